@@ -1,54 +1,134 @@
 import traceback
+from collections import OrderedDict, deque
+from itertools import count
+from contextlib import asynccontextmanager, nullcontext
 from typing import Tuple
-from bleak import BleakClient, BleakScanner
+from bleak import BleakClient
 import colorsys
 import asyncio
 import logging
+import time
+
+from . import codec
+from .discovery import DiscoveryService
+from .metrics import LightMetrics
+from .connection import NoFreeSlotError
+from .health import CircuitBreaker, LightUnavailableError
+from .trace import TraceReader, TracePlayer
+from .scheduler import PRIORITY_INTERACTIVE, PRIORITY_POWER, PRIORITY_FRAME, PRIORITY_POLL
+from .codec import (NEEWER_COMMAND_CCT, NEEWER_COMMAND_SCENE, NEEWER_COMMAND_BRIGHTNESS, NEEWER_COMMAND_COLOURTEMP,
+                    NEEWER_COMMAND_POWER, NEEWER_COMMAND_READ)
 
 # logging.basicConfig(level=logging.DEBUG)
 LOGGER = logging.getLogger("NeewerLight")
 LOGGER.setLevel(logging.WARN)
 
-NEEWER_SERVICE_UUID = "69400001-b5a3-f393-e0a9-e50e24dcca99"
 NEEWER_CONTROL_UUID = "69400002-b5a3-f393-e0a9-e50e24dcca99"
 NEEWER_READ_UUID = "69400003-b5a3-f393-e0a9-e50e24dcca99"
-# these commands are in the format 0x78 (prefix), <something>, length of data following, data, checksum
-NEEWER_POWER_ON = bytearray([0x78,0x81,0x01,0x01,0xFB])
-NEEWER_POWER_OFF = bytearray([0x78,0x81,0x01,0x02,0xFC])
-NEEWER_READ_REQUEST = bytearray([0x78,0x84,0x00,0xFC])
+# packet encoding and decoding lives in codec.py
+NEEWER_POWER_ON = codec.POWER_ON
+NEEWER_POWER_OFF = codec.POWER_OFF
+NEEWER_READ_REQUEST = codec.READ_REQUEST
 NEEWER_UPDATE_PREFIX = bytearray([0x78,0x01,0x01])
-NEEWER_COMMAND_PREFIX = 0x78
-NEEWER_COMMAND_RGB = 0x86
-NEEWER_COMMAND_CCT = 0x87
-NEEWER_COMMAND_SCENE = 0x88
-NEEWER_COMMAND_BRIGHTNESS = 0x82
-NEEWER_COMMAND_COLOURTEMP = 0x83
+
+# outgoing commands are queued per light in a slot keyed by their class. Coalesced classes keep only the latest
+# unsent frame (a newer colour replaces an older one), every other class is queued in order and never dropped
+COMMAND_CLASS_COLOUR = "colour"
+COMMAND_CLASS_SCENE = "scene"
+COMMAND_CLASS_POWER = "power"
+COMMAND_CLASS_READ = "read"
+COALESCED_COMMAND_CLASSES = frozenset([COMMAND_CLASS_COLOUR, COMMAND_CLASS_SCENE])
+# colour and scene frames are sent as write-without-response, as they always were, while power and read requests are
+# acknowledged. In streaming mode every STREAM_WINDOW colour frames (and before any other command class) an
+# acknowledged write is sent instead, which can't complete until the light has taken the frames before it, so at most
+# STREAM_WINDOW frames are ever in flight
+UNACKNOWLEDGED_COMMAND_CLASSES = frozenset([COMMAND_CLASS_COLOUR, COMMAND_CLASS_SCENE])
+STREAMED_COMMAND_CLASSES = frozenset([COMMAND_CLASS_COLOUR])
+STREAM_WINDOW = 8
+# a colour and a scene each replace whatever mode the light was in, so queueing one drops an unsent one of the other
+SUPERSEDED_COMMAND_CLASSES = {COMMAND_CLASS_COLOUR: COMMAND_CLASS_SCENE, COMMAND_CLASS_SCENE: COMMAND_CLASS_COLOUR}
+# the adapter's scheduler.CommandScheduler priority of each class, unless the command says otherwise (transition frames)
+COMMAND_CLASS_PRIORITIES = {COMMAND_CLASS_COLOUR: PRIORITY_INTERACTIVE, COMMAND_CLASS_SCENE: PRIORITY_INTERACTIVE,
+                            COMMAND_CLASS_POWER: PRIORITY_POWER, COMMAND_CLASS_READ: PRIORITY_POLL}
+
+# animations the light runs itself from a single 0x88 packet, name -> scene number
+NEEWER_SCENES = {
+    "Police": 1,
+    "Police (steady)": 2,
+    "Ambulance": 3,
+    "Party": 4,
+    "Party (fast)": 5,
+    "Candlelight": 6,
+    "Lightning": 7,
+    "Lightning 2": 8,
+    "Lightning 3": 9,
+}
+NEEWER_SCENE_NAMES = {number: name for name, number in NEEWER_SCENES.items()}
+
+# white (CCT) mode colour temperature range in kelvin, the packets carry kelvin / 100
+NEEWER_MIN_TEMPERATURE = 3200
+NEEWER_MAX_TEMPERATURE = 5600
+
+COLOUR_MODE_RGB = "rgb"
+COLOUR_MODE_WHITE = "white"
+
+CONNECT_TIMEOUT = 5.0
+READ_CONNECT_TIMEOUT = 10.0
+READ_TIMEOUT = 10.0
 
 def hexPrint(l):
     print('['+(', '.join(hex(x) for x in l))+"]")
 
-def create_status_callback(future: asyncio.Future):
-    def callback(sender: int, data: bytearray):
-        if not future.done():
-            future.set_result(data)
-    return callback
-
 class NeewerLight:
 
-    def __init__(self, device, controlCharacteristic = NEEWER_CONTROL_UUID, readCharacteristic = NEEWER_READ_UUID):
+    def __init__(self, device, controlCharacteristic = NEEWER_CONTROL_UUID, readCharacteristic = NEEWER_READ_UUID, streaming = False,
+                 connectionManager = None, idleTimeout = None, discovery = None, clientFactory = BleakClient, pollInterval = None,
+                 adapter = None):
         LOGGER.debug("New device: %s",str(device))
-        self.device = BleakClient(device, use_cached=False)
+        self._clientFactory = clientFactory # anything constructed like BleakClient, e.g. benchmarks/simulator.py
+        self.pinnedAdapter = adapter # e.g. "hci1", None lets an adapters.AdapterPool choose
+        self.adapter = adapter # the adapter the client connects through, None for bleak's default
+        self._notifying = False # the read characteristic is subscribed once per connection
+        self._clientTarget = device
+        self._device = None # the BleakClient, only created once something needs it (see device)
+        self._discovery = discovery # discovery.DiscoveryService, optional, used to connect without bleak scanning first
+        self._connections = connectionManager # connection.ConnectionManager shared between lights, optional
+        self.idleTimeout = idleTimeout # seconds, None uses the connection manager's default
+        self.pollInterval = pollInterval # seconds, None uses the poll scheduler's default, 0 never polls
+        self._stateUpdated = None # monotonic time the cached state was last confirmed by a write or notification
+        self._holdCount = 0
+        self.metrics = LightMetrics()
+        self.health = CircuitBreaker()
+        self._healthListeners = []
+        self._recorders = [] # trace.TraceRecorders capturing every packet sent
+        self._probeTask = None
+        self._deferredCommand = None # latest colour/scene discarded while the circuit was open, sent once it closes
+        self._pendingRequests = {} # opcode of the expected notification -> futures waiting for it, oldest first
+        self._writing = False
         self.controlGATT = controlCharacteristic
         self.readGATT = readCharacteristic
         self._isPoweredOn = False
         self._mac = device
         self._rgbColor = (0,0,0)
         self._brightness = 0
+        self._scene = None # scene number while the light is running one of its own animations
+        self._colourMode = COLOUR_MODE_RGB
+        self._colourTemp = NEEWER_MAX_TEMPERATURE # kelvin
+        self._pendingCommands = OrderedDict() # slot key -> (characteristic, data, future, priority)
+        self._commandSequence = count()
+        self._writerTask = None
+        self._writeCounters = {"queued": 0, "sent": 0, "coalesced": 0, "abandoned": 0, "failed": 0, "unacknowledged": 0}
+        self._streaming = streaming
+        self._inFlight = 0 # unacknowledged writes since the last acknowledged one
 
     @property
     def mac(self):
         return self._mac
 
+    @property
+    def address(self):
+        return getattr(self._mac, "address", self._mac)
+
     @property
     def is_on(self):
         return self._isPoweredOn
@@ -61,28 +141,353 @@ class NeewerLight:
     def brightness(self):
         return self._brightness
 
-    async def _write(self, characteristic, data):
+    @property
+    def colour_mode(self):
+        """COLOUR_MODE_RGB or COLOUR_MODE_WHITE, whichever the last colour command used"""
+        return self._colourMode
+
+    @property
+    def colour_temp(self):
+        """Kelvin"""
+        return self._colourTemp
+
+    @property
+    def effect(self):
+        """Name of the scene the light is running, None in colour mode"""
+        return NEEWER_SCENE_NAMES.get(self._scene)
+
+    @property
+    def streaming(self):
+        return self._streaming
+
+    @property
+    def write_counters(self):
+        return dict(self._writeCounters)
+
+    @property
+    def available(self):
+        """False while the circuit is open, i.e. the light is unreachable and commands aren't attempted"""
+        return not self.health.isOpen
+
+    def addHealthListener(self, listener):
+        """listener() is called whenever the health state changes. Returns a function that removes it again"""
+        self._healthListeners.append(listener)
+        return lambda: self._healthListeners.remove(listener)
+
+    def addRecorder(self, recorder):
+        """Record every packet written to the light into a trace.TraceRecorder. Returns a function that stops it again"""
+        self._recorders.append(recorder)
+        return lambda: self._recorders.remove(recorder)
+
+    @property
+    def stateAge(self):
+        """Seconds since a command was written or a notification arrived, infinite if never"""
+        return time.monotonic() - self._stateUpdated if self._stateUpdated is not None else float("inf")
+
+    @property
+    def isBusy(self):
+        """True while commands are queued or the connection is held, so the connection manager won't evict it"""
+        return self._holdCount > 0 or self._writing or bool(self._pendingCommands)
+
+    @property
+    def device(self):
+        """The BleakClient, created on first use so setting up many lights doesn't build a client for each one"""
+        if self._device is None:
+            self._device = self._createClient(self._clientTarget)
+        return self._device
+
+    @property
+    def isConnected(self):
+        """Like device.is_connected, but doesn't create the client just to ask"""
+        return self._device is not None and self._device.is_connected
+
+    def _createClient(self, target):
+        self._clientTarget = target
+        self._notifying = False
+        if self.adapter is None:
+            return self._clientFactory(target, use_cached=True, disconnected_callback=self._onDisconnected)
+        return self._clientFactory(target, use_cached=True, disconnected_callback=self._onDisconnected, adapter=self.adapter)
+
+    def useAdapter(self, adapter):
+        """Connect through another adapter from the next connect on. The connection manager disconnects it first"""
+        if adapter == self.adapter:
+            return
+        self.adapter = adapter
+        # a BLEDevice is tied to the adapter that saw it advertise, so use the one the new adapter heard. Only without
+        # one does the client start from the address, and bleak scans for it
+        bleDevice = self._discovery.cached(self.address, adapter) if self._discovery is not None else None
+        self._clientTarget = bleDevice if bleDevice is not None else self.address
+        self._device = None
+
+    def _resolveDevice(self):
+        # a BleakClient made from just an address scans for the device on every connect, one made from a recently
+        # advertised BLEDevice connects straight away
+        if self._discovery is None or self.isConnected:
+            return
+        bleDevice = self._discovery.cached(self.address, self.adapter)
+        if bleDevice is not None and bleDevice is not self._clientTarget:
+            self._device = self._createClient(bleDevice)
+
+    async def connect(self, timeout=CONNECT_TIMEOUT, probe=False, slotTimeout=None):
+        """Raises LightUnavailableError straight away while the circuit is open, unless this is the background probe.
+        slotTimeout limits the wait for a connection slot, see ConnectionManager.acquire"""
+        self._resolveDevice()
+        wasConnected = self.isConnected
+        if not wasConnected and not probe:
+            if self.health.isOpen:
+                self.health.stats["rejected"] += 1
+                raise LightUnavailableError(str(self._mac)+" is unavailable, retrying in %.0fs" % self.health.retryIn)
+            if self.health.retryIn > 0:
+                await asyncio.sleep(self.health.retryIn) # back off between reconnects
+        start = time.monotonic()
+        try:
+            if self._connections is not None:
+                await self._connections.acquire(self, timeout, slotTimeout)
+            elif not wasConnected:
+                await self.device.connect(timeout=timeout)
+            if not wasConnected:
+                self.metrics.recordConnect(time.monotonic() - start)
+            if not self._notifying:
+                await self.device.start_notify(self.readGATT, self._onNotification)
+                self._notifying = True
+        except NoFreeSlotError:
+            raise # the adapter was busy, not the light's fault
+        except Exception as error:
+            self._recordFailure(error)
+            raise
+        if self.health.failures:
+            self._recordSuccess()
+
+    def _recordFailure(self, error):
+        changed = self.health.recordFailure(error)
+        LOGGER.debug("%s: failure %d (%s), backing off %.1fs",self._mac,self.health.failures,error,self.health.backoff)
+        if self.health.isOpen and (self._probeTask is None or self._probeTask.done()):
+            LOGGER.warning("%s is unreachable, probing in the background: %s",self._mac,error)
+            self._probeTask = asyncio.ensure_future(self._probe())
+        if changed:
+            self._notifyHealth()
+
+    def _recordSuccess(self):
+        wasOpen = self.health.isOpen
+        if self.health.recordSuccess():
+            self._notifyHealth()
+        if wasOpen and self._deferredCommand is not None:
+            LOGGER.info("%s is reachable again, sending the latest discarded command",self._mac)
+            asyncio.ensure_future(self._replayDeferred())
+
+    def _notifyHealth(self):
+        for listener in list(self._healthListeners):
+            listener()
+
+    async def _probe(self):
+        while self.health.isOpen:
+            await asyncio.sleep(self.health.retryIn)
+            try:
+                await self.connect(CONNECT_TIMEOUT, probe=True)
+            except Exception as error:
+                LOGGER.debug("%s: probe failed: %s",self._mac,error)
+
+    async def _replayDeferred(self):
+        deferred, self._deferredCommand = self._deferredCommand, None
+        if deferred is None:
+            return
+        try:
+            await self._write(*deferred)
+        except Exception as error:
+            LOGGER.debug("%s: resending the discarded command failed: %s",self._mac,error)
+
+    def _onDisconnected(self, client):
+        LOGGER.debug("%s disconnected",self._mac)
+        self._notifying = False
+        self._inFlight = 0
+
+    def _onNotification(self, sender, data):
+        try:
+            status = codec.decode(data)
+        except ValueError as error:
+            LOGGER.warning("%s: ignoring notification: %s",self._mac,error)
+            return
+        self._applyStatus(status)
+        self._stateUpdated = time.monotonic()
+
+        # notifications nobody asked for (or that arrive after their request timed out) only update the cached state
+        waiting = self._pendingRequests.get(data[1])
+        while waiting:
+            future = waiting.popleft()
+            if not future.done():
+                future.set_result(status)
+                break
+
+    async def request(self, data, responseOpcode, timeout=READ_TIMEOUT):
+        """Write a request and wait for the notification answering it, returning the decoded status"""
+        await self.connect(READ_CONNECT_TIMEOUT)
+        future = asyncio.get_event_loop().create_future()
+        waiting = self._pendingRequests.setdefault(responseOpcode, deque())
+        waiting.append(future)
+        self._holdCount += 1
+        start = time.monotonic()
+        try:
+            await self._write(self.controlGATT, data, COMMAND_CLASS_READ)
+            status = await asyncio.wait_for(future, timeout)
+            self.metrics.read.record(time.monotonic() - start)
+            return status
+        except Exception:
+            self.metrics.readFailures += 1
+            raise
+        finally:
+            if future in waiting:
+                waiting.remove(future)
+            self._holdCount -= 1
+            await self._released()
+
+    @asynccontextmanager
+    async def keepConnected(self, timeout=CONNECT_TIMEOUT, slotTimeout=None, required=False):
+        """Connect ahead of time (e.g. before a transition) and stay connected until the block exits. A failed connect
+        is only logged, the commands sent inside the block will retry it, unless required: then it's raised"""
+        self._holdCount += 1
+        try:
+            try:
+                await self.connect(timeout, slotTimeout=slotTimeout)
+            except Exception as error:
+                if required:
+                    raise
+                LOGGER.warning("%s: unable to connect ahead of time: %s",self._mac,error)
+            yield self
+        finally:
+            self._holdCount -= 1
+            await self._released()
+
+    async def _write(self, characteristic, data, commandClass=COMMAND_CLASS_POWER, priority=None):
+        """Queue a command and wait until it's written. Returns False if a newer command of the same class replaced it, or if
+        the circuit is open and it was kept to send once the light is back. Other commands raise LightUnavailableError.
+        priority overrides the class's scheduler priority"""
+        return await self._queue(characteristic, data, commandClass, priority)
+
+    def _queue(self, characteristic, data, commandClass, priority=None) -> asyncio.Future:
+        # the queueing half of _write, for callers that shouldn't need a task per command to wait on it
+        future = asyncio.get_event_loop().create_future()
+        if self.health.isOpen:
+            self.health.stats["rejected"] += 1
+            if commandClass in COALESCED_COMMAND_CLASSES:
+                self._deferredCommand = (characteristic, data, commandClass)
+                future.set_result(False)
+                return future
+            raise LightUnavailableError(str(self._mac)+" is unavailable")
+        self._writeCounters["queued"] += 1
+        if commandClass in COALESCED_COMMAND_CLASSES:
+            key = commandClass
+            for replacedKey in (key, SUPERSEDED_COMMAND_CLASSES.get(key)):
+                replaced = self._pendingCommands.pop(replacedKey, None)
+                if replaced is not None:
+                    self._writeCounters["coalesced"] += 1
+                    if not replaced[2].done():
+                        replaced[2].set_result(False)
+        else:
+            key = (commandClass, next(self._commandSequence))
+        self._pendingCommands[key] = (characteristic, data, future,
+                                      COMMAND_CLASS_PRIORITIES[commandClass] if priority is None else priority)
+
+        if self._writerTask is None or self._writerTask.done():
+            self._writerTask = asyncio.ensure_future(self._drainCommands())
+        return future
+
+    async def _drainCommands(self):
+        # writes are awaited one at a time per light, so a queued frame waits for at most one BLE write
+        self._writing = True
+        try:
+            while self._pendingCommands:
+                key = self._nextCommand()
+                characteristic, data, future, priority = self._pendingCommands.pop(key)
+                commandClass = key if isinstance(key, str) else key[0]
+                if future.cancelled():
+                    # whoever queued it stopped waiting (e.g. a light dropped from a group transition), so it's stale
+                    self._writeCounters["abandoned"] += 1
+                    continue
+                try:
+                    await self._sendCommand(characteristic, data, self._needsResponse(commandClass), priority)
+                except LightUnavailableError as error:
+                    # the circuit opened while this was queued
+                    self._writeCounters["failed"] += 1
+                    if not future.done():
+                        if commandClass in COALESCED_COMMAND_CLASSES:
+                            self._deferredCommand = (characteristic, data, commandClass)
+                            future.set_result(False)
+                        else:
+                            future.set_exception(error)
+                    continue
+                except Exception as error:
+                    self._writeCounters["failed"] += 1
+                    if not future.done():
+                        future.set_exception(error)
+                    continue
+                self._writeCounters["sent"] += 1
+                if commandClass != COMMAND_CLASS_READ:
+                    self._stateUpdated = time.monotonic()
+                    for recorder in self._recorders:
+                        recorder.record(self.address, data)
+                if not future.done():
+                    future.set_result(True)
+        finally:
+            self._writing = False
+        await self._released()
+
+    def _nextCommand(self):
+        # oldest first, except that a status read waits behind everything else: it changes nothing on the light, so
+        # sending it later can't reorder what the light shows
+        for key, command in self._pendingCommands.items():
+            if command[3] != PRIORITY_POLL:
+                return key
+        return next(iter(self._pendingCommands))
+
+    async def _released(self):
+        if self._connections is not None and not self._holdCount and not self._pendingCommands:
+            await self._connections.idle(self)
+
+    def _needsResponse(self, commandClass):
+        if not self._streaming:
+            return commandClass not in UNACKNOWLEDGED_COMMAND_CLASSES
+        if commandClass not in STREAMED_COMMAND_CLASSES:
+            return True
+        return self._inFlight >= STREAM_WINDOW
+
+    def _writeSlot(self, priority):
+        if self._connections is None:
+            return nullcontext()
+        return self._connections.schedulerFor(self).slot(self, priority)
+
+    async def _sendCommand(self, characteristic, data, response=True, priority=PRIORITY_INTERACTIVE):
         # LOGGER.debug("Writing: "+(''.join(format(x, ' 03x') for x in data))+" to "+characteristic)
-        #try:
-        if not self.device.is_connected:
-            await self.device.connect(timeout=5.0)
-        await self.device.write_gatt_char(characteristic, data)
-        #except Exception:
+        if not self.isConnected:
+            self._inFlight = 0
+        await self.connect(CONNECT_TIMEOUT)
+        # waiting for the adapter isn't part of the write's latency
+        async with self._writeSlot(priority):
+            start = time.monotonic()
+            try:
+                await self.device.write_gatt_char(characteristic, data, response=response)
+            except Exception as error:
+                self._recordFailure(error)
+                raise
+            self.metrics.write.record(time.monotonic() - start)
+        if self.health.failures:
+            self._recordSuccess()
+        if response:
+            self._inFlight = 0
+        else:
+            self._inFlight += 1
+            self._writeCounters["unacknowledged"] += 1
 
 
     def composeCommand(self, tag, vals):
-        length = len(vals)
-        command = [NEEWER_COMMAND_PREFIX]
-        command.append(tag)
-        command.append(length)
-        command.extend(vals)
-        return bytearray(NeewerLight.appendChecksum(command))
+        return codec.encode(tag, vals)
 
     async def set_color(self, rgb: Tuple[int,int,int], brightness = None):
-        LOGGER.info(str(self._mac)+": Set colour: "+str(rgb)+","+str(brightness))
+        LOGGER.info("%s: Set colour: %s,%s",self._mac,rgb,brightness)
         # rgb 0-255, brightness 0-255
         r, g, b = rgb
         self._rgbColor = (r,g,b) # TODO temporary as we don't read the color back from the light at the moment
+        self._scene = None
+        self._colourMode = COLOUR_MODE_RGB
         h,s,v = colorsys.rgb_to_hsv(r/255.0,g/255.0,b/255.0)
         h = int(h*360)
         s = int(s*100)
@@ -92,12 +497,126 @@ class NeewerLight:
             v = int(brightness*100/256)
             # LOGGER.info("Brightness overwrite: "+str(v))
             self._brightness = brightness # TODO temporary as we don't read the color back from the light at the moment
-        cmd = self.composeCommand(NEEWER_COMMAND_RGB, [h&0xFF,(h>>8)&0xFF,s&0xff,v&0xff])
-        await self._write(NEEWER_CONTROL_UUID, cmd)
-
-    async def set_white(self, intensity: int):
-        # brightness 0-100
-        await self.set_color((255,255,255),intensity)
+        return await self._write(NEEWER_CONTROL_UUID, codec.encodeHsi(h, s, v), COMMAND_CLASS_COLOUR)
+
+    async def set_color_packet(self, packet: bytes, rgb: Tuple[int,int,int], brightness: int):
+        """Send an already encoded RGB packet (see planner.py) for the given colour, skipping the HSV conversion. The
+        cached state only follows once the packet is sent, not if it's replaced or abandoned first"""
+        written = await self._write(self.controlGATT, packet, COMMAND_CLASS_COLOUR, PRIORITY_FRAME)
+        if written:
+            self.assume_color(rgb, brightness)
+        return written
+
+    def assume_color(self, rgb: Tuple[int,int,int], brightness: int):
+        """Record a colour the light is already showing without writing anything"""
+        self._rgbColor = tuple(rgb)
+        self._brightness = brightness
+        self._scene = None
+        self._colourMode = COLOUR_MODE_RGB
+
+    async def set_white(self, brightness: int, temperature = None):
+        """True white in CCT mode rather than RGB (255,255,255). brightness 0-255, temperature in kelvin (default the
+        last one used)"""
+        LOGGER.info("%s: Set white: %s,%s",self._mac,brightness,temperature)
+        if temperature is None:
+            temperature = self._colourTemp
+        temperature = min(max(int(temperature), NEEWER_MIN_TEMPERATURE), NEEWER_MAX_TEMPERATURE)
+        self.assume_white(temperature, brightness)
+        return await self._write(self.controlGATT, codec.encodeCct(int(brightness*100/256), temperature//100), COMMAND_CLASS_COLOUR)
+
+    async def set_white_packet(self, packet: bytes, temperature: int, brightness: int):
+        """Send an already encoded 0x82/0x83/0x87 packet (see planner.planWhiteTransition). Like set_color_packet, the
+        cached state only follows once it's sent"""
+        written = await self._writeWhite(packet, temperature, brightness, PRIORITY_FRAME)
+        if written:
+            self.assume_white(temperature, brightness)
+        return written
+
+    async def _writeWhite(self, packet, temperature, brightness, priority=PRIORITY_INTERACTIVE):
+        # 0x82 and 0x83 only carry half the white state, so if they would replace an unsent colour command (which may be
+        # the 0x87 that switched the light to white) the full 0x87 for the new state is queued instead
+        if COMMAND_CLASS_COLOUR in self._pendingCommands and packet[1] != NEEWER_COMMAND_CCT:
+            packet = codec.encodeCct(int(brightness*100/256), temperature//100)
+        return await self._write(self.controlGATT, packet, COMMAND_CLASS_COLOUR, priority)
+
+    async def send_packet(self, packet: bytes):
+        """Write an already encoded packet, e.g. one replayed from a trace, queued by its opcode. The cached state isn't
+        touched, use assume_packet once the packets are done"""
+        return await self.queue_packet(packet)
+
+    def queue_packet(self, packet: bytes) -> asyncio.Future:
+        """send_packet without waiting: returns a future resolving to what send_packet would return"""
+        opcode = packet[1]
+        if opcode == NEEWER_COMMAND_POWER:
+            commandClass = COMMAND_CLASS_POWER
+        elif opcode == NEEWER_COMMAND_SCENE:
+            commandClass = COMMAND_CLASS_SCENE
+        elif opcode == NEEWER_COMMAND_READ:
+            commandClass = COMMAND_CLASS_READ
+        else:
+            commandClass = COMMAND_CLASS_COLOUR
+            packet = self._completeWhitePacket(packet)
+        return self._queue(self.controlGATT, packet, commandClass, PRIORITY_FRAME if commandClass in COALESCED_COMMAND_CLASSES else None)
+
+    def _completeWhitePacket(self, packet):
+        # like _writeWhite, but for packets the cached state doesn't follow (a replayed trace): a 0x82 or 0x83 replacing
+        # an unsent 0x87 is merged into it, so the switch to white mode isn't lost
+        pending = self._pendingCommands.get(COMMAND_CLASS_COLOUR)
+        if pending is None or pending[1][1] != NEEWER_COMMAND_CCT:
+            return packet
+        brightness, temperature = pending[1][3], pending[1][4]
+        if packet[1] == NEEWER_COMMAND_BRIGHTNESS:
+            return codec.encodeCct(packet[3], temperature)
+        if packet[1] == NEEWER_COMMAND_COLOURTEMP:
+            return codec.encodeCct(brightness, packet[3])
+        return packet
+
+    def assume_packet(self, packet: bytes):
+        """Update the cached state as if the light had just been sent packet"""
+        status = codec.decode(packet)
+        if isinstance(status, codec.HsiStatus):
+            self._isPoweredOn = True
+        self._applyStatus(status)
+
+    async def playTrace(self, path, timeScale=1.0):
+        """Replay a trace.TraceRecorder file to this light. A trace of a single light plays whatever light it was recorded
+        from, otherwise only this light's packets are played. Returns the playback stats"""
+        with TraceReader(path) as trace:
+            addresses = trace.addresses if len(trace.addresses) == 1 else [self.address]
+            player = TracePlayer(trace, {address: self for address in addresses}, timeScale)
+            async with self.keepConnected():
+                return await player.run()
+
+    def restore_state(self, isOn: bool, rgb: Tuple[int,int,int] = None, brightness: int = None, temperature: int = None,
+                      effect: str = None, colourMode: str = None):
+        """Start from state saved before a restart instead of off and black. Nothing is written and the state still
+        counts as stale, so the poll scheduler reads the real state when its turn comes"""
+        self._isPoweredOn = isOn
+        if rgb is not None:
+            self._rgbColor = tuple(rgb)
+        if brightness is not None:
+            self._brightness = brightness
+        if temperature is not None:
+            self._colourTemp = min(max(int(temperature), NEEWER_MIN_TEMPERATURE), NEEWER_MAX_TEMPERATURE)
+        if colourMode is not None:
+            self._colourMode = colourMode
+        self._scene = NEEWER_SCENES.get(effect)
+
+    def assume_white(self, temperature: int, brightness: int):
+        self._colourTemp = temperature
+        self._brightness = brightness
+        self._scene = None
+        self._colourMode = COLOUR_MODE_WHITE
+
+    async def set_brightness(self, brightness: int):
+        """Change only the brightness (0-255) in whatever mode the light is in. In white mode that's a 5 byte 0x82
+        packet, the other modes have no brightness only command so their colour/scene is resent"""
+        if self._scene is not None:
+            return await self.set_effect(self.effect, brightness)
+        if self._colourMode == COLOUR_MODE_WHITE:
+            self._brightness = brightness
+            return await self._writeWhite(codec.encodeBrightness(int(brightness*100/256)), self._colourTemp, brightness)
+        return await self.set_color(self._rgbColor, brightness)
 
     async def turn_on(self):
         await self.powerOn()
@@ -114,59 +633,84 @@ class NeewerLight:
             LOGGER.debug(track)
 
     async def disconnect(self):
-        if self.device.is_connected:
+        if self._writerTask is not None and not self._writerTask.done():
+            self._writerTask.cancel()
+        if self._probeTask is not None and not self._probeTask.done():
+            self._probeTask.cancel()
+        for _, _, future, _ in self._pendingCommands.values():
+            if not future.done():
+                future.cancel()
+        self._pendingCommands.clear()
+        if self._connections is not None:
+            await self._connections.release(self)
+        elif self.isConnected:
             await self.device.disconnect()
 
     async def powerOn(self):
-        LOGGER.debug(str(self._mac)+" Sending power on")
-        await self._write(self.controlGATT, NEEWER_POWER_ON)
+        LOGGER.debug("%s Sending power on",self._mac)
+        await self._write(self.controlGATT, NEEWER_POWER_ON, COMMAND_CLASS_POWER)
         self._isPoweredOn = True
 
     async def powerOff(self):
-        LOGGER.debug(str(self._mac)+" Sending power off")
-        await self._write(self.controlGATT, NEEWER_POWER_OFF)
+        LOGGER.debug("%s Sending power off",self._mac)
+        await self._write(self.controlGATT, NEEWER_POWER_OFF, COMMAND_CLASS_POWER)
         self._isPoweredOn = False
 
     async def sendReadRequest(self):
         LOGGER.debug("Sending read request")
-        await self._write(self.controlGATT, NEEWER_READ_REQUEST)
+        await self._write(self.controlGATT, NEEWER_READ_REQUEST, COMMAND_CLASS_READ)
 
     async def setScene(self, scene, brightness=100):
         # scene 1-9, brightness 0-100
         # 1: police sirens, 2: police siren but stuck?, 3: ambulance?, 4: party mode A, 5: party mode B (A but faster), 6: party mode C (candlelight), 7-9: lightning
-        await self._write(self.controlGATT, self.composeCommand(NEEWER_COMMAND_SCENE, [brightness&0xff,scene&0x0f]))
+        self._scene = scene
+        self._isPoweredOn = True
+        return await self._write(self.controlGATT, codec.encodeScene(scene, brightness), COMMAND_CLASS_SCENE)
+
+    async def set_effect(self, effect: str, brightness = None):
+        """Start one of NEEWER_SCENES, brightness 0-255 like set_color. Sending a colour afterwards ends it"""
+        LOGGER.info("%s: Set effect: %s,%s",self._mac,effect,brightness)
+        if brightness is not None:
+            self._brightness = brightness
+        return await self.setScene(NEEWER_SCENES[effect], int(self._brightness*100/256))
 
     async def readStatus(self):
-        if not self.device.is_connected:
-            await self.device.connect(timeout=10.0)
-            # check characteristics
+        # the notification has already been applied to the cached state by the time this returns
+        status = await self.request(NEEWER_READ_REQUEST, codec.NEEWER_STATUS_POWER)
+        LOGGER.info("Read status: %s",status)
+        return status
 
-        future = asyncio.get_event_loop().create_future()
-        await self.device.start_notify(self.readGATT, create_status_callback(future))
-        await self.device.write_gatt_char(self.controlGATT, NEEWER_READ_REQUEST)
-
-        await asyncio.wait_for(future, 10.0)
-        await self.device.stop_notify(self.readGATT)
-
-        res = future.result()
-        if res[0]==NEEWER_UPDATE_PREFIX[0] and res[1]==NEEWER_UPDATE_PREFIX[1] and res[2]==NEEWER_UPDATE_PREFIX[2]:
-            LOGGER.info("Update prefix")
-        LOGGER.info("Read data: %s",str(res))
-        hexPrint(res)
-        #TODO: validate checksum?
+    def _applyStatus(self, status):
         #TODO: don't actually know what RGB values return, it's not in the swift implementation
-
-
-        # self.device.start_notify(self.readGATT, )
+        if isinstance(status, codec.PowerStatus):
+            self._isPoweredOn = status.on
+        elif isinstance(status, codec.HsiStatus):
+            r, g, b = colorsys.hsv_to_rgb(status.hue/360.0, status.saturation/100.0, 1.0)
+            self._rgbColor = (int(r*255), int(g*255), int(b*255))
+            self._brightness = min(round(status.intensity*256/100), 255)
+            self._scene = None
+            self._colourMode = COLOUR_MODE_RGB
+        elif isinstance(status, codec.SceneStatus):
+            self._scene = status.scene
+            self._brightness = min(round(status.brightness*256/100), 255)
+        elif isinstance(status, codec.CctStatus):
+            self._brightness = min(round(status.brightness*256/100), 255)
+            self._colourTemp = status.temperature*100
+            self._scene = None
+            self._colourMode = COLOUR_MODE_WHITE
+        elif isinstance(status, codec.BrightnessStatus):
+            self._brightness = min(round(status.brightness*256/100), 255)
+        elif isinstance(status, codec.ColourTempStatus):
+            self._colourTemp = status.temperature*100
+        else:
+            LOGGER.debug("Ignoring status: %s",status)
 
     @classmethod
-    async def discover(cls):
+    async def discover(cls, discovery: DiscoveryService = None):
         """Disover BLE devices, specifically the Neewer lights"""
-        LOGGER.debug("Discovering devices...")
-        devices = await BleakScanner.discover()
-        LOGGER.debug("Discovered devices: %s", [{"address": device.address, "name": device.name} for device in devices])
-        return [device for device in devices if
-                device.name is not None and (device.name.lower().startswith("neewer") or device.name.lower().startswith("laurie"))]
+        if discovery is None:
+            discovery = DiscoveryService()
+        return await discovery.discover()
 
     @classmethod
     def appendChecksum(cls, data: list):
@@ -178,25 +722,5 @@ class NeewerLight:
 
     @classmethod
     def validateChecksum(cls, data: list):
-        length = len(data)
-        if length<2:
-            return False
+        return codec.validateChecksum(data)
 
-        checksum = 0
-        for i in range(length-1):
-            checksum += data[i]
-        if checksum == data[length-1]:
-            return True
-        return False
-
-
-# async def main():
-#     devices = await NeewerLight.discover()
-#     if len(devices):
-#         d = NeewerLight(devices[0])
-#         # await d.init()
-#         # input("Pause")
-#         await d.set_color((255,127,0))
-#         print("done")
-#
-# asyncio.run(main())
@@ -1,25 +1,126 @@
 from __future__ import annotations
 
-from homeassistant.config_entries import ConfigEntry
-from homeassistant.core import HomeAssistant
-from homeassistant.const import CONF_MAC
+try:
+    from homeassistant.config_entries import ConfigEntry
+    from homeassistant.core import HomeAssistant
+    from homeassistant.const import CONF_MAC
+except ImportError: # running standalone, e.g. python -m neewerlight
+    ConfigEntry = HomeAssistant = None
+    CONF_MAC = "mac"
 
 from .NeewerLight import NeewerLight
+from .adapters import AdapterPool, AUTO_ADAPTER, localAdapters
+from .connection import DEFAULT_IDLE_TIMEOUT
+from .discovery import DiscoveryService
+from .poller import PollScheduler, DEFAULT_POLL_INTERVAL, DEFAULT_STARTUP_DELAY
+from .worker import BleWorker
 
 DOMAIN = "neewerlight"
-PLATFORMS = ["light"]
+PLATFORMS = ["light", "sensor"]
+CONNECTIONS = "neewerlight_connections" # hass.data key for the AdapterPool (connection managers) shared by every light
+DISCOVERY = "neewerlight_discovery" # hass.data key for the DiscoveryService shared by every light and the config flow
+POLLER = "neewerlight_poller" # hass.data key for the PollScheduler reading the status of every light
+WORKER = "neewerlight_worker" # hass.data key for the BleWorker running lights set up with CONF_BLE_WORKER
+
+CONF_STREAMING = "streaming"
+CONF_IDLE_TIMEOUT = "idle_timeout"
+CONF_POLL_INTERVAL = "poll_interval"
+CONF_ADAPTER = "adapter"
+CONF_BLE_WORKER = "ble_worker"
+
+def entry_option(entry: ConfigEntry, key, default=None):
+    """Options set after setup override the value chosen when the entry was created"""
+    return entry.options.get(key, entry.data.get(key, default))
+
+def get_discovery(hass: HomeAssistant) -> DiscoveryService:
+    if DISCOVERY not in hass.data:
+        hass.data[DISCOVERY] = DiscoveryService(adapters=localAdapters())
+    return hass.data[DISCOVERY]
+
+def get_worker(hass: HomeAssistant, instance: NeewerLight) -> BleWorker | None:
+    """The BleWorker a light runs on, None if it runs on Home Assistant's loop"""
+    worker = hass.data.get(WORKER)
+    return worker if worker is not None and instance in worker.lights else None
+
+def light_services(hass: HomeAssistant, instance: NeewerLight) -> dict:
+    """Where the connection pool and poller a light uses are kept: its worker's data or hass.data"""
+    worker = get_worker(hass, instance)
+    return worker.data if worker is not None else hass.data
+
+def shared_connections(data: dict, discovery: DiscoveryService) -> AdapterPool:
+    """The AdapterPool shared by every light in data, created on first use. Call it on the loop that drives them"""
+    connections = data.get(CONNECTIONS)
+    if connections is None:
+        connections = data[CONNECTIONS] = AdapterPool(discovery=discovery)
+        connections.start()
+    return connections
+
+async def _async_createLight(data: dict, discovery: DiscoveryService, entry: ConfigEntry) -> NeewerLight:
+    """The light, and the services shared by every light in data, created on the loop that will drive them"""
+    connections = shared_connections(data, discovery)
+    if POLLER not in data:
+        # entities restore their last state, so nothing needs reading until startup has settled
+        data[POLLER] = PollScheduler(startupDelay=DEFAULT_STARTUP_DELAY)
+        data[POLLER].start()
+    adapter = entry_option(entry, CONF_ADAPTER, AUTO_ADAPTER)
+    return NeewerLight(entry.data[CONF_MAC], streaming=entry_option(entry, CONF_STREAMING, False),
+                       connectionManager=connections, idleTimeout=entry_option(entry, CONF_IDLE_TIMEOUT, DEFAULT_IDLE_TIMEOUT),
+                       discovery=discovery, pollInterval=entry_option(entry, CONF_POLL_INTERVAL, DEFAULT_POLL_INTERVAL),
+                       adapter=None if adapter == AUTO_ADAPTER else adapter)
+
+async def _async_createDiscovery() -> DiscoveryService:
+    return DiscoveryService(adapters=localAdapters())
+
+async def _async_unloadLight(data: dict, instance: NeewerLight):
+    await instance.disconnect()
+    if CONNECTIONS in data:
+        data[CONNECTIONS].forget(instance)
+
+async def _async_stopServices(data: dict):
+    if CONNECTIONS in data:
+        await data.pop(CONNECTIONS).stop()
+    if POLLER in data:
+        await data.pop(POLLER).stop()
 
 async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     """Set up Triones from a config entry."""
-    instance = NeewerLight(entry.data[CONF_MAC])
+    if entry_option(entry, CONF_BLE_WORKER, False):
+        # Bluetooth I/O and transitions on a thread of their own. The worker scans with its own discovery, as a
+        # scanner belongs to the loop that started it
+        worker = hass.data.get(WORKER)
+        if worker is None:
+            worker = hass.data[WORKER] = BleWorker()
+        worker.start()
+        if DISCOVERY not in worker.data:
+            worker.data[DISCOVERY] = await worker.run(_async_createDiscovery())
+        instance = await worker.run(_async_createLight(worker.data, worker.data[DISCOVERY], entry))
+        worker.lights.add(instance)
+    else:
+        instance = await _async_createLight(hass.data, get_discovery(hass), entry)
     hass.data.setdefault(DOMAIN, {})[entry.entry_id] = instance
     hass.config_entries.async_setup_platforms(entry, PLATFORMS)
+    entry.async_on_unload(entry.add_update_listener(async_reload_entry))
     return True
 
+async def async_reload_entry(hass: HomeAssistant, entry: ConfigEntry) -> None:
+    """Reload the light when its options change."""
+    await hass.config_entries.async_reload(entry.entry_id)
+
 async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     """Unload a config entry."""
     unload_ok = await hass.config_entries.async_unload_platforms(entry, PLATFORMS)
     if unload_ok:
         instance = hass.data[DOMAIN].pop(entry.entry_id)
-        await instance.disconnect()
+        worker = get_worker(hass, instance)
+        if worker is not None:
+            await worker.run(_async_unloadLight(worker.data, instance))
+            worker.lights.discard(instance)
+            if not worker.lights:
+                await worker.run(_async_stopServices(worker.data))
+                worker.data.pop(DISCOVERY, None)
+                await hass.data.pop(WORKER).stop()
+        else:
+            await _async_unloadLight(hass.data, instance)
+        if not any(get_worker(hass, light) is None for light in hass.data[DOMAIN].values()):
+            await _async_stopServices(hass.data)
     return unload_ok
\ No newline at end of file
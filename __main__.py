@@ -0,0 +1,79 @@
+"""python -m neewerlight --light desk=AA:BB:CC:DD:EE:FF [--light key=...] [--unix /tmp/neewerlight.sock] [--tcp 127.0.0.1:7540]
+
+Runs the control daemon (see daemon.py for the protocol) without Home Assistant. Lights can also be listed in a JSON
+config file: {"lights": {"desk": "AA:BB:CC:DD:EE:FF"}, "streaming": true, "max_connections": 7, "adapters": ["hci0"]}"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import signal
+
+from .daemon import ControlDaemon
+
+DEFAULT_SOCKET = "/tmp/neewerlight.sock"
+
+
+def parser():
+    parser = argparse.ArgumentParser(prog="python -m neewerlight", description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--light", action="append", default=[], metavar="NAME=MAC", help="a light to control, repeatable")
+    parser.add_argument("--config", help="JSON config file")
+    parser.add_argument("--unix", help="Unix socket path (default %s unless --tcp is given)" % DEFAULT_SOCKET)
+    parser.add_argument("--tcp", metavar="HOST:PORT", help="also (or only) listen on TCP")
+    parser.add_argument("--streaming", action="store_true", help="stream colour frames as write-without-response")
+    parser.add_argument("--max-connections", type=int, help="connection slots per adapter")
+    parser.add_argument("--adapter", action="append", dest="adapters", help="adapter to use (default every one), repeatable")
+    parser.add_argument("--verbose", action="store_true")
+    return parser
+
+
+def loadConfig(args):
+    config = {}
+    if args.config:
+        with open(args.config) as file:
+            config = json.load(file)
+    lights = dict(config.get("lights", {}))
+    for light in args.light:
+        name, separator, mac = light.partition("=")
+        if not separator:
+            raise SystemExit("--light takes NAME=MAC, not "+light)
+        lights[name] = mac
+    if not lights:
+        raise SystemExit("No lights configured, use --light NAME=MAC or --config")
+    return {
+        "lights": lights,
+        "streaming": args.streaming or config.get("streaming", False),
+        "maxConnections": args.max_connections or config.get("max_connections"),
+        "adapters": args.adapters or config.get("adapters"),
+    }
+
+
+async def run(args):
+    daemon = ControlDaemon(**loadConfig(args))
+    host, port = None, None
+    if args.tcp:
+        host, _, port = args.tcp.rpartition(":")
+        host, port = host or "127.0.0.1", int(port)
+    unixPath = args.unix or (None if args.tcp else DEFAULT_SOCKET)
+    if unixPath is not None and os.path.exists(unixPath):
+        os.unlink(unixPath) # left behind by a previous run
+    await daemon.start(unixPath, host, port)
+
+    stopping = asyncio.Event()
+    loop = asyncio.get_event_loop()
+    for signalNumber in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signalNumber, stopping.set)
+    await stopping.wait()
+    await daemon.stop()
+    if unixPath is not None and os.path.exists(unixPath):
+        os.unlink(unixPath)
+
+
+def main():
+    args = parser().parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO, format="%(asctime)s %(name)s %(message)s")
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
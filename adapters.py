@@ -0,0 +1,206 @@
+from collections import OrderedDict
+import asyncio
+import logging
+import os
+import time
+
+from .connection import ConnectionManager, NoFreeSlotError, DEFAULT_MAX_CONNECTIONS, DEFAULT_IDLE_TIMEOUT
+from .scheduler import CommandScheduler, DEFAULT_MAX_OUTSTANDING
+
+LOGGER = logging.getLogger("NeewerLightAdapters")
+LOGGER.setLevel(logging.WARN)
+
+ADAPTER_REFRESH_INTERVAL = 30.0 # seconds between checks for adapters being plugged in or removed
+LOAD_PENALTY = 20.0 # dB of RSSI an adapter with a full set of lights is worth giving up for an empty one
+UNKNOWN_RSSI = -90 # for adapters that haven't heard the light advertise
+AUTO_ADAPTER = "auto"
+
+
+def localAdapters():
+    """Names of the local Bluetooth adapters (hci0, hci1, ...). [None] (bleak's default adapter) where they can't be listed"""
+    try:
+        adapters = sorted(name for name in os.listdir("/sys/class/bluetooth") if name.startswith("hci") and ":" not in name)
+    except OSError:
+        adapters = []
+    return adapters or [None]
+
+
+class AdapterPool:
+    """Spreads lights over several Bluetooth adapters, each with its own ConnectionManager
+
+    Used in place of a ConnectionManager. Each light is assigned to the adapter that heard it loudest, less a penalty for
+    how many lights that adapter already has, unless it's pinned to one. A light that can't get a connection slot on its
+    adapter moves to one with a free slot, adapters holding more lights than they have slots hand their idle lights to
+    emptier ones, and the lights of an adapter that disappears are reassigned to the others."""
+
+    def __init__(self, adapters=None, maxConnections=DEFAULT_MAX_CONNECTIONS, idleTimeout=DEFAULT_IDLE_TIMEOUT,
+                 discovery=None, listAdapters=localAdapters, refreshInterval=ADAPTER_REFRESH_INTERVAL,
+                 maxOutstanding=DEFAULT_MAX_OUTSTANDING):
+        self.maxConnections = maxConnections # per adapter
+        self.idleTimeout = idleTimeout
+        self.maxOutstanding = maxOutstanding # writes on air at once, per adapter
+        self._discovery = discovery
+        self._listAdapters = listAdapters
+        self.refreshInterval = refreshInterval
+        self._managers = OrderedDict() # adapter name -> ConnectionManager
+        self._assigned = {} # light -> adapter name
+        self._refreshTask = None
+        self.stats = {"assignments": 0, "moves": 0, "adaptersLost": 0}
+        for adapter in (adapters if adapters is not None else listAdapters()):
+            self._addAdapter(adapter)
+
+    @property
+    def adapters(self):
+        return list(self._managers)
+
+    @property
+    def connected(self):
+        return [light for manager in self._managers.values() for light in manager.connected]
+
+    @property
+    def capacity(self):
+        """Lights that can be connected at once, over every adapter"""
+        return sum(manager.capacity for manager in self._managers.values())
+
+    def manager(self, adapter) -> ConnectionManager:
+        return self._managers[adapter]
+
+    def load(self, adapter):
+        return sum(1 for assigned in self._assigned.values() if assigned == adapter)
+
+    def adapterFor(self, light):
+        return self._assigned.get(light)
+
+    def _addAdapter(self, adapter):
+        manager = ConnectionManager(self.maxConnections, self.idleTimeout, self.maxOutstanding)
+        self._managers[adapter] = manager
+        if self._refreshTask is not None:
+            manager.start()
+
+    def _score(self, light, adapter):
+        rssi = UNKNOWN_RSSI
+        if self._discovery is not None:
+            rssi = self._discovery.rssiByAdapter(light.address).get(adapter, UNKNOWN_RSSI)
+        return rssi - LOAD_PENALTY * self.load(adapter) / self.maxConnections
+
+    def assign(self, light, exclude=()):
+        """Pick the light's adapter (its pinned one if that's present) and switch it over"""
+        pinned = light.pinnedAdapter
+        if pinned is not None and pinned in self._managers:
+            adapter = pinned
+        else:
+            if pinned is not None:
+                LOGGER.warning("%s is pinned to %s, which isn't present", light.mac, pinned)
+            candidates = [adapter for adapter in self._managers if adapter not in exclude] or list(self._managers)
+            self._assigned.pop(light, None) # its own assignment doesn't count against the adapter it's on
+            adapter = max(candidates, key=lambda adapter: self._score(light, adapter))
+        if self._assigned.get(light) != adapter:
+            self.stats["assignments"] += 1
+        self._assigned[light] = adapter
+        light.useAdapter(adapter)
+        return adapter
+
+    def forget(self, light):
+        self._assigned.pop(light, None)
+
+    def _managerFor(self, light):
+        adapter = self._assigned.get(light)
+        if adapter not in self._managers:
+            adapter = self.assign(light)
+        return self._managers[adapter]
+
+    def schedulerFor(self, light) -> CommandScheduler:
+        return self._managerFor(light).scheduler
+
+    def _freeAdapter(self, exclude):
+        free = [adapter for adapter, manager in self._managers.items() if adapter != exclude and manager.freeSlots]
+        return min(free, key=self.load, default=None)
+
+    async def _move(self, light, adapter):
+        LOGGER.info("Moving %s from %s to %s", light.mac, self._assigned.get(light), adapter)
+        old = self._managers.get(self._assigned.get(light))
+        if old is not None:
+            await old.release(light)
+        self._assigned[light] = adapter
+        light.useAdapter(adapter)
+        self.stats["moves"] += 1
+
+    async def acquire(self, light, timeout, slotTimeout=None):
+        deadline = time.monotonic() + timeout
+        manager = self._managerFor(light)
+        try:
+            await manager.acquire(light, timeout, slotTimeout)
+        except NoFreeSlotError:
+            # this adapter is saturated, use another one with room instead
+            alternative = None if light.pinnedAdapter in self._managers else self._freeAdapter(self._assigned[light])
+            if alternative is None:
+                raise
+            await self._move(light, alternative)
+            await self._managers[alternative].acquire(light, max(deadline - time.monotonic(), 1.0), slotTimeout)
+
+    async def idle(self, light):
+        manager = self._managers.get(self._assigned.get(light))
+        if manager is not None:
+            await manager.idle(light)
+
+    async def release(self, light):
+        manager = self._managers.get(self._assigned.get(light))
+        if manager is not None:
+            await manager.release(light)
+
+    def touch(self, light):
+        manager = self._managers.get(self._assigned.get(light))
+        if manager is not None:
+            manager.touch(light)
+
+    def start(self):
+        for manager in self._managers.values():
+            manager.start()
+        if self._refreshTask is None or self._refreshTask.done():
+            self._refreshTask = asyncio.ensure_future(self._refreshLoop())
+
+    async def stop(self):
+        if self._refreshTask is not None:
+            self._refreshTask.cancel()
+            self._refreshTask = None
+        for manager in self._managers.values():
+            await manager.stop()
+
+    async def _refreshLoop(self):
+        while True:
+            await asyncio.sleep(self.refreshInterval)
+            try:
+                await self.refresh()
+            except Exception as error:
+                LOGGER.warning("Error refreshing adapters: %s", error)
+
+    async def refresh(self):
+        """Pick up added and removed adapters, then rebalance"""
+        present = self._listAdapters()
+        for adapter in present:
+            if adapter not in self._managers:
+                LOGGER.info("Adapter %s appeared", adapter)
+                self._addAdapter(adapter)
+                for light in [light for light in self._assigned if light.pinnedAdapter == adapter and not light.isBusy]:
+                    await self._move(light, adapter)
+        for adapter in [adapter for adapter in self._managers if adapter not in present]:
+            LOGGER.warning("Adapter %s disappeared, reassigning its lights", adapter)
+            self.stats["adaptersLost"] += 1
+            manager = self._managers.pop(adapter)
+            await manager.stop()
+            for light in [light for light, assigned in self._assigned.items() if assigned == adapter]:
+                self.assign(light)
+        await self.rebalance()
+
+    async def rebalance(self):
+        """Move idle lights off adapters that have more lights than connection slots"""
+        for adapter in list(self._managers):
+            while self.load(adapter) > self.maxConnections:
+                target = min((other for other in self._managers if other != adapter), key=self.load, default=None)
+                if target is None or self.load(target) >= self.maxConnections:
+                    return
+                movable = [light for light, assigned in self._assigned.items()
+                           if assigned == adapter and not light.isBusy and light.pinnedAdapter != adapter]
+                if not movable:
+                    break
+                await self._move(movable[0], target)
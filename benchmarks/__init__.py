@@ -0,0 +1,15 @@
+"""Benchmarks for the integration, run from the repository root with python -m benchmarks.<name>"""
+import os
+import sys
+import types
+
+PACKAGE = "neewerlight"
+
+
+def loadIntegration():
+	"""Make the integration importable as the neewerlight package without running its Home Assistant setup"""
+	if PACKAGE not in sys.modules:
+		package = types.ModuleType(PACKAGE)
+		package.__path__ = [os.path.dirname(os.path.dirname(os.path.abspath(__file__)))]
+		sys.modules[PACKAGE] = package
+	return sys.modules[PACKAGE]
@@ -0,0 +1,73 @@
+"""Encode cost per frame of the old list based composeCommand against codec.py
+
+python -m benchmarks.codec_bench [--frames N]"""
+import argparse
+import colorsys
+import json
+import timeit
+
+from . import loadIntegration
+
+loadIntegration()
+from neewerlight import codec  # noqa: E402
+
+
+def legacyCompose(tag, vals):
+	# NeewerLight.composeCommand/appendChecksum as they were before codec.py
+	command = [codec.NEEWER_COMMAND_PREFIX]
+	command.append(tag)
+	command.append(len(vals))
+	command.extend(vals)
+	checksum = 0
+	for i in range(len(command)):
+		checksum += command[i] & 0xFF
+	command.append(checksum & 0xFF)
+	return bytearray(command)
+
+
+def frames(count):
+	# hsi values a fade from red to blue at varying brightness would produce
+	result = []
+	for i in range(count):
+		h, s, _ = colorsys.rgb_to_hsv(1.0 - i/count, 0.0, i/count)
+		result.append((int(h*360), int(s*100), i*100//count))
+	return result
+
+
+def run(count, repeat):
+	hsi = frames(count)
+	for h, s, v in hsi:
+		assert bytes(legacyCompose(codec.NEEWER_COMMAND_RGB, [h&0xFF,(h>>8)&0xFF,s&0xff,v&0xff])) == codec.encodeHsi(h, s, v)
+
+	cases = {
+		"rgb": (
+			lambda: [legacyCompose(codec.NEEWER_COMMAND_RGB, [h&0xFF,(h>>8)&0xFF,s&0xff,v&0xff]) for h, s, v in hsi],
+			lambda: [codec.encodeHsi(h, s, v) for h, s, v in hsi],
+		),
+		"brightness": (
+			lambda: [legacyCompose(codec.NEEWER_COMMAND_BRIGHTNESS, [v]) for _, _, v in hsi],
+			lambda: [codec.encodeBrightness(v) for _, _, v in hsi],
+		),
+		"power": (
+			lambda: [legacyCompose(codec.NEEWER_COMMAND_POWER, [codec.NEEWER_POWER_STATE_ON]) for _ in hsi],
+			lambda: [codec.POWER_ON for _ in hsi],
+		),
+	}
+	results = {}
+	for name, (before, after) in cases.items():
+		beforeTime = min(timeit.repeat(before, number=1, repeat=repeat)) / count
+		afterTime = min(timeit.repeat(after, number=1, repeat=repeat)) / count
+		results[name] = {
+			"before_ns_per_frame": round(beforeTime * 1e9, 1),
+			"after_ns_per_frame": round(afterTime * 1e9, 1),
+			"speedup": round(beforeTime / afterTime, 2),
+		}
+	return results
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description=__doc__)
+	parser.add_argument("--frames", type=int, default=10000)
+	parser.add_argument("--repeat", type=int, default=5)
+	args = parser.parse_args()
+	print(json.dumps(run(args.frames, args.repeat), indent=2))
@@ -0,0 +1,245 @@
+"""A simulated Neewer light and a BleakClient stand-in that talks to it
+
+Pass SimulatedAdapter.clientFactory to NeewerLight(clientFactory=...) and every client it creates connects to the
+simulated light with the same address instead of a real one."""
+import asyncio
+import random
+import time
+
+from . import loadIntegration
+
+loadIntegration()
+from neewerlight import codec  # noqa: E402
+from neewerlight.NeewerLight import NEEWER_CONTROL_UUID, NEEWER_READ_UUID  # noqa: E402
+
+
+class SimulatedLinkError(Exception):
+	"""A write or connect the simulated radio link failed"""
+
+
+class LinkProfile:
+	"""How the simulated radio link behaves, all times in seconds"""
+
+	def __init__(self, writeLatency=0.015, jitter=0.005, unacknowledgedLatency=0.002, connectLatency=0.3,
+				 loss=0.0, disconnectRate=0.0, notifyLatency=0.01, concurrentWrites=None, maxConnections=None, stallRate=0.0,
+				 stallTime=0.05, disconnectLatency=0.0):
+		self.writeLatency = writeLatency # an acknowledged write, i.e. a full ATT round trip
+		self.jitter = jitter # uniformly added to every latency
+		self.unacknowledgedLatency = unacknowledgedLatency # handing a write-without-response to the controller
+		self.connectLatency = connectLatency
+		self.loss = loss # probability a write is lost (acknowledged writes raise, others vanish silently)
+		self.disconnectRate = disconnectRate # probability the link drops on any write
+		self.notifyLatency = notifyLatency
+		self.concurrentWrites = concurrentWrites # writes the adapter's radio can have on air at once, None for no limit
+		self.maxConnections = maxConnections # connects beyond this fail, None for no limit
+		self.stallRate = stallRate # probability a write blocks the thread driving it, like a slow D-Bus call to BlueZ
+		self.stallTime = stallTime
+		self.disconnectLatency = disconnectLatency # a requested disconnect, e.g. BlueZ waiting for the link to close
+
+
+class SimulatedNeewerDevice:
+	"""The light itself: validates every packet and keeps the state the commands set"""
+
+	def __init__(self, address):
+		self.address = address
+		self.on = False
+		self.hsi = None
+		self.brightness = None
+		self.colourTemp = None
+		self.scene = None
+		self.received = [] # (monotonic time, packet) for every packet that arrived intact
+		self.badPackets = 0
+
+	def receive(self, data):
+		"""Apply a packet, returning the notification to send back (or None)"""
+		data = bytes(data)
+		try:
+			status = codec.decode(data)
+		except ValueError:
+			self.badPackets += 1
+			return None
+		self.received.append((time.monotonic(), data))
+		if isinstance(status, codec.PowerStatus):
+			self.on = status.on
+		elif isinstance(status, codec.HsiStatus):
+			self.on, self.hsi, self.scene = True, status, None
+		elif isinstance(status, codec.BrightnessStatus):
+			self.brightness = status.brightness
+		elif isinstance(status, codec.ColourTempStatus):
+			self.colourTemp = status.temperature
+		elif isinstance(status, codec.CctStatus):
+			self.on, self.brightness, self.colourTemp, self.hsi = True, status.brightness, status.temperature, None
+		elif isinstance(status, codec.SceneStatus):
+			self.on, self.scene = True, status
+		elif isinstance(status, codec.ReadRequest):
+			state = codec.NEEWER_POWER_STATE_ON if self.on else codec.NEEWER_POWER_STATE_OFF
+			return codec.encode(codec.NEEWER_STATUS_POWER, [state])
+		return None
+
+
+class SimulatedBleakClient:
+	"""Implements the parts of BleakClient NeewerLight uses"""
+
+	def __init__(self, adapter, target, use_cached=True, disconnected_callback=None, **kwargs):
+		self._adapter = adapter
+		self.address = getattr(target, "address", target)
+		self._disconnectedCallback = disconnected_callback
+		self._notifyCallbacks = {}
+		self._writesInFlight = 0
+		self.is_connected = False
+
+	@property
+	def _device(self) -> SimulatedNeewerDevice:
+		return self._adapter.devices[self.address.upper()]
+
+	def _delay(self, latency):
+		return latency + self._adapter.random.uniform(0, self._adapter.profile.jitter)
+
+	async def connect(self, timeout=10.0):
+		delay = self._delay(self._adapter.profile.connectLatency)
+		if not self._adapter.present:
+			raise SimulatedLinkError("Adapter "+str(self._adapter.name)+" is gone")
+		if self.address.upper() not in self._adapter.devices or delay > timeout:
+			await asyncio.sleep(min(delay, timeout))
+			raise SimulatedLinkError("Connect to "+self.address+" timed out")
+		await asyncio.sleep(delay)
+		if self._adapter.profile.maxConnections is not None and self._adapter.connections >= self._adapter.profile.maxConnections:
+			raise SimulatedLinkError("Adapter has no free connection slot for "+self.address)
+		self.is_connected = True
+		self._adapter.stats["connects"] += 1
+		return True
+
+	async def disconnect(self):
+		if self._adapter.profile.disconnectLatency:
+			await asyncio.sleep(self._delay(self._adapter.profile.disconnectLatency))
+		self._dropLink()
+		return True
+
+	def _dropLink(self):
+		if not self.is_connected:
+			return
+		self.is_connected = False
+		self._notifyCallbacks.clear()
+		if self._disconnectedCallback is not None:
+			self._disconnectedCallback(self)
+
+	async def start_notify(self, characteristic, callback):
+		self._requireConnection()
+		self._notifyCallbacks[characteristic] = callback
+
+	async def stop_notify(self, characteristic):
+		self._notifyCallbacks.pop(characteristic, None)
+
+	def _requireConnection(self):
+		if not self.is_connected:
+			raise SimulatedLinkError(self.address+" is not connected")
+
+	async def write_gatt_char(self, characteristic, data, response=False):
+		self._requireConnection()
+		profile = self._adapter.profile
+		rng = self._adapter.random
+		self._adapter.stats["writes"] += 1
+		if profile.stallRate and rng.random() < profile.stallRate:
+			self._adapter.stats["stalls"] += 1
+			time.sleep(profile.stallTime) # blocks the whole event loop, not just this write
+		# more than one write at a time to the same light means two writers are racing each other
+		self._writesInFlight += 1
+		self._adapter.stats["maxWritesInFlightPerLight"] = max(self._adapter.stats["maxWritesInFlightPerLight"], self._writesInFlight)
+		try:
+			async with self._adapter.airtime:
+				await asyncio.sleep(self._delay(profile.writeLatency if response else profile.unacknowledgedLatency))
+		finally:
+			self._writesInFlight -= 1
+		if rng.random() < profile.disconnectRate:
+			self._adapter.stats["disconnects"] += 1
+			self._dropLink()
+			raise SimulatedLinkError(self.address+" disconnected")
+		if rng.random() < profile.loss:
+			self._adapter.stats["lost"] += 1
+			if response:
+				raise SimulatedLinkError("Write to "+self.address+" was not acknowledged")
+			return
+		if characteristic != NEEWER_CONTROL_UUID:
+			raise SimulatedLinkError("Unknown characteristic "+str(characteristic))
+
+		notification = self._device.receive(data)
+		callback = self._notifyCallbacks.get(NEEWER_READ_UUID)
+		if notification is not None and callback is not None:
+			asyncio.get_event_loop().call_later(self._delay(profile.notifyLatency), callback, 0, bytearray(notification))
+
+
+class SimulatedAdapter:
+	"""A set of simulated lights reachable over one simulated adapter"""
+
+	def __init__(self, profile: LinkProfile = None, seed=None, name=None, devices=None):
+		self.profile = profile or LinkProfile()
+		self.random = random.Random(seed)
+		self.name = name
+		self.present = True
+		self.devices = devices if devices is not None else {}
+		self.stats = {"connects": 0, "writes": 0, "lost": 0, "disconnects": 0, "stalls": 0, "maxWritesInFlightPerLight": 0}
+		self.airtime = asyncio.Semaphore(self.profile.concurrentWrites) if self.profile.concurrentWrites else _Unlimited()
+		self.clients = []
+
+	@property
+	def connections(self):
+		return sum(1 for client in self.clients if client.is_connected)
+
+	def addDevice(self, address) -> SimulatedNeewerDevice:
+		device = SimulatedNeewerDevice(address)
+		self.devices[address.upper()] = device
+		return device
+
+	def clientFactory(self, target, **kwargs):
+		client = SimulatedBleakClient(self, target, **kwargs)
+		self.clients.append(client)
+		return client
+
+	def unplug(self):
+		self.present = False
+		for client in self.clients:
+			client._dropLink()
+
+
+class SimulatedHost:
+	"""Several simulated adapters in one machine that can all reach the same lights, each with its own radio airtime
+
+	Pass clientFactory to NeewerLight and listAdapters/self (as the discovery) to adapters.AdapterPool."""
+
+	def __init__(self, adapters=("hci0",), profile: LinkProfile = None, seed=None):
+		self.profile = profile or LinkProfile()
+		self.random = random.Random(seed)
+		self.devices = {}
+		self.rssi = {} # upper case address -> {adapter: rssi}
+		self.adapters = {name: SimulatedAdapter(self.profile, self.random.random(), name, self.devices) for name in adapters}
+
+	def addDevice(self, address, rssi=None) -> SimulatedNeewerDevice:
+		"""rssi maps adapter name -> dBm, by default every adapter hears the light at a random strength"""
+		device = SimulatedNeewerDevice(address)
+		self.devices[address.upper()] = device
+		self.rssi[address.upper()] = rssi if rssi is not None else {name: self.random.randint(-85, -50) for name in self.adapters}
+		return device
+
+	def rssiByAdapter(self, address):
+		return {name: rssi for name, rssi in self.rssi.get(address.upper(), {}).items() if self.adapters[name].present}
+
+	def listAdapters(self):
+		return [name for name, adapter in self.adapters.items() if adapter.present]
+
+	def removeAdapter(self, name):
+		self.adapters[name].unplug()
+
+	def clientFactory(self, target, adapter=None, **kwargs):
+		return self.adapters[adapter if adapter is not None else next(iter(self.adapters))].clientFactory(target, **kwargs)
+
+	@property
+	def stats(self):
+		return {name: dict(adapter.stats, connections=adapter.connections) for name, adapter in self.adapters.items()}
+
+
+class _Unlimited:
+	async def __aenter__(self):
+		return self
+
+	async def __aexit__(self, *exc):
+		return False
@@ -0,0 +1,539 @@
+"""Benchmark and soak suite for the hot paths, run against simulated lights
+
+python -m benchmarks.suite [--duration 5] [--lights 1 4 16] [--latency 0.015] [--loss 0.01] [--output results.json]
+
+Every scenario reports machine readable JSON so runs can be compared for regressions."""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import tempfile
+import time
+
+from . import loadIntegration
+from .simulator import LinkProfile, SimulatedAdapter, SimulatedHost
+import numpy as np
+
+loadIntegration()
+from neewerlight.NeewerLight import NeewerLight  # noqa: E402
+from neewerlight.adapters import AdapterPool  # noqa: E402
+from neewerlight.colour import INTERPOLATIONS, srgbToOklab  # noqa: E402
+from neewerlight.connection import ConnectionManager  # noqa: E402
+from neewerlight.planner import planTransition  # noqa: E402
+from neewerlight.poller import PollScheduler  # noqa: E402
+from neewerlight.trace import TracePlayer, TraceReader, TraceRecorder  # noqa: E402
+from neewerlight.transition import GroupTransition, TransitionController, playGroup, playTransition  # noqa: E402
+from neewerlight.worker import BleWorker  # noqa: E402
+
+FADE_FROM = ((255, 0, 0), 20)
+FADE_TO = ((0, 80, 255), 255)
+
+
+def summarise(samples):
+	"""Latency summary in milliseconds"""
+	if not samples:
+		return {"count": 0}
+	ordered = sorted(samples)
+	def percentile(p):
+		return ordered[min(int(p / 100 * len(ordered)), len(ordered) - 1)] * 1000
+	return {
+		"count": len(ordered),
+		"mean_ms": round(statistics.mean(ordered) * 1000, 3),
+		"p50_ms": round(percentile(50), 3),
+		"p95_ms": round(percentile(95), 3),
+		"p99_ms": round(percentile(99), 3),
+		"max_ms": round(ordered[-1] * 1000, 3),
+	}
+
+
+def makeLights(adapter, count, streaming=False, connections=None):
+	lights = []
+	for i in range(count):
+		address = "SIM:00:00:00:%02X:%02X" % (i >> 8, i & 0xFF)
+		adapter.addDevice(address)
+		lights.append(NeewerLight(address, streaming=streaming, connectionManager=connections, clientFactory=adapter.clientFactory))
+	return lights
+
+
+async def benchTransition(args, profile):
+	adapter = SimulatedAdapter(profile, args.seed)
+	light, = makeLights(adapter, 1, args.streaming)
+	await light.connect()
+	light.assume_color(*FADE_FROM)
+	plan = planTransition(FADE_FROM[0], FADE_FROM[1], FADE_TO[0], FADE_TO[1], args.duration, args.ms_per_frame)
+	try:
+		stats = await playTransition(light, plan)
+		error = None
+	except Exception as exception:
+		stats, error = {}, repr(exception)
+	duration = stats.get("duration", 0.0)
+	return {
+		"requested_duration_s": args.duration,
+		"actual_duration_s": round(duration, 4),
+		"planned_frames": plan.plannedFrames,
+		"writes": stats.get("sent", 0),
+		"frames_per_s": round(stats.get("sent", 0) / duration, 2) if duration else 0.0,
+		"deadline_misses": stats.get("late", 0),
+		"skipped_frames": stats.get("skipped", 0),
+		"max_lateness_ms": round(stats.get("maxLateness", 0.0) * 1000, 3),
+		"completed": stats.get("completed", False),
+		"error": error,
+		"write_counters": light.write_counters,
+		"metrics": light.metrics.asDict(),
+	}
+
+
+async def benchConnect(args, profile):
+	adapter = SimulatedAdapter(profile, args.seed)
+	connections = ConnectionManager(maxConnections=args.max_connections)
+	lights = makeLights(adapter, max(args.lights), connections=connections)
+	samples = []
+	for light in lights:
+		start = time.monotonic()
+		await light.connect()
+		samples.append(time.monotonic() - start)
+	# a second pass finds most lights still connected (or evicts to make room)
+	warm = []
+	for light in lights:
+		start = time.monotonic()
+		await light.connect()
+		warm.append(time.monotonic() - start)
+	await connections.stop()
+	return {"cold": summarise(samples), "warm": summarise(warm), "manager": dict(connections.stats)}
+
+
+async def benchStatus(args, profile):
+	adapter = SimulatedAdapter(profile, args.seed)
+	light, = makeLights(adapter, 1)
+	await light.connect()
+	samples = []
+	failures = 0
+	for _ in range(args.reads):
+		start = time.monotonic()
+		try:
+			await light.readStatus()
+		except Exception:
+			failures += 1
+			continue
+		samples.append(time.monotonic() - start)
+	return {"latency": summarise(samples), "failures": failures, "gatt_writes": adapter.stats["writes"], "metrics": light.metrics.asDict()}
+
+
+async def benchScaling(args, profile):
+	results = {}
+	for count in args.lights:
+		adapter = SimulatedAdapter(profile, args.seed)
+		lights = makeLights(adapter, count, args.streaming)
+		await asyncio.gather(*[light.connect() for light in lights])
+		group = GroupTransition(args.ms_per_frame)
+		for light in lights:
+			light.assume_color(*FADE_FROM)
+			group.add(light, planTransition(FADE_FROM[0], FADE_FROM[1], FADE_TO[0], FADE_TO[1], args.duration, args.ms_per_frame))
+		start = time.monotonic()
+		stats = await playGroup(group)
+		duration = time.monotonic() - start
+		results[str(count)] = {
+			"actual_duration_s": round(duration, 4),
+			"writes": stats["sent"],
+			"frames_per_s": round(stats["sent"] / duration, 2),
+			"frames_per_s_per_light": round(stats["sent"] / duration / count, 2),
+			"skipped_frames": stats["skipped"],
+			"failed_writes": stats["failed"],
+		}
+	return results
+
+
+async def benchPreemption(args, profile):
+	"""A slider being dragged: a new transition (or every fourth time an immediate colour) every slider interval, each
+	pre-empting the last. Measures the time from issuing a command until its first packet reaches the light"""
+	adapter = SimulatedAdapter(profile, args.seed)
+	light, = makeLights(adapter, 1, args.streaming)
+	device = adapter.devices[light.mac.upper()]
+	await light.connect()
+	light.assume_color(*FADE_FROM)
+	controller = TransitionController(light)
+	rng = random.Random(args.seed)
+	latencies = {"transition": [], "immediate": []}
+	starved = 0
+
+	for i in range(args.commands):
+		color = (rng.randrange(256), rng.randrange(256), rng.randrange(256))
+		seen = len(device.received)
+		issued = time.monotonic()
+		if i % 4 == 3:
+			kind = "immediate"
+			await controller.stop()
+			await light.set_color(color, 255)
+			packets = {device.received[-1][1]} if len(device.received) > seen else set()
+		else:
+			kind = "transition"
+			plans = []
+			def makePlan():
+				plans.append(planTransition(light.rgb_color, light.brightness, color, 255, args.duration, args.ms_per_frame))
+				return plans[0]
+			await controller.start(makePlan)
+		await asyncio.sleep(args.slider_interval)
+		if kind == "transition":
+			packets = {frame.packet for frame in plans[0]} if plans else set()
+		arrived = next((received for received, packet in device.received[seen:] if packet in packets), None)
+		if arrived is None:
+			starved += 1
+		else:
+			latencies[kind].append(arrived - issued)
+	await controller.stop()
+	return {
+		"commands": args.commands,
+		"slider_interval_s": args.slider_interval,
+		"first_packet_transition": summarise(latencies["transition"]),
+		"first_packet_immediate": summarise(latencies["immediate"]),
+		"starved_commands": starved,
+		"max_writes_in_flight": adapter.stats["maxWritesInFlightPerLight"],
+		"write_counters": light.write_counters,
+	}
+
+
+async def benchAdapters(args, profile):
+	"""One group transition over many lights, spread over 1, 2, ... adapters by AdapterPool. Each adapter has its own
+	connection slots and radio airtime, so the aggregate frame rate should scale with the number of adapters"""
+	if profile.concurrentWrites is None:
+		profile = LinkProfile(**dict(vars(profile), concurrentWrites=2))
+	results = {}
+	for count in args.adapters:
+		host = SimulatedHost(["hci%d" % i for i in range(count)], profile, args.seed)
+		pool = AdapterPool(host.listAdapters(), maxConnections=args.max_connections, discovery=host, listAdapters=host.listAdapters)
+		lights = []
+		for i in range(args.adapter_lights):
+			address = "SIM:00:00:00:01:%02X" % i
+			host.addDevice(address)
+			lights.append(NeewerLight(address, streaming=args.streaming, connectionManager=pool, clientFactory=host.clientFactory))
+		await asyncio.gather(*[light.connect() for light in lights], return_exceptions=True)
+		group = GroupTransition(args.ms_per_frame)
+		for light in lights:
+			light.assume_color(*FADE_FROM)
+			group.add(light, planTransition(FADE_FROM[0], FADE_FROM[1], FADE_TO[0], FADE_TO[1], args.duration, args.ms_per_frame))
+		start = time.monotonic()
+		# as the integration plays it: lights beyond the adapters' slots are deferred rather than evicting each other
+		stats = await playGroup(group)
+		duration = time.monotonic() - start
+		results[str(count)] = {
+			"lights": len(lights),
+			"connected": len(pool.connected),
+			"lights_per_adapter": {adapter: pool.load(adapter) for adapter in pool.adapters},
+			"deferred_lights": stats["deferred"],
+			"writes": stats["sent"],
+			"frames_per_s": round(stats["sent"] / duration, 2),
+			"skipped_frames": stats["skipped"],
+			"failed_writes": stats["failed"],
+		}
+		await pool.stop()
+	return results
+
+
+async def benchTrace(args, profile):
+	"""A show of several back to back fades over the scaling run's largest light count, played live from plans and then
+	replayed from a recorded trace. Compares the CPU time each costs and how close the trace's packets land to their
+	recorded times"""
+	count = max(args.lights)
+	colors = [FADE_FROM, FADE_TO, ((0, 255, 0), 120), FADE_FROM]
+	results = {}
+	with tempfile.TemporaryDirectory() as directory:
+		path = os.path.join(directory, "show.nltr")
+		for mode in ("plans", "trace"):
+			adapter = SimulatedAdapter(profile, args.seed)
+			lights = makeLights(adapter, count, args.streaming)
+			await asyncio.gather(*[light.connect() for light in lights])
+			for light in lights:
+				light.assume_color(*FADE_FROM)
+			cpu = time.process_time()
+			start = time.monotonic()
+			if mode == "plans":
+				recorder = TraceRecorder()
+				for start_, end in zip(colors, colors[1:]):
+					group = GroupTransition(args.ms_per_frame)
+					for light in lights:
+						group.add(light, planTransition(start_[0], start_[1], end[0], end[1], args.duration, args.ms_per_frame))
+					await playGroup(group)
+				stats = {}
+			else:
+				with TraceReader(path) as trace:
+					stats = await TracePlayer(trace, lights).run()
+			cpu = time.process_time() - cpu
+			duration = time.monotonic() - start
+			if mode == "plans":
+				# the same show, planned once more straight into a trace for the replay
+				offset = 0.0
+				for start_, end in zip(colors, colors[1:]):
+					for light in lights:
+						recorder.addPlan(light.address, planTransition(start_[0], start_[1], end[0], end[1], args.duration, args.ms_per_frame), offset)
+					offset += args.duration
+				recorder.save(path)
+			results[mode] = {
+				"lights": count,
+				"actual_duration_s": round(duration, 4),
+				"cpu_s": round(cpu, 4),
+				"cpu_per_show_s": round(cpu / duration, 4) if duration else None,
+				"gatt_writes": adapter.stats["writes"],
+				"frame_lateness": lights[0].metrics.frameLateness.asDict(),
+			}
+			if stats:
+				results[mode].update({
+					"trace_bytes": os.path.getsize(path),
+					"packets": stats["packets"],
+					"coalesced": stats["coalesced"],
+					"late_packets": stats["late"],
+					"max_lateness_ms": round(stats["maxLateness"] * 1000, 3),
+				})
+	return results
+
+
+async def benchStartup(args, profile):
+	"""Setting up N lights with restored state, as after an HA restart: how long setup takes, how many BLE clients and
+	connects it causes, and how the reconciliation reads that follow are spread out"""
+	results = {}
+	for count in args.lights:
+		adapter = SimulatedAdapter(profile, args.seed)
+		connections = ConnectionManager(maxConnections=args.max_connections)
+		poller = PollScheduler(interval=args.startup_window, startupDelay=args.startup_delay, minSpacing=args.startup_window / (2 * count))
+		start = time.monotonic()
+		lights = makeLights(adapter, count, connections=connections)
+		poller.start()
+		for light in lights:
+			light.restore_state(True, (255, 80, 0), 200)
+			poller.add(light)
+		setup = time.monotonic() - start
+		clientsAtSetup = len(adapter.clients)
+		await asyncio.sleep(args.startup_delay)
+		connectsDuringDelay = adapter.stats["connects"]
+		await asyncio.sleep(args.startup_window)
+		await poller.stop()
+		await connections.stop()
+		reads = sorted(received for device in adapter.devices.values() for received, packet in device.received)
+		busiest = max((sum(1 for other in reads if read <= other < read + 1.0) for read in reads), default=0)
+		results[str(count)] = {
+			"setup_ms": round(setup * 1000, 3),
+			"clients_at_setup": clientsAtSetup,
+			"connects_during_startup_delay": connectsDuringDelay,
+			"reconciliation_reads": poller.stats["polls"],
+			"max_reads_per_s": busiest,
+		}
+	return results
+
+
+async def benchPriority(args, profile):
+	"""A group fade over --adapter-lights lights on one adapter with limited airtime, while another light gets an
+	interactive colour every --slider-interval and a third is polled. Run with the adapter's write scheduler and with it
+	effectively disabled (unlimited outstanding writes, so every write queues for airtime in arrival order)"""
+	if profile.concurrentWrites is None:
+		profile = LinkProfile(**dict(vars(profile), concurrentWrites=2))
+	results = {}
+	for mode, maxOutstanding in (("scheduled", profile.concurrentWrites), ("unscheduled", 1 << 16)):
+		adapter = SimulatedAdapter(profile, args.seed)
+		connections = ConnectionManager(maxConnections=args.adapter_lights + 2, maxOutstanding=maxOutstanding)
+		fading = makeLights(adapter, args.adapter_lights + 2, args.streaming, connections)
+		interactive, polled = fading.pop(), fading.pop()
+		await asyncio.gather(*[light.connect() for light in fading + [interactive, polled]])
+		group = GroupTransition(args.ms_per_frame)
+		for light in fading:
+			light.assume_color(*FADE_FROM)
+			group.add(light, planTransition(FADE_FROM[0], FADE_FROM[1], FADE_TO[0], FADE_TO[1], args.duration, args.ms_per_frame))
+		fade = asyncio.ensure_future(playGroup(group))
+		latencies, reads = [], []
+		rng = random.Random(args.seed)
+		while not fade.done():
+			start = time.monotonic()
+			await interactive.set_color((rng.randrange(256), rng.randrange(256), rng.randrange(256)), 255)
+			latencies.append(time.monotonic() - start)
+			if len(latencies) % 5 == 0:
+				start = time.monotonic()
+				await polled.readStatus()
+				reads.append(time.monotonic() - start)
+			await asyncio.sleep(args.slider_interval)
+		stats = await fade
+		results[mode] = {
+			"interactive_latency": summarise(latencies),
+			"poll_latency": summarise(reads),
+			"fade_writes": stats["sent"],
+			"fade_skipped_frames": stats["skipped"],
+			"scheduler": connections.scheduler.asDict(),
+		}
+		await connections.stop()
+	return results
+
+
+def shownOklab(plan):
+	"""OKLab of what the light shows for every frame, decoded from the packets (hue, saturation and intensity)"""
+	packets = np.frombuffer(b"".join(frame.packet for frame in plan), dtype=np.uint8).reshape(-1, 8).astype(np.float64)
+	hue, sat, value = (packets[:, 3] + packets[:, 4] * 256) / 60.0, packets[:, 5] / 100.0, packets[:, 6] / 100.0
+	# hsv to rgb, vectorised
+	sector = np.floor(hue) % 6
+	f = hue - np.floor(hue)
+	p, q, t = value * (1 - sat), value * (1 - sat * f), value * (1 - sat * (1 - f))
+	choices = [np.stack(c, axis=1) for c in ((value, t, p), (q, value, p), (p, value, t), (p, q, value), (t, p, value), (value, p, q))]
+	rgb = np.choose(sector.astype(np.int64)[:, None], choices)
+	return srgbToOklab(np.rint(rgb * 255))
+
+
+async def benchInterpolation(args, profile):
+	"""Planning cost, writes and smoothness of fades through each interpolation. The largest step is the biggest
+	perceptual jump (OKLab distance of what the light shows) between consecutive writes: lower is smoother, and a good
+	path reaches the same largest step with fewer frames"""
+	fades = {"red_to_blue": (((255, 0, 0), 255), ((0, 0, 255), 255)), "blue_to_yellow": (((0, 0, 255), 255), ((255, 255, 0), 255)),
+			 "fade_to_dark": (((255, 120, 0), 255), ((255, 120, 0), 3)), "slider": (FADE_FROM, FADE_TO)}
+	results = {}
+	for interpolation in INTERPOLATIONS:
+		for msPerFrame in (args.ms_per_frame, args.ms_per_frame * 2):
+			result = {}
+			for name, (start, end) in fades.items():
+				planned = time.perf_counter()
+				plan = planTransition(start[0], start[1], end[0], end[1], args.duration, msPerFrame, interpolation=interpolation)
+				planned = time.perf_counter() - planned
+				shown = shownOklab(plan)
+				steps = np.linalg.norm(np.diff(shown, axis=0), axis=1)
+				# how close the midpoint comes to grey (white on the light), 0 is fully saturated
+				chroma = np.hypot(shown[:, 1], shown[:, 2])
+				result[name] = {
+					"writes": len(plan),
+					"largest_step": round(float(steps.max(initial=0.0)), 4),
+					"step_spread": round(float(steps.std()) if len(steps) else 0.0, 4),
+					"min_chroma": round(float(chroma.min()), 4),
+					"plan_ms": round(planned * 1000, 3),
+				}
+			results["%s_%dms" % (interpolation, msPerFrame)] = result
+	return results
+
+
+async def _fadeLights(args, profile):
+	"""--adapter-lights lights each playing their own fade, as entity transitions do. Returns the gaps between packets
+	arriving at each light and the transitions' stats"""
+	adapter = SimulatedAdapter(profile, args.seed)
+	lights = makeLights(adapter, args.adapter_lights, args.streaming)
+	await asyncio.gather(*[light.connect() for light in lights])
+	for light in lights:
+		light.assume_color(*FADE_FROM)
+	plan = planTransition(FADE_FROM[0], FADE_FROM[1], FADE_TO[0], FADE_TO[1], args.duration, args.ms_per_frame)
+	stats = await asyncio.gather(*[playTransition(light, plan) for light in lights])
+	gaps = []
+	for device in adapter.devices.values():
+		arrivals = [received for received, _ in device.received]
+		gaps.extend(later - earlier for earlier, later in zip(arrivals, arrivals[1:]))
+	await asyncio.gather(*[light.disconnect() for light in lights])
+	return gaps, stats, dict(adapter.stats)
+
+
+async def benchWorker(args, profile):
+	"""Fades on --adapter-lights lights while the host loop (Home Assistant's) is kept busy with --host-load seconds of
+	blocking work every --host-load-interval, and BlueZ stalls block whichever loop drives the lights. The lights run on
+	the host loop (inline) or on a BleWorker thread. Frame gaps are the time between packets arriving at a light, host
+	loop lag is how late a 10 ms sleep on the host loop wakes up"""
+	if not profile.stallRate:
+		profile = LinkProfile(**dict(vars(profile), stallRate=0.01, stallTime=0.05))
+	results = {}
+	for mode in ("inline", "worker"):
+		lag = []
+		running = True
+
+		async def hostLoad():
+			while running:
+				time.sleep(args.host_load)
+				await asyncio.sleep(args.host_load_interval)
+
+		async def probe():
+			while running:
+				start = time.monotonic()
+				await asyncio.sleep(0.01)
+				lag.append(time.monotonic() - start - 0.01)
+
+		background = [asyncio.ensure_future(hostLoad()), asyncio.ensure_future(probe())]
+		worker = None
+		try:
+			if mode == "worker":
+				worker = BleWorker()
+				worker.start()
+				gaps, stats, adapterStats = await worker.run(_fadeLights(args, profile))
+			else:
+				gaps, stats, adapterStats = await _fadeLights(args, profile)
+		finally:
+			running = False
+			await asyncio.gather(*background)
+			if worker is not None:
+				await worker.stop()
+		results[mode] = {
+			"frame_gap": summarise(gaps),
+			"late_frames": sum(stat["late"] for stat in stats),
+			"max_lateness_ms": round(max(stat["maxLateness"] for stat in stats) * 1000, 3),
+			"writes": sum(stat["sent"] for stat in stats),
+			"host_loop_lag": summarise(lag),
+			"stalls": adapterStats["stalls"],
+		}
+	return results
+
+
+SCENARIOS = {
+	"transition": benchTransition,
+	"connect": benchConnect,
+	"status": benchStatus,
+	"scaling": benchScaling,
+	"preemption": benchPreemption,
+	"adapters": benchAdapters,
+	"trace": benchTrace,
+	"startup": benchStartup,
+	"priority": benchPriority,
+	"interpolation": benchInterpolation,
+	"worker": benchWorker,
+}
+
+
+async def run(args):
+	profile = LinkProfile(writeLatency=args.latency, jitter=args.jitter, connectLatency=args.connect_latency,
+						  loss=args.loss, disconnectRate=args.disconnect_rate, concurrentWrites=args.concurrent_writes)
+	results = {
+		"python": platform.python_version(),
+		"profile": vars(profile),
+		"scenarios": {},
+	}
+	for name in args.scenarios:
+		start = time.monotonic()
+		results["scenarios"][name] = await SCENARIOS[name](args, profile)
+		results["scenarios"][name]["wall_time_s"] = round(time.monotonic() - start, 3)
+	return results
+
+
+def parser():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+	parser.add_argument("--duration", type=float, default=5.0, help="transition length in seconds")
+	parser.add_argument("--ms-per-frame", type=int, default=40)
+	parser.add_argument("--lights", type=int, nargs="+", default=[1, 4, 16], help="light counts for the scaling run")
+	parser.add_argument("--reads", type=int, default=50, help="status reads to time")
+	parser.add_argument("--commands", type=int, default=40, help="commands issued by the pre-emption run")
+	parser.add_argument("--slider-interval", type=float, default=0.1, help="seconds between pre-empting commands")
+	parser.add_argument("--max-connections", type=int, default=5, help="connection slots per adapter")
+	parser.add_argument("--adapters", type=int, nargs="+", default=[1, 2, 4], help="adapter counts for the adapters run")
+	parser.add_argument("--adapter-lights", type=int, default=20, help="lights in the adapters run")
+	parser.add_argument("--startup-delay", type=float, default=1.0, help="seconds before the startup run's first read")
+	parser.add_argument("--startup-window", type=float, default=4.0, help="seconds the startup run spreads its reads over")
+	parser.add_argument("--host-load", type=float, default=0.02, help="seconds the worker run's host loop is blocked at a time")
+	parser.add_argument("--host-load-interval", type=float, default=0.1, help="seconds between the host loop's blocking work")
+	parser.add_argument("--streaming", action="store_true", help="use write-without-response streaming mode")
+	parser.add_argument("--latency", type=float, default=0.015, help="acknowledged write latency in seconds")
+	parser.add_argument("--jitter", type=float, default=0.005)
+	parser.add_argument("--connect-latency", type=float, default=0.3)
+	parser.add_argument("--loss", type=float, default=0.0)
+	parser.add_argument("--disconnect-rate", type=float, default=0.0)
+	parser.add_argument("--concurrent-writes", type=int, help="writes one adapter can have on air at once")
+	parser.add_argument("--seed", type=int, default=1)
+	parser.add_argument("--output", help="write the JSON here instead of stdout")
+	return parser
+
+
+if __name__ == "__main__":
+	args = parser().parse_args()
+	results = json.dumps(asyncio.run(run(args)), indent=2)
+	if args.output:
+		with open(args.output, "w") as file:
+			file.write(results)
+	else:
+		print(results)
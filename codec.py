@@ -0,0 +1,136 @@
+from functools import lru_cache
+from typing import NamedTuple
+import struct
+
+# packets are 0x78 (prefix), opcode, length of data following, data, checksum (sum of every previous byte & 0xFF)
+NEEWER_COMMAND_PREFIX = 0x78
+NEEWER_COMMAND_POWER = 0x81
+NEEWER_COMMAND_BRIGHTNESS = 0x82
+NEEWER_COMMAND_COLOURTEMP = 0x83
+NEEWER_COMMAND_READ = 0x84
+NEEWER_COMMAND_RGB = 0x86
+NEEWER_COMMAND_CCT = 0x87
+NEEWER_COMMAND_SCENE = 0x88
+# notifications sent back on the read characteristic
+NEEWER_STATUS_POWER = 0x01
+
+NEEWER_POWER_STATE_ON = 0x01
+NEEWER_POWER_STATE_OFF = 0x02
+
+_RGB_PACKET = struct.Struct("<BBBHBBB")
+_RGB_CHECKSUM_BASE = NEEWER_COMMAND_PREFIX + NEEWER_COMMAND_RGB + 4
+
+
+class ChecksumError(ValueError):
+    """A packet whose last byte doesn't match the checksum of the bytes before it"""
+
+
+class PowerStatus(NamedTuple):
+    on: bool
+
+class BrightnessStatus(NamedTuple):
+    brightness: int # 0-100
+
+class ColourTempStatus(NamedTuple):
+    temperature: int # kelvin / 100
+
+class ReadRequest(NamedTuple):
+    pass
+
+class HsiStatus(NamedTuple):
+    hue: int # 0-359
+    saturation: int # 0-100
+    intensity: int # 0-100
+
+class CctStatus(NamedTuple):
+    brightness: int # 0-100
+    temperature: int # kelvin / 100
+
+class SceneStatus(NamedTuple):
+    brightness: int # 0-100
+    scene: int # 1-9
+
+class UnknownPacket(NamedTuple):
+    opcode: int
+    payload: bytes
+
+
+def checksum(data) -> int:
+    return sum(data) & 0xFF
+
+def validateChecksum(data) -> bool:
+    return len(data) >= 2 and checksum(data[:-1]) == data[-1]
+
+def encode(opcode: int, payload) -> bytes:
+    """Generic packet encoder, the specific encoders below are cheaper for anything sent often"""
+    body = bytes([NEEWER_COMMAND_PREFIX, opcode, len(payload), *(value & 0xFF for value in payload)])
+    return body + bytes([checksum(body)])
+
+
+POWER_ON = encode(NEEWER_COMMAND_POWER, [NEEWER_POWER_STATE_ON])
+POWER_OFF = encode(NEEWER_COMMAND_POWER, [NEEWER_POWER_STATE_OFF])
+READ_REQUEST = encode(NEEWER_COMMAND_READ, [])
+
+# single byte commands only have 256 possible packets, so they are all built once up front
+_BRIGHTNESS_PACKETS = tuple(encode(NEEWER_COMMAND_BRIGHTNESS, [value]) for value in range(256))
+_COLOURTEMP_PACKETS = tuple(encode(NEEWER_COMMAND_COLOURTEMP, [value]) for value in range(256))
+
+
+def encodeHsi(hue: int, saturation: int, intensity: int) -> bytes:
+    """0x86 colour packet: hue 0-359 (little endian), saturation 0-100, intensity 0-100"""
+    hue &= 0xFFFF
+    saturation &= 0xFF
+    intensity &= 0xFF
+    check = (_RGB_CHECKSUM_BASE + (hue & 0xFF) + (hue >> 8) + saturation + intensity) & 0xFF
+    return _RGB_PACKET.pack(NEEWER_COMMAND_PREFIX, NEEWER_COMMAND_RGB, 4, hue, saturation, intensity, check)
+
+def encodeBrightness(brightness: int) -> bytes:
+    """0x82 brightness packet, brightness 0-100"""
+    return _BRIGHTNESS_PACKETS[brightness & 0xFF]
+
+def encodeColourTemp(temperature: int) -> bytes:
+    """0x83 colour temperature packet, temperature in kelvin / 100"""
+    return _COLOURTEMP_PACKETS[temperature & 0xFF]
+
+@lru_cache(maxsize=1024)
+def encodeCct(brightness: int, temperature: int) -> bytes:
+    """0x87 white packet, brightness 0-100 and temperature in kelvin / 100"""
+    return encode(NEEWER_COMMAND_CCT, [brightness, temperature])
+
+@lru_cache(maxsize=256)
+def encodeScene(scene: int, brightness: int) -> bytes:
+    """0x88 scene packet, scene 1-9 and brightness 0-100"""
+    return encode(NEEWER_COMMAND_SCENE, [brightness, scene & 0x0F])
+
+
+def decode(data):
+    """Turn a packet (a notification from the light, or one of our own commands) into a status object
+
+    Raises ChecksumError for corrupted packets and ValueError for anything that isn't a Neewer packet"""
+    data = bytes(data)
+    if len(data) < 4 or data[0] != NEEWER_COMMAND_PREFIX:
+        raise ValueError("Not a Neewer packet: "+data.hex())
+    length = data[2]
+    if len(data) != length + 4:
+        raise ValueError("Neewer packet length mismatch: "+data.hex())
+    if not validateChecksum(data):
+        raise ChecksumError("Invalid checksum: "+data.hex())
+
+    opcode = data[1]
+    payload = data[3:-1]
+    if (opcode == NEEWER_STATUS_POWER or opcode == NEEWER_COMMAND_POWER) and length == 1:
+        return PowerStatus(payload[0] == NEEWER_POWER_STATE_ON)
+    if opcode == NEEWER_COMMAND_BRIGHTNESS and length == 1:
+        return BrightnessStatus(payload[0])
+    if opcode == NEEWER_COMMAND_COLOURTEMP and length == 1:
+        return ColourTempStatus(payload[0])
+    if opcode == NEEWER_COMMAND_READ and length == 0:
+        return ReadRequest()
+    if opcode == NEEWER_COMMAND_RGB and length == 4:
+        hue, saturation, intensity = struct.unpack("<HBB", payload)
+        return HsiStatus(hue, saturation, intensity)
+    if opcode == NEEWER_COMMAND_CCT and length == 2:
+        return CctStatus(payload[0], payload[1])
+    if opcode == NEEWER_COMMAND_SCENE and length == 2:
+        return SceneStatus(payload[0], payload[1])
+    return UnknownPacket(opcode, payload)
@@ -0,0 +1,95 @@
+"""Perceptual colour maths for planning transitions, vectorised over every frame of a plan at once
+
+Colours are interpolated in OKLab (https://bottosson.github.io/posts/oklab/), or its polar form OKLCh, where equal
+steps look like equal changes. sRGB is decoded and encoded through lookup tables rather than per value powers."""
+import numpy as np
+
+INTERPOLATION_OKLCH = "oklch" # lightness, chroma and hue: the hue turns around the colour wheel, never through grey
+INTERPOLATION_OKLAB = "oklab" # straight line in OKLab: even, but complementary colours pass close to grey
+INTERPOLATION_RGB = "rgb" # straight line in gamma encoded sRGB, with linear brightness
+INTERPOLATIONS = (INTERPOLATION_OKLCH, INTERPOLATION_OKLAB, INTERPOLATION_RGB)
+
+EASING_LINEAR = "linear"
+EASINGS = {
+    EASING_LINEAR: lambda t: t,
+    "ease_in": lambda t: t * t * t,
+    "ease_out": lambda t: 1 - (1 - t) ** 3,
+    "ease_in_out": lambda t: np.where(t < 0.5, 4 * t * t * t, 1 - (-2 * t + 2) ** 3 / 2),
+}
+
+# sRGB byte -> linear light, and linear light (in LINEAR_STEPS steps) -> sRGB 0-255
+LINEAR_STEPS = 4096
+_SRGB = np.arange(256) / 255.0
+SRGB_TO_LINEAR = np.where(_SRGB <= 0.04045, _SRGB / 12.92, ((_SRGB + 0.055) / 1.055) ** 2.4)
+_LINEAR = np.arange(LINEAR_STEPS) / (LINEAR_STEPS - 1)
+LINEAR_TO_SRGB = 255.0 * np.where(_LINEAR <= 0.0031308, _LINEAR * 12.92, 1.055 * _LINEAR ** (1 / 2.4) - 0.055)
+
+_LINEAR_TO_LMS = np.array([
+    [0.4122214708, 0.5363325363, 0.0514459929],
+    [0.2119034982, 0.6806995451, 0.1073969566],
+    [0.0883024619, 0.2817188376, 0.6299787005],
+])
+_LMS_TO_OKLAB = np.array([
+    [0.2104542553, 0.7936177850, -0.0040720468],
+    [1.9779984951, -2.4285922050, 0.4505937099],
+    [0.0259040371, 0.7827717662, -0.8086757660],
+])
+_OKLAB_TO_LMS = np.linalg.inv(_LMS_TO_OKLAB)
+_LMS_TO_LINEAR = np.linalg.inv(_LINEAR_TO_LMS)
+
+
+def ease(easing, t):
+    """Apply a named easing curve to progress values 0-1"""
+    if easing not in EASINGS:
+        raise ValueError("Unknown easing "+str(easing)+", expected one of "+", ".join(EASINGS))
+    return np.asarray(EASINGS[easing](t), dtype=np.float64)
+
+
+def srgbToOklab(rgb):
+    """(N,3) sRGB 0-255 integers to (N,3) OKLab"""
+    linear = SRGB_TO_LINEAR[np.clip(np.asarray(rgb, dtype=np.int64), 0, 255)]
+    return np.cbrt(linear @ _LINEAR_TO_LMS.T) @ _LMS_TO_OKLAB.T
+
+
+def oklabToSrgb(lab):
+    """(N,3) OKLab to (N,3) sRGB 0-255 integers, out of gamut colours clipped"""
+    linear = (np.asarray(lab, dtype=np.float64) @ _OKLAB_TO_LMS.T) ** 3 @ _LMS_TO_LINEAR.T
+    index = np.rint(np.clip(linear, 0.0, 1.0) * (LINEAR_STEPS - 1)).astype(np.int64)
+    return np.rint(LINEAR_TO_SRGB[index]).astype(np.int64)
+
+
+def interpolateColours(startColor, endColor, progress, interpolation=INTERPOLATION_OKLCH):
+    """sRGB colours (N,3) at each progress value 0-1 along the path from startColor to endColor"""
+    progress = np.asarray(progress, dtype=np.float64)[:, None]
+    start = np.asarray([startColor], dtype=np.float64)
+    end = np.asarray([endColor], dtype=np.float64)
+    if interpolation == INTERPOLATION_RGB:
+        return np.trunc(start + progress * (end - start)).astype(np.int64)
+    startLab, endLab = srgbToOklab(start), srgbToOklab(end)
+    if interpolation == INTERPOLATION_OKLAB:
+        return oklabToSrgb(startLab + progress * (endLab - startLab))
+    if interpolation != INTERPOLATION_OKLCH:
+        raise ValueError("Unknown interpolation "+str(interpolation)+", expected one of "+", ".join(INTERPOLATIONS))
+
+    startChroma, endChroma = np.hypot(startLab[0, 1], startLab[0, 2]), np.hypot(endLab[0, 1], endLab[0, 2])
+    startHue, endHue = np.arctan2(startLab[0, 2], startLab[0, 1]), np.arctan2(endLab[0, 2], endLab[0, 1])
+    # a grey or black end has no hue of its own, so it keeps the other end's
+    if startChroma < 1e-4:
+        startHue = endHue
+    if endChroma < 1e-4:
+        endHue = startHue
+    hueStep = (endHue - startHue + np.pi) % (2 * np.pi) - np.pi # the short way round
+    lightness = startLab[0, 0] + progress[:, 0] * (endLab[0, 0] - startLab[0, 0])
+    chroma = startChroma + progress[:, 0] * (endChroma - startChroma)
+    hue = startHue + progress[:, 0] * hueStep
+    return oklabToSrgb(np.stack([lightness, chroma * np.cos(hue), chroma * np.sin(hue)], axis=1))
+
+
+def interpolateBrightness(startBrightness, endBrightness, progress, interpolation=INTERPOLATION_OKLCH):
+    """Brightness 0-255 at each progress value. Perceptual interpolations move evenly in lightness (the cube root of
+    the light output, as OKLab's L) rather than in output, so a fade doesn't rush through the dark end"""
+    progress = np.asarray(progress, dtype=np.float64)
+    if interpolation == INTERPOLATION_RGB:
+        return np.trunc(startBrightness + progress * (endBrightness - startBrightness)).astype(np.int64)
+    start, end = np.cbrt(startBrightness / 255.0), np.cbrt(endBrightness / 255.0)
+    return np.rint((start + progress * (end - start)) ** 3 * 255.0).astype(np.int64)
@@ -1,9 +1,16 @@
 import asyncio
 from .NeewerLight import NeewerLight
+from . import (CONF_STREAMING, CONF_IDLE_TIMEOUT, CONF_POLL_INTERVAL, CONF_ADAPTER, CONF_BLE_WORKER, CONNECTIONS, DISCOVERY,
+			   WORKER, entry_option, get_discovery, shared_connections)
+from .adapters import AUTO_ADAPTER, localAdapters
+from .connection import DEFAULT_IDLE_TIMEOUT, DEFAULT_MAX_CONNECTIONS
+from .poller import DEFAULT_POLL_INTERVAL
 from typing import Any
 
 from homeassistant import config_entries
 from homeassistant.const import CONF_MAC
+from homeassistant.core import callback
+import homeassistant.helpers.config_validation as cv
 import voluptuous as vol
 from homeassistant.helpers.device_registry import format_mac
 
@@ -16,6 +23,65 @@ DATA_SCHEMA = vol.Schema({("host"): str})
 DOMAIN = "neewerlight"
 
 MANUAL_MAC = "manual"
+BULK_MAC = "bulk"
+SOURCE_BULK_ENTRY = "bulk_entry" # flow source creating one entry for each light after the first in a bulk setup
+
+BLINK_TIME = 1 # seconds a light stays toggled so you can see it blink
+BULK_CONNECTION_LIMIT = DEFAULT_MAX_CONNECTIONS # lights validated at once in bulk setup
+
+
+async def blinkLight(light: NeewerLight):
+	"""Toggle a light's power there and back so it visibly blinks, then disconnect. Raises if it can't be reached"""
+	try:
+		# held for the whole blink, so other lights waiting for a slot can't evict it between the two toggles
+		async with light.keepConnected(required=True):
+			await light.update()
+			if light.is_on:
+				await light.turn_off()
+				await asyncio.sleep(BLINK_TIME)
+				await light.turn_on()
+			else:
+				await light.turn_on()
+				await asyncio.sleep(BLINK_TIME)
+				await light.turn_off()
+	finally:
+		await light.disconnect()
+
+
+async def blinkLights(lights: "list[NeewerLight]", limit=BULK_CONNECTION_LIMIT):
+	"""Blink every light, at most limit connected at once, so the time taken grows with len(lights) / limit.
+	Returns {address: the error, or None if it blinked}"""
+	slots = asyncio.Semaphore(limit)
+
+	async def blink(light):
+		async with slots:
+			try:
+				await blinkLight(light)
+			except Exception as error:
+				LOGGER.debug("%s did not blink: %s", light.address, error)
+				return error
+
+	results = await asyncio.gather(*[blink(light) for light in lights])
+	return {light.address: result for light, result in zip(lights, results)}
+
+
+async def blinkNewLights(data: dict, discovery, addresses):
+	"""blinkLights for lights that aren't set up yet, through the connection slots of the lights already set up in data,
+	so validating them counts against (and can evict) those lights rather than taking slots behind their back"""
+	connections = shared_connections(data, discovery)
+	# the lights were all just seen by the user step's scan, so this is normally answered from the cache
+	await asyncio.gather(*[discovery.find(address) for address in addresses])
+	lights = [NeewerLight(address, discovery=discovery, connectionManager=connections) for address in addresses]
+	try:
+		return await blinkLights(lights)
+	finally:
+		for light in lights:
+			connections.forget(light)
+
+
+def bulkName(name, address):
+	"""Lights of one model all advertise the same name, so bulk added ones get the end of their address appended"""
+	return "%s %s" % (name or "Neewer", address.replace(":", "")[-4:].upper())
 
 
 class NeewerLightFlowHandler(config_entries.ConfigFlow, domain=DOMAIN):
@@ -27,35 +93,51 @@ class NeewerLightFlowHandler(config_entries.ConfigFlow, domain=DOMAIN):
 		self.mac = None
 		self.neewerlight_instance = None
 		self.name = None
+		self.streaming = False
+		self.discovered = {} # address -> advertised name, from the user step's scan
+		self.bulk = {} # address -> name, the lights picked in bulk setup
+		self.bulkErrors = {} # address -> error for bulk lights that didn't blink
+
+	@staticmethod
+	@callback
+	def async_get_options_flow(config_entry):
+		return NeewerLightOptionsFlowHandler(config_entry)
 
 	async def async_step_user(self, user_input=None):
 		"""Handle the initial step."""
 		if user_input is not None:
 			if user_input["mac"] == MANUAL_MAC:
 				return await self.async_step_manual()
+			if user_input["mac"] == BULK_MAC:
+				self.streaming = user_input.get(CONF_STREAMING, False)
+				return await self.async_step_bulk()
 
 			self.mac = user_input["mac"]
-			self.name = user_input["name"]
+			self.name = user_input.get("name") or self.discovered.get(self.mac) or self.mac
+			self.streaming = user_input.get(CONF_STREAMING, False)
 			await self.async_set_unique_id(format_mac(self.mac))
 			return await self.async_step_validate()
 
 		already_configured = self._async_current_ids(False)
-		devices = await NeewerLight.discover()
+		devices = await NeewerLight.discover(get_discovery(self.hass))
 		devices = [device for device in devices if format_mac(device.address) not in already_configured]
 
 		if not devices:
 			return await self.async_step_manual()
+		self.discovered = {device.address: device.name for device in devices}
 
 		return self.async_show_form(
 			step_id="user", data_schema=vol.Schema(
 				{
 					vol.Required("mac"): vol.In(
 						{
-							**{device.address: device.name for device in devices},
+							**self.discovered,
+							**({BULK_MAC: "Add several lights at once"} if len(devices) > 1 else {}),
 							MANUAL_MAC: "Manually add a MAC address",
 						}
 					),
-					vol.Required("name"): str
+					vol.Optional("name", default=""): str,
+					vol.Optional(CONF_STREAMING, default=False): bool
 				}
 			),
 			errors={})
@@ -64,7 +146,7 @@ class NeewerLightFlowHandler(config_entries.ConfigFlow, domain=DOMAIN):
 		if user_input is not None:
 			if "flicker" in user_input:
 				if user_input["flicker"]:
-					return self.async_create_entry(title=self.name, data={CONF_MAC: self.mac, "name": self.name})
+					return self.async_create_entry(title=self.name, data={CONF_MAC: self.mac, "name": self.name, CONF_STREAMING: self.streaming})
 				return self.async_abort(reason="cannot_validate")
 
 			if "retry" in user_input and not user_input["retry"]:
@@ -91,6 +173,7 @@ class NeewerLightFlowHandler(config_entries.ConfigFlow, domain=DOMAIN):
 		if user_input is not None:
 			self.mac = user_input["mac"]
 			self.name = user_input["name"]
+			self.streaming = user_input.get(CONF_STREAMING, False)
 			await self.async_set_unique_id(format_mac(self.mac))
 			return await self.async_step_validate()
 
@@ -98,24 +181,112 @@ class NeewerLightFlowHandler(config_entries.ConfigFlow, domain=DOMAIN):
 			step_id="manual", data_schema=vol.Schema(
 				{
 					vol.Required("mac"): str,
-					vol.Required("name"): str
+					vol.Required("name"): str,
+					vol.Optional(CONF_STREAMING, default=False): bool
 				}
 			), errors={})
 
+	async def async_step_bulk(self, user_input: "dict[str, Any] | None" = None):
+		"""Pick any number of the discovered lights to validate and add together"""
+		if user_input is not None:
+			if not user_input["macs"]:
+				return self.async_show_form(step_id="bulk", data_schema=self._bulkSchema(), errors={"base": "none_selected"})
+			self.streaming = user_input.get(CONF_STREAMING, self.streaming)
+			self.bulk = {address: bulkName(self.discovered.get(address), address) for address in user_input["macs"]}
+			return await self.async_step_bulk_validate()
+
+		return self.async_show_form(step_id="bulk", data_schema=self._bulkSchema(), errors={})
+
+	def _bulkSchema(self):
+		return vol.Schema(
+			{
+				vol.Required("macs", default=list(self.discovered)): cv.multi_select(
+					{address: "%s (%s)" % (name, address) for address, name in self.discovered.items()}
+				),
+				vol.Optional(CONF_STREAMING, default=self.streaming): bool
+			}
+		)
+
+	async def async_step_bulk_validate(self, user_input: "dict[str, Any] | None" = None):
+		"""Blink every picked light in one pass, then add the ones confirmed to have blinked"""
+		if user_input is not None:
+			if "blinked" in user_input:
+				if not user_input["blinked"]:
+					return self.async_abort(reason="cannot_validate")
+				return await self._createBulkEntries(user_input["blinked"])
+
+			if "retry" in user_input and not user_input["retry"]:
+				return self.async_abort(reason="cannot_connect")
+
+		worker = self.hass.data.get(WORKER)
+		if CONNECTIONS not in self.hass.data and worker is not None and worker.running:
+			# every light set up so far runs on the BLE worker, so its slots are the ones in use
+			results = await worker.run(blinkNewLights(worker.data, worker.data[DISCOVERY], list(self.bulk)))
+		else:
+			results = await blinkNewLights(self.hass.data, get_discovery(self.hass), list(self.bulk))
+		self.bulkErrors = {address: error for address, error in results.items() if error is not None}
+		blinked = [address for address in self.bulk if address not in self.bulkErrors]
+		placeholders = {"failed": ", ".join(self.bulk[address] for address in self.bulkErrors) or "none"}
+
+		if not blinked:
+			return self.async_show_form(
+				step_id="bulk_validate", data_schema=vol.Schema(
+					{
+						vol.Required("retry"): bool
+					}
+				), errors={"base": "connect"}, description_placeholders=placeholders)
+
+		return self.async_show_form(
+			step_id="bulk_validate", data_schema=vol.Schema(
+				{
+					vol.Required("blinked", default=blinked): cv.multi_select({address: self.bulk[address] for address in blinked})
+				}
+			), errors={}, description_placeholders=placeholders)
+
+	async def _createBulkEntries(self, addresses):
+		"""A flow finishes with a single entry, so this one creates the first and a bulk_entry flow is started for each other"""
+		entries = [{CONF_MAC: address, "name": self.bulk[address], CONF_STREAMING: self.streaming} for address in addresses]
+		for data in entries[1:]:
+			self.hass.async_create_task(self.hass.config_entries.flow.async_init(
+				DOMAIN, context={"source": SOURCE_BULK_ENTRY}, data=data))
+		first = entries[0]
+		await self.async_set_unique_id(format_mac(first[CONF_MAC]))
+		self._abort_if_unique_id_configured()
+		return self.async_create_entry(title=first["name"], data=first)
+
+	async def async_step_bulk_entry(self, entry_data: "dict[str, Any]"):
+		"""An entry for a light bulk setup has already validated, unless it's been configured since"""
+		await self.async_set_unique_id(format_mac(entry_data[CONF_MAC]))
+		self._abort_if_unique_id_configured()
+		return self.async_create_entry(title=entry_data["name"], data=entry_data)
+
 	async def toggle_light(self):
 		if not self.neewerlight_instance:
-			self.neewerlight_instance = NeewerLight(self.mac)
+			discovery = get_discovery(self.hass)
+			await discovery.find(self.mac)
+			self.neewerlight_instance = NeewerLight(self.mac, discovery=discovery)
 		try:
-			await self.neewerlight_instance.update()
-			if self.neewerlight_instance.is_on:
-				await self.neewerlight_instance.turn_off()
-				await asyncio.sleep(1)
-				await self.neewerlight_instance.turn_on()
-			else:
-				await self.neewerlight_instance.turn_on()
-				await asyncio.sleep(1)
-				await self.neewerlight_instance.turn_off()
+			await blinkLight(self.neewerlight_instance)
 		except (Exception) as error:
 			return error
-		finally:
-			await self.neewerlight_instance.disconnect()
\ No newline at end of file
+
+class NeewerLightOptionsFlowHandler(config_entries.OptionsFlow):
+	def __init__(self, config_entry) -> None:
+		self.config_entry = config_entry
+
+	async def async_step_init(self, user_input=None):
+		"""Per light tuning, applied by reloading the entry."""
+		if user_input is not None:
+			return self.async_create_entry(title="", data=user_input)
+
+		return self.async_show_form(
+			step_id="init", data_schema=vol.Schema(
+				{
+					vol.Optional(CONF_STREAMING, default=entry_option(self.config_entry, CONF_STREAMING, False)): bool,
+					vol.Optional(CONF_IDLE_TIMEOUT, default=entry_option(self.config_entry, CONF_IDLE_TIMEOUT, DEFAULT_IDLE_TIMEOUT)): vol.All(vol.Coerce(float), vol.Range(min=5)),
+					vol.Optional(CONF_POLL_INTERVAL, default=entry_option(self.config_entry, CONF_POLL_INTERVAL, DEFAULT_POLL_INTERVAL)): vol.All(vol.Coerce(float), vol.Range(min=0)),
+					vol.Optional(CONF_ADAPTER, default=entry_option(self.config_entry, CONF_ADAPTER, AUTO_ADAPTER)):
+						vol.In([AUTO_ADAPTER] + [adapter for adapter in localAdapters() if adapter is not None]),
+					vol.Optional(CONF_BLE_WORKER, default=entry_option(self.config_entry, CONF_BLE_WORKER, False)): bool
+				}
+			), errors={})
@@ -0,0 +1,183 @@
+from collections import OrderedDict
+import asyncio
+import logging
+import time
+
+from .scheduler import CommandScheduler, DEFAULT_MAX_OUTSTANDING
+
+LOGGER = logging.getLogger("NeewerLightConnections")
+LOGGER.setLevel(logging.WARN)
+
+# most adapters only manage a handful of simultaneous LE connections before connects start failing
+DEFAULT_MAX_CONNECTIONS = 5
+DEFAULT_IDLE_TIMEOUT = 60.0 # seconds
+HOLD_SLOT_TIMEOUT = 0.25 # seconds holdConnections waits for a slot before leaving a light out
+
+
+class NoFreeSlotError(asyncio.TimeoutError):
+    """Every connection slot stayed busy for the whole timeout, the light itself was never tried"""
+
+
+class ConnectionManager:
+    """Shares the adapter's connection slots between lights
+
+    Lights connect through acquire(), which takes a slot. When every slot is in use the least recently used idle light
+    is disconnected to make room, and lights that haven't been used for their idle timeout are disconnected in the
+    background. A light is never evicted while it has commands queued or is held with NeewerLight.keepConnected().
+    Writes from every light on the adapter are ordered by one scheduler.CommandScheduler."""
+
+    def __init__(self, maxConnections=DEFAULT_MAX_CONNECTIONS, idleTimeout=DEFAULT_IDLE_TIMEOUT, maxOutstanding=DEFAULT_MAX_OUTSTANDING):
+        self.maxConnections = maxConnections
+        self.idleTimeout = idleTimeout
+        self.scheduler = CommandScheduler(maxOutstanding)
+        self._slots = OrderedDict() # light -> last used (monotonic), least recently used first
+        self._connecting = set()
+        self._disconnecting = {} # light -> future resolved once its disconnect is done
+        self._slotFreed = asyncio.Condition()
+        self._idleTask = None
+        self.stats = {"connects": 0, "evictions": 0, "idleDisconnects": 0}
+
+    @property
+    def connected(self):
+        return [light for light in self._slots if light.isConnected]
+
+    @property
+    def freeSlots(self):
+        return self.maxConnections - len(self._slots)
+
+    @property
+    def capacity(self):
+        """Lights that can be connected at once"""
+        return self.maxConnections
+
+    def schedulerFor(self, light) -> CommandScheduler:
+        return self.scheduler
+
+    def touch(self, light):
+        if light in self._slots:
+            self._slots[light] = time.monotonic()
+            self._slots.move_to_end(light)
+
+    def _idleTimeoutFor(self, light):
+        return light.idleTimeout if light.idleTimeout is not None else self.idleTimeout
+
+    def _evictionCandidate(self):
+        for light in self._slots:
+            if not light.isBusy and light not in self._connecting:
+                return light
+        return None
+
+    async def acquire(self, light, timeout, slotTimeout=None):
+        """Connect the light, waiting for (or freeing) a connection slot first. slotTimeout limits the wait for a slot
+        separately, by default it's part of timeout"""
+        if light in self._slots and light.isConnected:
+            self.touch(light)
+            return
+
+        deadline = time.monotonic() + timeout
+        slotDeadline = deadline if slotTimeout is None else min(deadline, time.monotonic() + slotTimeout)
+        victim = None
+        async with self._slotFreed:
+            while light not in self._slots:
+                if len(self._slots) < self.maxConnections:
+                    self._slots[light] = time.monotonic()
+                    break
+                victim = self._evictionCandidate()
+                if victim is None:
+                    # every slot is busy, the timeout covers waiting for one as well as the connect itself
+                    try:
+                        await asyncio.wait_for(self._slotFreed.wait(), max(slotDeadline - time.monotonic(), 0))
+                    except asyncio.TimeoutError:
+                        raise NoFreeSlotError("No free connection slot for "+str(light.mac)) from None
+                    continue
+                LOGGER.debug("Evicting %s to make room for %s", victim.mac, light.mac)
+                # the victim's slot goes straight to this light
+                del self._slots[victim]
+                self._slots[light] = time.monotonic()
+                self.stats["evictions"] += 1
+            # counted as connecting from here, so the slot can't be evicted while the victim disconnects
+            self._connecting.add(light)
+        try:
+            if victim is not None:
+                # outside the lock, so a slow BlueZ disconnect only holds up the light taking the slot
+                await self._disconnect(victim)
+            disconnecting = self._disconnecting.get(light)
+            if disconnecting is not None:
+                # the light was just evicted itself, its old link has to close before it connects again
+                await asyncio.shield(disconnecting)
+            self.touch(light)
+            if not light.isConnected:
+                try:
+                    await light.device.connect(timeout=max(deadline - time.monotonic(), 1.0))
+                    self.stats["connects"] += 1
+                except Exception:
+                    await self.release(light)
+                    raise
+        finally:
+            self._connecting.discard(light)
+
+    async def idle(self, light):
+        """Called when a light stops being busy, so anyone waiting for a slot can evict it"""
+        self.touch(light)
+        async with self._slotFreed:
+            self._slotFreed.notify_all()
+
+    async def release(self, light):
+        """Give up the light's slot, disconnecting it"""
+        async with self._slotFreed:
+            self._slots.pop(light, None)
+            self._slotFreed.notify_all()
+        await self._disconnect(light)
+
+    async def _disconnect(self, light):
+        done = asyncio.get_event_loop().create_future()
+        self._disconnecting[light] = done
+        try:
+            if light.isConnected:
+                await light.device.disconnect()
+        except Exception as error:
+            LOGGER.warning("Error disconnecting %s: %s", light.mac, error)
+        finally:
+            if self._disconnecting.get(light) is done:
+                del self._disconnecting[light]
+            done.set_result(None)
+
+    def start(self):
+        if self._idleTask is None or self._idleTask.done():
+            self._idleTask = asyncio.ensure_future(self._evictIdle())
+
+    async def stop(self):
+        if self._idleTask is not None:
+            self._idleTask.cancel()
+            self._idleTask = None
+        for light in list(self._slots):
+            await self.release(light)
+
+    async def _evictIdle(self):
+        while True:
+            await asyncio.sleep(max(min([self.idleTimeout] + [self._idleTimeoutFor(light) for light in self._slots]) / 4, 1.0))
+            now = time.monotonic()
+            idle = [light for light, lastUsed in self._slots.items()
+                    if not light.isBusy and light not in self._connecting and now - lastUsed >= self._idleTimeoutFor(light)]
+            for light in idle:
+                LOGGER.debug("Disconnecting idle light %s", light.mac)
+                self.stats["idleDisconnects"] += 1
+                await self.release(light)
+
+
+async def holdConnections(stack, lights, timeout=None, slotTimeout=HOLD_SLOT_TIMEOUT):
+    """Hold the lights connected (NeewerLight.keepConnected) until the AsyncExitStack closes, as many as the adapters have
+    slots for. Held lights can't be evicted, so a light that can't get a slot within slotTimeout, or can't connect, is
+    left out rather than waiting for one of the others to let go. Returns the held lights"""
+    options = {} if timeout is None else {"timeout": timeout}
+
+    async def hold(light):
+        try:
+            await stack.enter_async_context(light.keepConnected(slotTimeout=slotTimeout, required=True, **options))
+            return True
+        except Exception as error:
+            LOGGER.info("Not holding %s: %s", light.mac, error)
+            return False
+
+    held = await asyncio.gather(*[hold(light) for light in lights])
+    return [light for light, isHeld in zip(lights, held) if isHeld]
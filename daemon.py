@@ -0,0 +1,284 @@
+"""Control daemon: holds persistent connections to a set of lights and takes commands over a local socket
+
+When there are more lights than connection slots they can't all be held: they are connected on demand instead, the
+least recently used light being disconnected to make room.
+
+Every line a client sends is either one JSON command, a JSON list of commands (run concurrently, answered together) or
+a plain text command "cmd light args...". Every line gets one JSON line back, with each command's completion time in
+milliseconds measured from when the line was read. Commands:
+
+  {"cmd": "color", "light": "desk", "rgb": [255, 0, 0], "brightness": 200}
+  {"cmd": "white", "light": "desk", "brightness": 200, "kelvin": 4400}
+  {"cmd": "brightness", "light": "desk", "brightness": 100}
+  {"cmd": "effect", "light": "desk", "effect": "Candlelight", "brightness": 150}
+  {"cmd": "transition", "light": ["desk", "key"], "rgb": [0, 0, 255], "brightness": 255, "duration": 2.5}
+  {"cmd": "transition", "light": "*", "kelvin": 3200, "brightness": 60, "duration": 10, "wait": true}
+  {"cmd": "transition", "light": "desk", "rgb": [255, 0, 0], "duration": 3, "easing": "ease_in_out", "interpolation": "oklab"}
+  {"cmd": "on" | "off" | "stop" | "state" | "status" | "metrics", "light": "desk"}
+  {"cmd": "list"}
+
+"light" is a name, a list of names or "*" for every light. An "id" is echoed back in the reply. Brightness is 0-255."""
+from contextlib import AsyncExitStack
+import asyncio
+import json
+import logging
+import math
+import time
+
+from .NeewerLight import NeewerLight, NEEWER_MIN_TEMPERATURE, NEEWER_MAX_TEMPERATURE, COLOUR_MODE_WHITE
+from .adapters import AdapterPool, localAdapters
+from .colour import EASINGS, EASING_LINEAR, INTERPOLATIONS, INTERPOLATION_OKLCH
+from .discovery import DiscoveryService
+from .planner import planTransition, planWhiteTransition
+from .transition import TransitionController
+
+LOGGER = logging.getLogger("NeewerLightDaemon")
+LOGGER.setLevel(logging.INFO)
+
+# lights stay connected for the daemon's whole life (or until evicted for another light), never for being idle
+PERSISTENT_IDLE_TIMEOUT = float("inf")
+
+
+class CommandError(Exception):
+    """A malformed command or one for an unknown light, reported back to the client"""
+
+
+class ControlDaemon:
+    def __init__(self, lights, streaming=False, maxConnections=None, adapters=None, clientFactory=None, connectionManager=None):
+        """lights maps name -> MAC address. clientFactory and connectionManager replace the real Bluetooth stack, e.g.
+        with benchmarks/simulator.py"""
+        adapters = adapters if adapters is not None else localAdapters()
+        self.discovery = DiscoveryService(adapters=adapters)
+        poolOptions = {} if maxConnections is None else {"maxConnections": maxConnections}
+        self.connections = connectionManager or AdapterPool(adapters, discovery=self.discovery, **poolOptions)
+        lightOptions = {} if clientFactory is None else {"clientFactory": clientFactory}
+        self.lights = {name: NeewerLight(mac, streaming=streaming, connectionManager=self.connections,
+                                         idleTimeout=PERSISTENT_IDLE_TIMEOUT, discovery=self.discovery, **lightOptions)
+                       for name, mac in lights.items()}
+        self.transitions = {name: TransitionController(light) for name, light in self.lights.items()}
+        self._stack = AsyncExitStack()
+        self._servers = []
+        self.stats = {"clients": 0, "lines": 0, "commands": 0, "errors": 0}
+
+    async def start(self, unixPath=None, host=None, port=None):
+        self.connections.start()
+        if len(self.lights) <= self.connections.capacity:
+            # connect everything up front so the first command from the desk doesn't pay for a connect
+            await asyncio.gather(*[self._stack.enter_async_context(light.keepConnected()) for light in self.lights.values()])
+        else:
+            # a held light can't be evicted, so holding some would leave the others without a slot
+            LOGGER.warning("%d lights share %d connection slots, connecting them on demand", len(self.lights),
+                           self.connections.capacity)
+        if unixPath is not None:
+            self._servers.append(await asyncio.start_unix_server(self._serve, path=unixPath))
+            LOGGER.info("Listening on %s", unixPath)
+        if port is not None:
+            self._servers.append(await asyncio.start_server(self._serve, host, port))
+            LOGGER.info("Listening on %s:%s", host, port)
+
+    async def stop(self):
+        for server in self._servers:
+            server.close()
+            await server.wait_closed()
+        for transitions in self.transitions.values():
+            await transitions.stop()
+        await self._stack.aclose()
+        for light in self.lights.values():
+            await light.disconnect()
+        await self.connections.stop()
+
+    async def _serve(self, reader, writer):
+        self.stats["clients"] += 1
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                line = line.strip()
+                if not line:
+                    continue
+                writer.write(json.dumps(await self.handleLine(line.decode())).encode() + b"\n")
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def handleLine(self, line):
+        """One reply per line: a result dict, or a list of them for a batch"""
+        received = time.monotonic()
+        self.stats["lines"] += 1
+        try:
+            request = json.loads(line) if line[0] in "{[" else self.parseText(line)
+        except (ValueError, CommandError) as error:
+            self.stats["errors"] += 1
+            return {"ok": False, "error": "Unparseable command: %s" % error}
+        if isinstance(request, list):
+            results = await asyncio.gather(*[self.execute(command, received) for command in request])
+            return {"ok": all(result["ok"] for result in results), "results": results, "ms": _elapsedMs(received)}
+        return await self.execute(request, received)
+
+    @staticmethod
+    def parseText(line):
+        """"color desk 255 0 0 [brightness]", "white desk brightness [kelvin]", "effect desk Name [brightness]",
+        "brightness desk value", "transition desk r g b brightness duration", "on desk", "list"..."""
+        words = line.split()
+        command = {"cmd": words[0].lower()}
+        if len(words) > 1:
+            command["light"] = words[1]
+        args = words[2:]
+        try:
+            if command["cmd"] == "color":
+                command["rgb"] = [int(value) for value in args[:3]]
+                if len(args) > 3:
+                    command["brightness"] = int(args[3])
+            elif command["cmd"] == "white":
+                command["brightness"] = int(args[0])
+                if len(args) > 1:
+                    command["kelvin"] = int(args[1])
+            elif command["cmd"] == "brightness":
+                command["brightness"] = int(args[0])
+            elif command["cmd"] == "effect":
+                command["effect"] = " ".join(word for word in args if not word.isdigit())
+                if args and args[-1].isdigit():
+                    command["brightness"] = int(args[-1])
+            elif command["cmd"] == "transition":
+                command["rgb"] = [int(value) for value in args[:3]]
+                command["brightness"] = int(args[3])
+                command["duration"] = float(args[4])
+        except (IndexError, ValueError):
+            raise CommandError("Wrong arguments for "+command["cmd"]) from None
+        return command
+
+    def _targets(self, command):
+        names = command.get("light")
+        if names == "*":
+            return list(self.lights.items())
+        if names is None:
+            raise CommandError("No light given")
+        if isinstance(names, str):
+            names = [names]
+        unknown = [name for name in names if name not in self.lights]
+        if unknown:
+            raise CommandError("Unknown light(s): "+", ".join(unknown))
+        return [(name, self.lights[name]) for name in names]
+
+    async def execute(self, command, received=None):
+        received = received if received is not None else time.monotonic()
+        self.stats["commands"] += 1
+        reply = {"id": command.get("id")} if isinstance(command, dict) and "id" in command else {}
+        try:
+            if not isinstance(command, dict) or "cmd" not in command:
+                raise CommandError("Commands are objects with a \"cmd\"")
+            if command["cmd"] == "list":
+                result = {name: self._state(light) for name, light in self.lights.items()}
+            else:
+                targets = self._targets(command)
+                results = await asyncio.gather(*[self._run(name, light, command) for name, light in targets])
+                result = dict(zip([name for name, _ in targets], results))
+            reply.update(ok=True, result=result)
+        except Exception as error:
+            self.stats["errors"] += 1
+            reply.update(ok=False, error=str(error) or type(error).__name__)
+        reply["ms"] = _elapsedMs(received)
+        return reply
+
+    async def _run(self, name, light, command):
+        cmd = command["cmd"]
+        transitions = self.transitions[name]
+        if cmd in ("color", "white", "brightness", "effect", "off"):
+            await transitions.stop() # an immediate command always wins over a running fade
+        if cmd == "on":
+            await light.turn_on()
+        elif cmd == "off":
+            await light.turn_off()
+        elif cmd == "color":
+            return await light.set_color(tuple(command["rgb"]), command.get("brightness"))
+        elif cmd == "white":
+            return await light.set_white(command.get("brightness", light.brightness), command.get("kelvin"))
+        elif cmd == "brightness":
+            return await light.set_brightness(command["brightness"])
+        elif cmd == "effect":
+            return await light.set_effect(command["effect"], command.get("brightness"))
+        elif cmd == "transition":
+            # checked up front, as an error planning inside the transition's task would never reach the client
+            args = self._transitionArgs(command)
+            task = await transitions.start(lambda: self._plan(light, args))
+            if command.get("wait"):
+                return await task
+        elif cmd == "stop":
+            await transitions.stop()
+        elif cmd == "status":
+            await light.readStatus()
+            return self._state(light)
+        elif cmd == "state":
+            return self._state(light)
+        elif cmd == "metrics":
+            return {"metrics": light.metrics.asDict(), "write_counters": light.write_counters, "health": light.health.asDict()}
+        else:
+            raise CommandError("Unknown command: "+str(cmd))
+        return True
+
+    @staticmethod
+    def _transitionArgs(command):
+        """A transition command's arguments, parsed and range checked"""
+        if "duration" not in command:
+            raise CommandError("A transition needs a duration")
+        duration = command["duration"]
+        if isinstance(duration, bool) or not isinstance(duration, (int, float)) or not math.isfinite(duration) or duration < 0:
+            raise CommandError("duration must be a number of seconds, 0 or more")
+        args = {"duration": float(duration), "easing": command.get("easing", EASING_LINEAR),
+                "interpolation": command.get("interpolation", INTERPOLATION_OKLCH)}
+        if args["easing"] not in EASINGS:
+            raise CommandError("Unknown easing, expected one of "+", ".join(EASINGS))
+        if args["interpolation"] not in INTERPOLATIONS:
+            raise CommandError("Unknown interpolation, expected one of "+", ".join(INTERPOLATIONS))
+        if "kelvin" in command:
+            args["kelvin"] = _integer(command, "kelvin", NEEWER_MIN_TEMPERATURE, NEEWER_MAX_TEMPERATURE)
+        elif "rgb" in command:
+            rgb = command["rgb"]
+            if not isinstance(rgb, list) or len(rgb) != 3 or not all(_isInteger(value) and 0 <= value <= 255 for value in rgb):
+                raise CommandError("rgb must be three integers 0-255")
+            args["rgb"] = tuple(rgb)
+        else:
+            raise CommandError("A transition needs rgb or kelvin")
+        if "brightness" in command:
+            args["brightness"] = _integer(command, "brightness", 0, 255)
+        return args
+
+    @staticmethod
+    def _plan(light, args):
+        brightness = args.get("brightness", light.brightness)
+        shape = {"easing": args["easing"], "interpolation": args["interpolation"]}
+        if "kelvin" in args:
+            return planWhiteTransition(light.colour_temp, light.brightness, args["kelvin"], brightness, args["duration"],
+                                       startInWhite=light.colour_mode == COLOUR_MODE_WHITE and light.effect is None, **shape)
+        return planTransition(light.rgb_color, light.brightness, args["rgb"], brightness, args["duration"], **shape)
+
+    @staticmethod
+    def _state(light):
+        return {
+            "available": light.available,
+            "connected": light.isConnected,
+            "on": light.is_on,
+            "mode": light.colour_mode,
+            "rgb": list(light.rgb_color),
+            "kelvin": light.colour_temp,
+            "brightness": light.brightness,
+            "effect": light.effect,
+        }
+
+
+def _isInteger(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _integer(command, key, low, high):
+    value = command[key]
+    if not _isInteger(value) or not low <= value <= high:
+        raise CommandError("%s must be an integer %d-%d" % (key, low, high))
+    return value
+
+
+def _elapsedMs(since):
+    return round((time.monotonic() - since) * 1000, 3)
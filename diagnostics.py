@@ -0,0 +1,44 @@
+from __future__ import annotations
+
+from typing import Any
+
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.core import HomeAssistant
+
+from . import DOMAIN, CONNECTIONS, POLLER, get_worker, light_services
+
+
+async def async_get_config_entry_diagnostics(hass: HomeAssistant, entry: ConfigEntry) -> dict[str, Any]:
+    """Latency histograms and health counters, to find which light or adapter is the bottleneck."""
+    instance = hass.data[DOMAIN][entry.entry_id]
+    worker = get_worker(hass, instance)
+    services = light_services(hass, instance)
+    if worker is None:
+        return _snapshot(instance, services, worker)
+    # a light on the worker changes its metrics and connection tables on the worker's loop, so read them there
+    return await worker.call(_snapshot, instance, services, worker)
+
+
+def _snapshot(instance, services: dict, worker) -> dict[str, Any]:
+    connections = services.get(CONNECTIONS)
+    poller = services.get(POLLER)
+    return {
+        "adapter": instance.adapter,
+        "ble_worker": worker is not None,
+        "streaming": instance.streaming,
+        "connected": instance.isConnected,
+        "health": instance.health.asDict(),
+        "write_counters": instance.write_counters,
+        "metrics": instance.metrics.asDict(),
+        "adapters": {
+            **connections.stats,
+            **{str(adapter): {
+                "max_connections": connections.manager(adapter).maxConnections,
+                "lights": connections.load(adapter),
+                "connected": len(connections.manager(adapter).connected),
+                **connections.manager(adapter).stats,
+                "scheduler": connections.manager(adapter).scheduler.asDict(),
+            } for adapter in connections.adapters},
+        } if connections is not None else None,
+        "poller": dict(poller.stats) if poller is not None else None,
+    }
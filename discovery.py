@@ -0,0 +1,149 @@
+from contextlib import asynccontextmanager
+from typing import NamedTuple, Optional
+import asyncio
+import logging
+import time
+
+from bleak import BleakScanner
+
+LOGGER = logging.getLogger("NeewerLightDiscovery")
+LOGGER.setLevel(logging.WARN)
+
+NEEWER_SERVICE_UUID = "69400001-b5a3-f393-e0a9-e50e24dcca99"
+NEEWER_NAME_PREFIXES = ("neewer", "laurie")
+
+ADVERTISEMENT_TTL = 60.0 # seconds an advertisement stays usable
+DISCOVERY_TIMEOUT = 5.0
+SETTLE_TIME = 0.5 # keep scanning this long after the first light is seen, to pick up the others
+
+
+class Advertisement(NamedTuple):
+    device: object # bleak BLEDevice
+    rssi: int
+    seen: float # monotonic
+    adapter: Optional[str] = None # the adapter that heard it, None for bleak's default
+
+
+def isNeewerAdvertisement(device, advertisementData) -> bool:
+    uuids = getattr(advertisementData, "service_uuids", None) or []
+    if NEEWER_SERVICE_UUID in (uuid.lower() for uuid in uuids):
+        return True
+    name = device.name or getattr(advertisementData, "local_name", None)
+    return name is not None and name.lower().startswith(NEEWER_NAME_PREFIXES)
+
+
+class DiscoveryService:
+    """Scans for Neewer lights and remembers recent advertisements
+
+    The scanner only runs while someone is waiting on it and stops as soon as they have what they asked for, so a
+    light that is advertising is found in well under a second. A recently seen light is found from the cache without
+    scanning at all, and its BLEDevice can be handed straight to BleakClient. With several adapters every one
+    of them scans, and the signal strength each one hears a light at is kept for adapters.AdapterPool."""
+
+    def __init__(self, ttl=ADVERTISEMENT_TTL, adapters=None):
+        self.ttl = ttl
+        self.adapters = adapters or [None]
+        self._cache = {} # upper case address -> {adapter: Advertisement}
+        self._waiters = {} # upper case address -> futures waiting for it to be seen
+        self._seen = asyncio.Event()
+        self._scanners = []
+        self._scanUsers = 0
+        self._scanLock = asyncio.Lock()
+
+    def _onDetection(self, device, advertisementData, adapter=None):
+        if not isNeewerAdvertisement(device, advertisementData):
+            return
+        address = device.address.upper()
+        rssi = getattr(advertisementData, "rssi", None)
+        if rssi is None:
+            rssi = getattr(device, "rssi", 0)
+        self._cache.setdefault(address, {})[adapter] = Advertisement(device, rssi, time.monotonic(), adapter)
+        self._seen.set()
+        for future in self._waiters.pop(address, []):
+            if not future.done():
+                future.set_result(device)
+
+    def _fresh(self, address):
+        cutoff = time.monotonic() - self.ttl
+        return [advertisement for advertisement in self._cache.get(address.upper(), {}).values() if advertisement.seen >= cutoff]
+
+    def recent(self):
+        """Advertisements seen within the TTL (the loudest one per light), strongest signal first"""
+        fresh = [self.advertisement(address) for address in self._cache]
+        return sorted([advertisement for advertisement in fresh if advertisement is not None],
+                      key=lambda advertisement: advertisement.rssi, reverse=True)
+
+    def advertisement(self, address, adapter=None):
+        """The latest advertisement the adapter heard within the TTL, or the loudest one any adapter heard"""
+        fresh = self._fresh(address)
+        if adapter is not None:
+            fresh = [advertisement for advertisement in fresh if advertisement.adapter == adapter]
+        return max(fresh, key=lambda advertisement: advertisement.rssi, default=None)
+
+    def rssiByAdapter(self, address):
+        return {advertisement.adapter: advertisement.rssi for advertisement in self._fresh(address)}
+
+    def cached(self, address, adapter=None):
+        """The BLEDevice for a recently seen light, or None"""
+        advertisement = self.advertisement(address, adapter)
+        return advertisement.device if advertisement is not None else None
+
+    def _createScanner(self, adapter):
+        if adapter is None:
+            scanner = BleakScanner()
+        else:
+            scanner = BleakScanner(adapter=adapter)
+        scanner.register_detection_callback(lambda device, advertisementData: self._onDetection(device, advertisementData, adapter))
+        return scanner
+
+    @asynccontextmanager
+    async def _scanning(self):
+        async with self._scanLock:
+            if self._scanUsers == 0:
+                self._scanners = [self._createScanner(adapter) for adapter in self.adapters]
+                await asyncio.gather(*[scanner.start() for scanner in self._scanners])
+            self._scanUsers += 1
+        try:
+            yield
+        finally:
+            async with self._scanLock:
+                self._scanUsers -= 1
+                if self._scanUsers == 0:
+                    await asyncio.gather(*[scanner.stop() for scanner in self._scanners], return_exceptions=True)
+                    self._scanners = []
+
+    async def find(self, address, timeout=DISCOVERY_TIMEOUT):
+        """The BLEDevice for a light, from the cache or by scanning until it's seen. None if it isn't found in time"""
+        device = self.cached(address)
+        if device is not None:
+            return device
+        future = asyncio.get_event_loop().create_future()
+        waiters = self._waiters.setdefault(address.upper(), [])
+        waiters.append(future)
+        try:
+            async with self._scanning():
+                return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            LOGGER.debug("%s not seen within %ss", address, timeout)
+            return None
+        finally:
+            if future in waiters:
+                waiters.remove(future)
+            if not waiters and self._waiters.get(address.upper()) is waiters:
+                del self._waiters[address.upper()]
+
+    async def discover(self, timeout=DISCOVERY_TIMEOUT, settle=SETTLE_TIME):
+        """Lights advertising now or within the TTL. It always scans, so a light switched on since the last scan is
+        found too, but with lights already in the cache it only scans for settle rather than waiting for a first one"""
+        LOGGER.debug("Discovering devices...")
+        self._seen.clear()
+        async with self._scanning():
+            try:
+                if not self.recent():
+                    await asyncio.wait_for(self._seen.wait(), timeout)
+                await asyncio.sleep(settle)
+            except asyncio.TimeoutError:
+                pass
+        devices = [advertisement.device for advertisement in self.recent()]
+        LOGGER.debug("Discovered devices: %s", [{"address": device.address, "name": device.name} for device in devices])
+        return devices
@@ -0,0 +1,83 @@
+import logging
+import time
+
+LOGGER = logging.getLogger("NeewerLightHealth")
+LOGGER.setLevel(logging.WARN)
+
+HEALTH_HEALTHY = "healthy"
+HEALTH_DEGRADED = "degraded" # recent failures, reconnects are retried after a backoff
+HEALTH_OPEN = "open" # unreachable, commands fail fast until a background probe reconnects
+
+FAILURE_THRESHOLD = 3 # consecutive failures before the circuit opens
+BACKOFF_BASE = 1.0 # seconds before the first retry, doubling with every failure
+BACKOFF_MAX = 300.0
+
+
+class LightUnavailableError(Exception):
+    """The light's circuit is open, the command was not attempted"""
+
+
+class CircuitBreaker:
+    """Connection health of one light
+
+    Every connect or write failure doubles the time before the next reconnect may be attempted. After FAILURE_THRESHOLD
+    failures in a row the circuit opens: commands are no longer attempted at all, and only a background probe tries to
+    reconnect. Any success closes the circuit again."""
+
+    def __init__(self, failureThreshold=FAILURE_THRESHOLD, backoffBase=BACKOFF_BASE, backoffMax=BACKOFF_MAX):
+        self.failureThreshold = failureThreshold
+        self.backoffBase = backoffBase
+        self.backoffMax = backoffMax
+        self.failures = 0 # consecutive
+        self.retryAt = 0.0 # monotonic
+        self.lastError = None
+        self.stats = {"failures": 0, "opened": 0, "rejected": 0}
+
+    @property
+    def state(self):
+        if self.failures == 0:
+            return HEALTH_HEALTHY
+        if self.failures < self.failureThreshold:
+            return HEALTH_DEGRADED
+        return HEALTH_OPEN
+
+    @property
+    def isOpen(self):
+        return self.failures >= self.failureThreshold
+
+    @property
+    def retryIn(self):
+        """Seconds until the next reconnect attempt is allowed"""
+        return max(self.retryAt - time.monotonic(), 0.0)
+
+    @property
+    def backoff(self):
+        return min(self.backoffBase * 2 ** max(self.failures - 1, 0), self.backoffMax) if self.failures else 0.0
+
+    def recordSuccess(self) -> bool:
+        """Returns True if this changed the state"""
+        changed = self.failures > 0
+        self.failures = 0
+        self.retryAt = 0.0
+        self.lastError = None
+        return changed
+
+    def recordFailure(self, error) -> bool:
+        """Returns True if this changed the state"""
+        before = self.state
+        self.failures += 1
+        self.stats["failures"] += 1
+        self.lastError = repr(error)
+        self.retryAt = time.monotonic() + self.backoff
+        if self.failures == self.failureThreshold:
+            self.stats["opened"] += 1
+        return self.state != before
+
+    def asDict(self):
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "retry_in_s": round(self.retryIn, 3),
+            "last_error": self.lastError,
+            **self.stats,
+        }
@@ -1,21 +1,57 @@
 import asyncio
 import logging
-import time
 
 import voluptuous as vol
 from typing import Any, Optional, Tuple
 
-from .NeewerLight import NeewerLight
+from .NeewerLight import (NeewerLight, NEEWER_SCENES, NEEWER_MIN_TEMPERATURE, NEEWER_MAX_TEMPERATURE,
+						  COLOUR_MODE_RGB, COLOUR_MODE_WHITE)
+from .colour import EASINGS, EASING_LINEAR, INTERPOLATIONS, INTERPOLATION_OKLCH
+from .planner import planTransition, planWhiteTransition
+from .trace import TracePlayer, TraceReader, TraceRecorder, playHeld
+from .transition import GroupTransition, TransitionController, playGroup
+from .worker import threadsafe
+from . import POLLER, get_worker, light_services
 
-from homeassistant.const import CONF_MAC
+from homeassistant.const import CONF_MAC, STATE_ON
 import homeassistant.helpers.config_validation as cv
+from homeassistant.helpers.service import async_extract_entity_ids
 from homeassistant.components.light import (COLOR_MODE_RGB, PLATFORM_SCHEMA,
-											LightEntity, ATTR_RGB_COLOR, ATTR_BRIGHTNESS, COLOR_MODE_WHITE, ATTR_WHITE, SUPPORT_TRANSITION, ATTR_TRANSITION)
-from homeassistant.util.color import (match_max_scale)
+											LightEntity, ATTR_RGB_COLOR, ATTR_BRIGHTNESS, COLOR_MODE_WHITE, ATTR_WHITE, SUPPORT_TRANSITION, ATTR_TRANSITION,
+											SUPPORT_EFFECT, ATTR_EFFECT, COLOR_MODE_COLOR_TEMP, ATTR_COLOR_TEMP)
+from homeassistant.util.color import (match_max_scale, color_temperature_kelvin_to_mired, color_temperature_mired_to_kelvin)
 from homeassistant.helpers import device_registry
+from homeassistant.helpers.restore_state import RestoreEntity
 from homeassistant.core import callback
+from homeassistant.exceptions import HomeAssistantError
 
 DOMAIN = "neewerlight"
+ENTITIES = "neewerlight_entities" # hass.data key, entity_id -> NeewerLightEntity
+
+SERVICE_GROUP_TRANSITION = "group_transition"
+ATTR_EASING = "easing"
+ATTR_INTERPOLATION = "interpolation"
+GROUP_TRANSITION_SCHEMA = cv.make_entity_service_schema({
+	vol.Required(ATTR_RGB_COLOR): vol.All(vol.ExactSequence((cv.byte,)*3), vol.Coerce(tuple)),
+	vol.Optional(ATTR_BRIGHTNESS): cv.byte,
+	vol.Required(ATTR_TRANSITION): vol.All(vol.Coerce(float), vol.Range(min=0)),
+	vol.Optional(ATTR_EASING, default=EASING_LINEAR): vol.In(list(EASINGS)),
+	vol.Optional(ATTR_INTERPOLATION, default=INTERPOLATION_OKLCH): vol.In(INTERPOLATIONS),
+})
+
+SERVICE_RECORD_TRACE = "record_trace"
+SERVICE_PLAY_TRACE = "play_trace"
+ATTR_PATH = "path"
+ATTR_DURATION = "duration"
+ATTR_TIME_SCALE = "time_scale"
+RECORD_TRACE_SCHEMA = cv.make_entity_service_schema({
+	vol.Required(ATTR_PATH): cv.string,
+	vol.Required(ATTR_DURATION): vol.All(vol.Coerce(float), vol.Range(min=0)),
+})
+PLAY_TRACE_SCHEMA = cv.make_entity_service_schema({
+	vol.Required(ATTR_PATH): cv.string,
+	vol.Optional(ATTR_TIME_SCALE, default=1.0): vol.All(vol.Coerce(float), vol.Range(min=0.01)),
+})
 
 #logging.basicConfig(level=logging.DEBUG)
 LOGGER = logging.getLogger("NeewerLightEntity")
@@ -28,27 +64,164 @@ PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend({
 
 async def async_setup_entry(hass, config_entry, async_add_devices):
 	instance = hass.data[DOMAIN][config_entry.entry_id]
-	async_add_devices([NeewerLightEntity(instance, config_entry.data["name"], config_entry.entry_id)])
-
-
-class NeewerLightEntity(LightEntity):
-	def __init__(self, lightInstance: NeewerLight, name: str, entry_id: str) -> None:
+	async_add_devices([NeewerLightEntity(instance, config_entry.data["name"], config_entry.entry_id, get_worker(hass, instance))])
+
+	if not hass.services.has_service(DOMAIN, SERVICE_GROUP_TRANSITION):
+		async def async_handle_group_transition(call):
+			entity_ids = await async_extract_entity_ids(hass, call)
+			entities = [entity for entity_id, entity in hass.data.get(ENTITIES, {}).items() if entity_id in entity_ids]
+			# lights on a BLE worker fade together on its loop, the rest on this one
+			await _async_onLightLoops(entities, lambda group: async_groupTransition(
+				group, call.data[ATTR_RGB_COLOR], call.data.get(ATTR_BRIGHTNESS), call.data[ATTR_TRANSITION],
+				easing=call.data[ATTR_EASING], interpolation=call.data[ATTR_INTERPOLATION]))
+
+		hass.services.async_register(DOMAIN, SERVICE_GROUP_TRANSITION, async_handle_group_transition, schema=GROUP_TRANSITION_SCHEMA)
+
+	if not hass.services.has_service(DOMAIN, SERVICE_RECORD_TRACE):
+		async def async_handle_record_trace(call):
+			entities = await _async_serviceEntities(hass, call)
+			await async_recordTrace(hass, entities, _tracePath(hass, call.data[ATTR_PATH]), call.data[ATTR_DURATION])
+
+		async def async_handle_play_trace(call):
+			entities = await _async_serviceEntities(hass, call)
+			await async_playTrace(hass, entities, _tracePath(hass, call.data[ATTR_PATH]), call.data[ATTR_TIME_SCALE])
+
+		hass.services.async_register(DOMAIN, SERVICE_RECORD_TRACE, async_handle_record_trace, schema=RECORD_TRACE_SCHEMA)
+		hass.services.async_register(DOMAIN, SERVICE_PLAY_TRACE, async_handle_play_trace, schema=PLAY_TRACE_SCHEMA)
+
+
+async def _async_serviceEntities(hass, call):
+	entity_ids = await async_extract_entity_ids(hass, call)
+	return [entity for entity_id, entity in hass.data.get(ENTITIES, {}).items() if entity_id in entity_ids]
+
+
+async def _async_onLightLoops(entities, makeCoroutine):
+	''' run makeCoroutine(entities) once for the entities on each loop, as a light on a BLE worker can only be driven
+	from the worker's loop '''
+	byWorker = {}
+	for entity in entities:
+		byWorker.setdefault(entity._worker, []).append(entity)
+	await asyncio.gather(*[makeCoroutine(group) if worker is None else worker.run(makeCoroutine(group))
+						   for worker, group in byWorker.items()])
+
+
+def _tracePath(hass, path):
+	''' relative paths are in the config directory, and like any file service the path has to be allowlisted '''
+	path = hass.config.path(path)
+	if not hass.config.is_allowed_path(path):
+		raise HomeAssistantError("Access to "+path+" is not allowed, add it to allowlist_external_dirs")
+	return path
+
+
+async def async_recordTrace(hass, entities, path, duration):
+	''' record every packet the lights are sent for the next duration seconds, returns straight away so the cues to
+	record can be run next '''
+	recorder = TraceRecorder()
+	recorder.start()
+	for entity in entities:
+		# numbered up front, so lights recording from a BLE worker's thread only ever append packets
+		recorder.lightIndex(entity._instance.address)
+	# a light's recorders are used by its writer, so they're attached and detached on the light's loop
+	removers = [(entity, await entity._async_callOnLightLoop(entity._instance.addRecorder, recorder)) for entity in entities]
+	LOGGER.info("Recording %d lights to %s for %ss", len(entities), path, duration)
+
+	async def finish():
+		await asyncio.sleep(duration)
+		for entity, remove in removers:
+			await entity._async_callOnLightLoop(remove)
+		await hass.async_add_executor_job(recorder.save, path)
+
+	hass.async_create_task(finish())
+
+
+async def async_playTrace(hass, entities, path, timeScale=1.0):
+	''' replay a recorded trace to the lights it was recorded from, or to the one selected light for a single light trace '''
+	try:
+		trace = await hass.async_add_executor_job(TraceReader, path)
+	except (OSError, ValueError) as error:
+		raise HomeAssistantError("Unable to read trace "+path+": "+str(error)) from error
+	try:
+		retarget = len(trace.addresses) == 1 and len(entities) == 1
+		await _async_onLightLoops(entities, lambda group: _async_playTraceTo(trace, group, timeScale, retarget))
+	finally:
+		trace.close()
+
+
+async def _async_playTraceTo(trace, entities, timeScale, retarget):
+	lights = {entity._instance.address: entity._instance for entity in entities}
+	if retarget:
+		lights = {trace.addresses[0]: entities[0]._instance}
+	player = TracePlayer(trace, lights, timeScale)
+	playing = [entity for entity in entities if entity._instance in player.lights]
+	for entity in playing:
+		# like a group transition, a new command for a light drops it from the playback
+		await entity._transitions.joinPlayback(player)
+	LOGGER.info("Playing trace %s to %d lights", trace.path, len(playing))
+	try:
+		await playHeld(player)
+	finally:
+		for entity in playing:
+			entity._writeState()
+
+
+async def async_groupTransition(entities, endColor, endBrightness, transition, msPerFrame=40, easing=EASING_LINEAR,
+								interpolation=INTERPOLATION_OKLCH):
+	''' fade several lights together from one scheduler so they stay in lockstep, leaving out any that are
+	unavailable or fail to turn on '''
+	for entity in entities:
+		if not entity.available:
+			LOGGER.warning("Leaving %s out of the group transition, it's unavailable", entity.entity_id)
+	entities = [entity for entity in entities if entity.available]
+	turningOn = [entity for entity in entities if not entity.is_on]
+	results = await asyncio.gather(*[entity._instance.turn_on() for entity in turningOn], return_exceptions=True)
+	failed = []
+	for entity, result in zip(turningOn, results):
+		if isinstance(result, Exception):
+			LOGGER.warning("Leaving %s out of the group transition, it didn't turn on: %s", entity.entity_id, result)
+			failed.append(entity)
+	entities = [entity for entity in entities if entity not in failed]
+	if not entities:
+		LOGGER.warning("No lights available for the group transition")
+		return
+
+	group = GroupTransition(msPerFrame)
+	for entity in entities:
+		# each light stops its own transition first, and a new command for it later cancels its part of the group
+		await entity._transitions.stop()
+		originalColor, originalBrightness = entity._transitionStart()
+		brightness = originalBrightness if endBrightness is None else endBrightness
+		await entity._transitions.joinGroup(group, planTransition(originalColor, originalBrightness, endColor, brightness, transition, msPerFrame,
+																  easing, interpolation))
+	LOGGER.info("Starting group transition of %d lights to %s %s with time %s", len(group), endColor, endBrightness, transition)
+	try:
+		# lights are connected before the first tick, as many as there are connection slots for
+		await playGroup(group)
+	finally:
+		for entity in entities:
+			entity._writeState()
+
+
+class NeewerLightEntity(LightEntity, RestoreEntity):
+	def __init__(self, lightInstance: NeewerLight, name: str, entry_id: str, worker=None) -> None:
 		self._instance = lightInstance
 		self._entry_id = entry_id
-		self._attr_supported_color_modes = {COLOR_MODE_RGB, COLOR_MODE_WHITE}
-		self._attr_supported_features = SUPPORT_TRANSITION
+		self._worker = worker # the BleWorker the light runs on, None for this loop
+		self._writeState = self.async_write_ha_state # made callable from the worker once added to hass
+		self._attr_supported_color_modes = {COLOR_MODE_RGB, COLOR_MODE_COLOR_TEMP, COLOR_MODE_WHITE}
+		self._attr_min_mireds = color_temperature_kelvin_to_mired(NEEWER_MAX_TEMPERATURE)
+		self._attr_max_mireds = color_temperature_kelvin_to_mired(NEEWER_MIN_TEMPERATURE)
+		self._attr_supported_features = SUPPORT_TRANSITION | SUPPORT_EFFECT
+		self._attr_effect_list = list(NEEWER_SCENES)
 		self._color_mode = None
 		self._attr_name = name
 		self._attr_unique_id = self._instance.mac
-		self._isTransitioning = asyncio.Event()
-		self._stopTransition = asyncio.Event()
-		self._hasExitedTransition = asyncio.Event()
-		self._transitionQueueCounter = 0
+		self._transitions = TransitionController(self._instance)
 		self._fade_time = 0.0
+		self._removeHealthListener = None
 
 	@property
 	def available(self):
-		return self._instance.is_on != None
+		return self._instance.available
 
 	@property
 	def brightness(self):
@@ -70,6 +243,59 @@ class NeewerLightEntity(LightEntity):
 	def fade_time(self, value):
 		self._fade_time = value
 
+	async def async_added_to_hass(self) -> None:
+		await super().async_added_to_hass()
+		self.hass.data.setdefault(ENTITIES, {})[self.entity_id] = self
+		self._writeState = threadsafe(self.hass.loop, self.async_write_ha_state)
+		restored = await self._async_restoreState()
+		poller = light_services(self.hass, self._instance).get(POLLER)
+		if poller is not None:
+			# status reads are spread out by the shared scheduler rather than HA polling every light at once. A light with
+			# restored state waits for the startup delay, a new one is read straight away
+			await self._async_callOnLightLoop(poller.add, self._instance, lambda: self._transitions.isRunning, self._writeState,
+											  delay=None if restored else 0)
+		self._removeHealthListener = self._instance.addHealthListener(self._writeState)
+
+	async def async_will_remove_from_hass(self) -> None:
+		self.hass.data.get(ENTITIES, {}).pop(self.entity_id, None)
+		poller = light_services(self.hass, self._instance).get(POLLER)
+		if poller is not None:
+			await self._async_callOnLightLoop(poller.remove, self._instance)
+		if self._removeHealthListener is not None:
+			self._removeHealthListener()
+			self._removeHealthListener = None
+
+	async def _async_restoreState(self):
+		''' start from the state saved at shutdown rather than off and black until the light has been read '''
+		lastState = await self.async_get_last_state()
+		if lastState is None:
+			return False
+		attributes = lastState.attributes
+		colorTemp = attributes.get(ATTR_COLOR_TEMP)
+		rgb = attributes.get(ATTR_RGB_COLOR)
+		colorMode = attributes.get("color_mode") # only saved while the light was on
+		await self._async_callOnLightLoop(self._instance.restore_state,
+			lastState.state == STATE_ON,
+			rgb=tuple(rgb) if rgb is not None else None,
+			brightness=attributes.get(ATTR_BRIGHTNESS),
+			temperature=color_temperature_mired_to_kelvin(colorTemp) if colorTemp else None,
+			effect=attributes.get(ATTR_EFFECT),
+			colourMode=None if colorMode is None else COLOUR_MODE_WHITE if colorMode == COLOR_MODE_COLOR_TEMP else COLOUR_MODE_RGB)
+		LOGGER.debug("%s: restored %s", self.entity_id, lastState)
+		return True
+
+	async def _async_onLightLoop(self, coroutine):
+		''' light I/O and transitions run on the light's BLE worker when it has one '''
+		if self._worker is None:
+			return await coroutine
+		return await self._worker.run(coroutine)
+
+	async def _async_callOnLightLoop(self, function, *args, **kwargs):
+		''' plain function equivalent of _async_onLightLoop '''
+		if self._worker is None:
+			return function(*args, **kwargs)
+		return await self._worker.call(function, *args, **kwargs)
+
 	@callback
 	def _schedule_immediate_update(self):
 		self.async_schedule_update_ha_state(True)
@@ -85,8 +311,18 @@ class NeewerLightEntity(LightEntity):
 			return match_max_scale((255,), self._instance.rgb_color)
 		return None
 
+	@property
+	def color_temp(self):
+		return color_temperature_kelvin_to_mired(self._instance.colour_temp)
+
+	@property
+	def effect(self):
+		return self._instance.effect
+
 	@property
 	def color_mode(self):
+		if self._instance.colour_mode == COLOUR_MODE_WHITE:
+			return COLOR_MODE_COLOR_TEMP
 		return COLOR_MODE_RGB
 
 	@property
@@ -116,19 +352,31 @@ class NeewerLightEntity(LightEntity):
 		return res
 
 	async def async_turn_on(self, **kwargs: Any) -> None:
+		await self._async_onLightLoop(self._async_applyTurnOn(**kwargs))
+		self.async_schedule_update_ha_state()
+
+	async def _async_applyTurnOn(self, **kwargs: Any) -> None:
 		if not self.is_on:
 			await self._instance.turn_on()
 
 		transition = kwargs.get(ATTR_TRANSITION,self._fade_time)
 
-		if ATTR_WHITE in kwargs:
-			if kwargs[ATTR_WHITE] != self.brightness:
+		if ATTR_EFFECT in kwargs:
+			await self._async_setEffect(kwargs[ATTR_EFFECT], kwargs.get(ATTR_BRIGHTNESS, self.brightness or 255))
+
+		elif ATTR_COLOR_TEMP in kwargs:
+			LOGGER.info("Colour temperature change: %s", kwargs[ATTR_COLOR_TEMP])
+			temperature = color_temperature_mired_to_kelvin(kwargs[ATTR_COLOR_TEMP])
+			await self._async_setWhite(kwargs.get(ATTR_BRIGHTNESS, self.brightness), temperature, transition)
+
+		elif ATTR_WHITE in kwargs:
+			if kwargs[ATTR_WHITE] != self.brightness or self.color_mode != COLOR_MODE_COLOR_TEMP or self.effect is not None:
 				LOGGER.info("White set")
-				await self._async_turn_on(kwargs[ATTR_WHITE], (255,255,255), transition)
+				await self._async_setWhite(kwargs[ATTR_WHITE], None, transition)
 
 		elif ATTR_RGB_COLOR in kwargs:
 			LOGGER.info("Colour change: "+str(kwargs[ATTR_RGB_COLOR]))
-			if kwargs[ATTR_RGB_COLOR] != self.rgb_color:
+			if kwargs[ATTR_RGB_COLOR] != self.rgb_color or self.effect is not None:
 				#color = kwargs[ATTR_RGB_COLOR]
 				bright = self.brightness
 				if ATTR_BRIGHTNESS in kwargs:
@@ -139,81 +387,97 @@ class NeewerLightEntity(LightEntity):
 					#color = self._transform_color_brightness(color, self.brightness)
 				await self._async_turn_on(bright, kwargs[ATTR_RGB_COLOR], transition)
 
+		elif ATTR_BRIGHTNESS in kwargs and kwargs[ATTR_BRIGHTNESS] != self.brightness and self.effect is not None:
+			LOGGER.debug("Changing brightness of effect %s to %s", self.effect, kwargs[ATTR_BRIGHTNESS])
+			await self._async_setEffect(self.effect, kwargs[ATTR_BRIGHTNESS])
+
+		elif ATTR_BRIGHTNESS in kwargs and kwargs[ATTR_BRIGHTNESS] != self.brightness and self.color_mode == COLOR_MODE_COLOR_TEMP:
+			LOGGER.debug("Just changing brightness (of white) with brightness: %s with transition %s", kwargs[ATTR_BRIGHTNESS], transition)
+			await self._async_setWhite(kwargs[ATTR_BRIGHTNESS], None, transition)
+
 		elif ATTR_BRIGHTNESS in kwargs and kwargs[ATTR_BRIGHTNESS] != self.brightness and self.rgb_color != None:
 			LOGGER.debug("Just changing brightness (of coloured rgb) with brightness: "+str(kwargs[ATTR_BRIGHTNESS])+" with transition "+str(transition))
 			await self._async_turn_on(kwargs[ATTR_BRIGHTNESS], self.rgb_color, transition)
 
-		self.async_schedule_update_ha_state()
-
 	async def _async_turn_on(self, brightness, color, transition=0.0):
 		''' helper for controling whether to call doTransition or just set the color immediately '''
+		if self.effect is not None:
+			transition = 0.0 # there's no colour to fade from while the light is animating a scene
 		if transition==0.0:
-			if self._isTransitioning.is_set():
-				self._stopTransition.set()
-				LOGGER.info("Canceling transition due to new set-colour")
+			await self._transitions.stop()
 			await self._instance.set_color(color,brightness)
 		else:
-			asyncio.ensure_future(self.async_doTransition(brightness,color,transition))
+			await self.async_doTransition(brightness,color,transition)
+
+	async def _async_setWhite(self, brightness, temperature=None, transition=0.0):
+		''' white (CCT) mode equivalent of _async_turn_on, temperature in kelvin or None to keep the current one '''
+		if brightness is None:
+			brightness = 255
+		if self.effect is not None:
+			transition = 0.0
+		if transition==0.0:
+			await self._transitions.stop()
+			if temperature is None and self.color_mode == COLOR_MODE_COLOR_TEMP:
+				await self._instance.set_brightness(brightness) # the smaller brightness only packet
+			else:
+				await self._instance.set_white(brightness, temperature)
+		else:
+			await self.async_doWhiteTransition(brightness, temperature, transition)
 
-	async def async_doTransition(self, endBrightness, endColor, transition, msPerFrame=40):
-		if self._isTransitioning.is_set():
-			LOGGER.info("Awaiting transition finish due to new set-colour")
-			self._stopTransition.set()
-			self._transitionQueueCounter += 1
-			ticket = self._transitionQueueCounter # handles multiple transitions getting called and blocked at the same point
-			await self._hasExitedTransition.wait()
-			self._hasExitedTransition.clear()
-			if self._transitionQueueCounter != ticket:
-				LOGGER.info("Transition canceled by another waiting transition")
-				return # canceled by another newer transition
-		self._isTransitioning.set()
-		self._hasExitedTransition.clear() # if there was an already completed transition a while ago
-		LOGGER.info("Starting transition to "+str(endBrightness)+" "+str(endColor)+" with time "+str(transition)+", msPerFrame: "+str(msPerFrame))
-
-		numFrames = max(int(transition*1000/msPerFrame),1)
+	async def _async_setEffect(self, effect, brightness):
+		''' the light animates the scene itself, so this is one write however long it runs '''
+		if effect not in NEEWER_SCENES:
+			LOGGER.warning("Unknown effect: %s", effect)
+			return
+		await self._transitions.stop()
+		await self._instance.set_effect(effect, brightness)
+
+	def _transitionStart(self):
 		originalBrightness = self.brightness
 		originalColor = self.rgb_color
 		if originalColor is None:
 			originalColor = [0,0,0]
 		if originalBrightness is None:
 			originalBrightness = 0
+		return originalColor, originalBrightness
 
-		LOGGER.debug("Orig: "+str(originalColor)+" bright: "+str(originalBrightness))
-
-		for i in range(1,numFrames+1):
-			if self._stopTransition.is_set():
-				break
-			newColor = [
-				int(originalColor[0] + i * (endColor[0] - originalColor[0]) / numFrames),
-				int(originalColor[1] + i * (endColor[1] - originalColor[1]) / numFrames),
-				int(originalColor[2] + i * (endColor[2] - originalColor[2]) / numFrames)
-			]
-			newBrightness = int(originalBrightness + i*(endBrightness-originalBrightness) / numFrames)
-
-			LOGGER.debug("Loop: "+str(i)+"/"+str(numFrames)+" c "+str(newColor)+" b "+str(newBrightness))
-
-			timeStart = time.time()
-			if newColor != self.rgb_color or newBrightness != self.brightness:
-				await self._instance.set_color(newColor,newBrightness)
-			timeTaken = time.time() - timeStart
-			LOGGER.debug("took "+str(timeTaken)+" seconds to execute set_color")
-			if timeTaken*1000 < msPerFrame:
-				waitTime = msPerFrame/1000-timeTaken
-				LOGGER.debug("Waiting "+str(waitTime)+"ms")
-				await asyncio.sleep(waitTime)
-			else:
-				LOGGER.debug("msPerFrame exceeded due to long set_color, running as fast as possible")
-		LOGGER.info("Finished transition")
-
-		self._stopTransition.clear()
-		self._isTransitioning.clear()
-		self._hasExitedTransition.set()
-
-
+	async def async_doTransition(self, endBrightness, endColor, transition, msPerFrame=40):
+		''' replaces any running transition straight away, returns the task playing the new one '''
+		LOGGER.info("Starting transition to %s %s with time %s, msPerFrame: %s", endBrightness, endColor, transition, msPerFrame)
+
+		def makePlan():
+			# planned once the old transition has stopped, from wherever it got to
+			originalColor, originalBrightness = self._transitionStart()
+			LOGGER.debug("Orig: %s bright: %s", originalColor, originalBrightness)
+			# every frame is precomputed and frames that would send the same packet as the one before are already dropped
+			return planTransition(originalColor, originalBrightness, endColor, endBrightness, transition, msPerFrame)
+		return await self._async_startTransition(makePlan)
+
+	async def async_doWhiteTransition(self, endBrightness, endTemperature, transition, msPerFrame=40):
+		''' brightness and/or colour temperature fade sent as the small white mode packets '''
+		LOGGER.info("Starting white transition to %s %sK with time %s, msPerFrame: %s", endBrightness, endTemperature, transition, msPerFrame)
+
+		def makePlan():
+			originalBrightness = self.brightness or 0
+			originalTemperature = self._instance.colour_temp
+			temperature = originalTemperature if endTemperature is None else endTemperature
+			temperature = min(max(int(temperature), NEEWER_MIN_TEMPERATURE), NEEWER_MAX_TEMPERATURE)
+			return planWhiteTransition(originalTemperature, originalBrightness, temperature, endBrightness, transition,
+				msPerFrame, startInWhite=self.color_mode == COLOR_MODE_COLOR_TEMP and self.effect is None)
+		return await self._async_startTransition(makePlan)
+
+	async def _async_startTransition(self, makePlan):
+		task = await self._transitions.start(makePlan)
+		task.add_done_callback(lambda _: self._writeState())
+		return task
 
 	async def async_turn_off(self, **kwargs: Any) -> None:
-		await self._instance.turn_off()
+		await self._async_onLightLoop(self._async_applyTurnOff())
 		self.async_schedule_update_ha_state()
 
+	async def _async_applyTurnOff(self):
+		await self._transitions.stop()
+		await self._instance.turn_off()
+
 	async def async_update(self) -> None:
-		await self._instance.update()
+		await self._async_onLightLoop(self._instance.update())
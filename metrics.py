@@ -0,0 +1,124 @@
+import math
+import time
+
+HISTOGRAM_LOWEST = 0.0001 # seconds, anything faster lands in the first bucket
+HISTOGRAM_HIGHEST = 60.0
+HISTOGRAM_SUB_BUCKETS = 16
+
+
+class LatencyHistogram:
+    """HDR style latency histogram
+
+    Every power of two range above the lowest trackable value is split into the same number of linear sub-buckets, so
+    recording is O(1) with fixed memory and every percentile is accurate to within one sub-bucket (~6%)."""
+
+    def __init__(self, lowest=HISTOGRAM_LOWEST, highest=HISTOGRAM_HIGHEST, subBuckets=HISTOGRAM_SUB_BUCKETS):
+        self.lowest = lowest
+        self.subBuckets = subBuckets
+        self._counts = [0] * (subBuckets * math.ceil(math.log2(highest / lowest)) + 2)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def _index(self, value):
+        if value < self.lowest:
+            return 0
+        mantissa, exponent = math.frexp(value / self.lowest) # value / lowest = mantissa * 2**exponent, 0.5 <= mantissa < 1
+        index = (exponent - 1) * self.subBuckets + int((mantissa * 2 - 1) * self.subBuckets) + 1
+        return min(index, len(self._counts) - 1)
+
+    def _upperBound(self, index):
+        if index == 0:
+            return self.lowest
+        exponent, sub = divmod(index - 1, self.subBuckets)
+        return self.lowest * 2 ** exponent * (1 + (sub + 1) / self.subBuckets)
+
+    def record(self, value):
+        self._counts[self._index(value)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, percentile):
+        if not self.count:
+            return None
+        target = max(math.ceil(percentile / 100 * self.count), 1)
+        seen = 0
+        for index, bucketCount in enumerate(self._counts):
+            seen += bucketCount
+            if seen >= target:
+                return min(self._upperBound(index), self.max)
+        return self.max
+
+    def asDict(self):
+        """Summary in milliseconds"""
+        if not self.count:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total / self.count * 1000, 3),
+            "min_ms": round(self.min * 1000, 3),
+            "p50_ms": round(self.percentile(50) * 1000, 3),
+            "p95_ms": round(self.percentile(95) * 1000, 3),
+            "p99_ms": round(self.percentile(99) * 1000, 3),
+            "max_ms": round(self.max * 1000, 3),
+        }
+
+
+class LightMetrics:
+    """Latency histograms and health counters for one light"""
+
+    def __init__(self):
+        self.write = LatencyHistogram()
+        self.connect = LatencyHistogram()
+        self.read = LatencyHistogram()
+        self.frameLateness = LatencyHistogram()
+        self.connects = 0
+        self.reconnects = 0
+        self.readFailures = 0
+        self.lateFrames = 0
+        self.droppedFrames = 0 # due during a transition but never sent because the light was still busy
+        self.transitions = 0
+        self.lastTransition = None
+
+    def recordConnect(self, seconds):
+        self.connect.record(seconds)
+        if self.connects:
+            self.reconnects += 1
+        self.connects += 1
+
+    def recordTransition(self, sent, duration, late=0, dropped=0):
+        self.transitions += 1
+        self.lateFrames += late
+        self.droppedFrames += dropped
+        self.lastTransition = {
+            "finished": time.time(),
+            "duration_s": round(duration, 3),
+            "frames": sent,
+            "fps": round(sent / duration, 2) if duration > 0 else None,
+            "late": late,
+            "dropped": dropped,
+        }
+
+    @property
+    def effectiveFps(self):
+        return self.lastTransition["fps"] if self.lastTransition else None
+
+    def asDict(self):
+        return {
+            "write": self.write.asDict(),
+            "connect": self.connect.asDict(),
+            "read": self.read.asDict(),
+            "frame_lateness": self.frameLateness.asDict(),
+            "connects": self.connects,
+            "reconnects": self.reconnects,
+            "read_failures": self.readFailures,
+            "late_frames": self.lateFrames,
+            "dropped_frames": self.droppedFrames,
+            "transitions": self.transitions,
+            "last_transition": self.lastTransition,
+        }
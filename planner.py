@@ -0,0 +1,202 @@
+from typing import NamedTuple, Tuple
+import numpy as np
+
+from . import codec
+from .codec import NEEWER_COMMAND_PREFIX, NEEWER_COMMAND_RGB
+from .colour import EASING_LINEAR, INTERPOLATION_OKLCH, INTERPOLATION_RGB, ease, interpolateBrightness, interpolateColours
+
+# planned frames are encoded exactly like NeewerLight.set_color would encode them, so dropping a frame whose packet
+# matches the one before it never changes what the light shows
+
+
+class TransitionFrame(NamedTuple):
+    time: float # seconds after the start of the transition
+    packet: bytes
+    rgb: Tuple[int, int, int]
+    brightness: int
+
+
+class WhiteFrame(NamedTuple):
+    time: float
+    packet: bytes
+    temperature: int # kelvin
+    brightness: int
+
+
+class TransitionPlan:
+    """A whole transition precomputed up front, holding only the frames that change the light"""
+
+    def __init__(self, times, packets, colors, brightnesses, endColor, endBrightness, plannedFrames, duration):
+        self._times = times
+        self._packets = packets
+        self._colors = colors
+        self._brightnesses = brightnesses
+        self.endColor = tuple(endColor)
+        self.endBrightness = endBrightness
+        self.plannedFrames = plannedFrames
+        self.duration = duration
+
+    def __len__(self):
+        return len(self._packets)
+
+    def __getitem__(self, i):
+        return TransitionFrame(float(self._times[i]), self._packets[i], tuple(self._colors[i]), int(self._brightnesses[i]))
+
+    def __iter__(self):
+        for i in range(len(self._packets)):
+            yield self[i]
+
+    def indexAt(self, elapsed):
+        """Index of the frame that should be showing elapsed seconds into the transition, -1 before the first one"""
+        return int(np.searchsorted(self._times, elapsed, side="right")) - 1
+
+    @property
+    def skippedFrames(self):
+        return self.plannedFrames - len(self._packets)
+
+    def sendFrame(self, light, frame):
+        return light.set_color_packet(frame.packet, frame.rgb, frame.brightness)
+
+    def assumeEnd(self, light):
+        light.assume_color(self.endColor, self.endBrightness)
+
+
+class WhiteTransitionPlan(TransitionPlan):
+    """A colour temperature and/or brightness fade in white (CCT) mode, colours are temperatures in kelvin"""
+
+    def __getitem__(self, i):
+        return WhiteFrame(float(self._times[i]), self._packets[i], int(self._colors[i]), int(self._brightnesses[i]))
+
+    @property
+    def endTemperature(self):
+        return self.endColor[0]
+
+    def sendFrame(self, light, frame):
+        return light.set_white_packet(frame.packet, frame.temperature, frame.brightness)
+
+    def assumeEnd(self, light):
+        light.assume_white(self.endTemperature, self.endBrightness)
+
+
+def rgbToHsi(rgb, brightness):
+    """Vectorised NeewerLight.set_color conversion: (N,3) rgb 0-255 and (N,) brightness 0-255 to hue 0-359, sat 0-100,
+    intensity 0-100, quantised the same way"""
+    rgb = rgb / 255.0
+    maxc = rgb.max(axis=1)
+    minc = rgb.min(axis=1)
+    delta = maxc - minc
+    grey = delta == 0
+    safeDelta = np.where(grey, 1.0, delta)
+    rc = (maxc - rgb[:, 0]) / safeDelta
+    gc = (maxc - rgb[:, 1]) / safeDelta
+    bc = (maxc - rgb[:, 2]) / safeDelta
+    # same branch order as colorsys.rgb_to_hsv: red wins ties, then green
+    h = np.where(rgb[:, 0] == maxc, bc - gc, np.where(rgb[:, 1] == maxc, 2.0 + rc - bc, 4.0 + gc - rc))
+    h = np.where(grey, 0.0, (h / 6.0) % 1.0)
+    s = np.where(grey, 0.0, delta / np.where(maxc == 0, 1.0, maxc))
+    hue = (h * 360).astype(np.int64)
+    sat = (s * 100).astype(np.int64)
+    intensity = (brightness * 100 / 256).astype(np.int64)
+    return hue, sat, intensity
+
+
+def encodeRgbPackets(hue, sat, intensity):
+    """Build the 0x86 packets for every frame at once, one row of bytes per frame"""
+    packets = np.empty((len(hue), 8), dtype=np.uint8)
+    packets[:, 0] = NEEWER_COMMAND_PREFIX
+    packets[:, 1] = NEEWER_COMMAND_RGB
+    packets[:, 2] = 4
+    packets[:, 3] = hue & 0xFF
+    packets[:, 4] = (hue >> 8) & 0xFF
+    packets[:, 5] = sat & 0xFF
+    packets[:, 6] = intensity & 0xFF
+    packets[:, 7] = packets[:, :7].sum(axis=1, dtype=np.int64) & 0xFF
+    return packets
+
+
+def planTransition(startColor, startBrightness, endColor, endBrightness, transition, msPerFrame=40, easing=EASING_LINEAR,
+                   interpolation=INTERPOLATION_OKLCH) -> TransitionPlan:
+    """Interpolate from the start to the end colour/brightness over transition seconds, one frame every msPerFrame, and
+    drop every frame whose packet is byte-identical to the one sent before it
+
+    The path is perceptual (see colour.py) unless interpolation is colour.INTERPOLATION_RGB, and easing (one of
+    colour.EASINGS) shapes the progress over time. Frame i of N is due at i*transition/N, so the last frame lands
+    exactly at the end of the transition, and it is always exactly the end colour"""
+    numFrames = max(int(transition*1000/msPerFrame),1)
+    steps = np.arange(1, numFrames+1, dtype=np.float64)
+    progress = ease(easing, steps / numFrames)
+
+    colors = interpolateColours(startColor, endColor, progress, interpolation)
+    brightnesses = interpolateBrightness(startBrightness, endBrightness, progress, interpolation)
+    colors[-1] = endColor
+    brightnesses[-1] = endBrightness
+    times = steps * transition / numFrames
+
+    # the start state is prepended so a first frame matching what the light already shows is dropped too
+    allColors = np.vstack([np.asarray([startColor], dtype=np.int64), colors])
+    allBrightnesses = np.concatenate([np.asarray([startBrightness], dtype=np.int64), brightnesses])
+    packets = encodeRgbPackets(*rgbToHsi(allColors.astype(np.float64), allBrightnesses.astype(np.float64)))
+    changed = np.any(packets[1:] != packets[:-1], axis=1)
+
+    keep = np.flatnonzero(changed)
+    return TransitionPlan(
+        times[keep],
+        [row.tobytes() for row in packets[1:][keep]],
+        colors[keep].tolist(),
+        brightnesses[keep],
+        endColor,
+        endBrightness,
+        numFrames,
+        transition
+    )
+
+
+def planWhiteTransition(startTemperature, startBrightness, endTemperature, endBrightness, transition, msPerFrame=40,
+                        startInWhite=True, easing=EASING_LINEAR, interpolation=INTERPOLATION_OKLCH) -> WhiteTransitionPlan:
+    """Like planTransition, but fading colour temperature (kelvin) and brightness in white mode. Perceptual
+    interpolations move evenly in mireds rather than kelvin, and in lightness for the brightness
+
+    Each frame sends the smallest packet for what changed since the frame before: 0x82 if only the brightness did,
+    0x83 if only the temperature did and 0x87 for both. Unless the light is already in white mode (startInWhite) the
+    first frame is always a full 0x87, since only that switches the light out of colour mode"""
+    numFrames = max(int(transition*1000/msPerFrame),1)
+    steps = np.arange(0, numFrames+1, dtype=np.float64)
+    progress = ease(easing, steps / numFrames)
+    if interpolation == INTERPOLATION_RGB:
+        temperatures = np.trunc(startTemperature + progress * (endTemperature - startTemperature)).astype(np.int64)
+    else:
+        startMired, endMired = 1e6 / startTemperature, 1e6 / endTemperature
+        temperatures = np.rint(1e6 / (startMired + progress * (endMired - startMired))).astype(np.int64)
+    brightnesses = interpolateBrightness(startBrightness, endBrightness, progress, interpolation)
+    temperatures[[0, -1]] = startTemperature, endTemperature
+    brightnesses[[0, -1]] = startBrightness, endBrightness
+    times = steps[1:] * transition / numFrames
+
+    # quantised the same way NeewerLight.set_white does, the first element is the start state
+    temperatureBytes = temperatures // 100
+    brightnessBytes = (brightnesses * 100 / 256).astype(np.int64)
+    temperatureChanged = temperatureBytes[1:] != temperatureBytes[:-1]
+    brightnessChanged = brightnessBytes[1:] != brightnessBytes[:-1]
+    full = temperatureChanged & brightnessChanged
+    if not startInWhite:
+        full[0] = True
+
+    keep = np.flatnonzero(temperatureChanged | brightnessChanged | full)
+    packets = []
+    for i in keep.tolist():
+        if full[i]:
+            packets.append(codec.encodeCct(int(brightnessBytes[i+1]), int(temperatureBytes[i+1])))
+        elif temperatureChanged[i]:
+            packets.append(codec.encodeColourTemp(int(temperatureBytes[i+1])))
+        else:
+            packets.append(codec.encodeBrightness(int(brightnessBytes[i+1])))
+    return WhiteTransitionPlan(
+        times[keep],
+        packets,
+        temperatures[1:][keep],
+        brightnesses[1:][keep],
+        (endTemperature,),
+        endBrightness,
+        numFrames,
+        transition
+    )
@@ -0,0 +1,131 @@
+from collections import OrderedDict
+from typing import Callable, Optional
+import asyncio
+import logging
+import time
+
+LOGGER = logging.getLogger("NeewerLightPoller")
+LOGGER.setLevel(logging.WARN)
+
+DEFAULT_POLL_INTERVAL = 60.0 # seconds between status reads of one light
+POLL_TIMEOUT = 15.0 # a poll that takes longer than this (connect included) is abandoned
+DEFAULT_STARTUP_DELAY = 30.0 # seconds after the scheduler starts before lights added with restored state are first read
+MIN_POLL_SPACING = 1.0 # seconds between any two reads, however many lights there are
+
+
+class _PollTarget:
+    def __init__(self, light, isPaused: Callable[[], bool], onUpdate: Optional[Callable[[], None]], nextDue: float):
+        self.light = light
+        self.isPaused = isPaused
+        self.onUpdate = onUpdate
+        self.nextDue = nextDue
+
+
+class PollScheduler:
+    """Reads the status of every light from one place, spread evenly over the poll interval
+
+    Consecutive reads are always at least interval / number of lights apart, so polling traffic grows linearly with the
+    number of lights instead of arriving in bursts, and never closer than minSpacing. A light whose state is fresher than
+    the state TTL (because a command was just written or a notification arrived) isn't read, and nor is one that is busy,
+    e.g. transitioning.
+
+    Lights added while the scheduler is starting up are first read startupDelay after it started, so a restart with
+    restored state doesn't begin with a connect and read of every light."""
+
+    def __init__(self, interval=DEFAULT_POLL_INTERVAL, stateTtl=None, startupDelay=0.0, minSpacing=MIN_POLL_SPACING):
+        self.interval = interval
+        self.stateTtl = stateTtl if stateTtl is not None else interval / 2
+        self.startupDelay = startupDelay
+        self.minSpacing = minSpacing
+        self._started = time.monotonic()
+        self._targets = OrderedDict() # light -> _PollTarget
+        self._changed = asyncio.Event()
+        self._lastPoll = 0.0
+        self._task = None
+        self.stats = {"polls": 0, "failures": 0, "skippedFresh": 0, "skippedBusy": 0, "skippedUnavailable": 0}
+
+    def add(self, light, isPaused: Callable[[], bool] = lambda: False, onUpdate: Optional[Callable[[], None]] = None,
+            delay: Optional[float] = None):
+        """isPaused is checked before every poll, onUpdate is called after every successful one. The first read is delay
+        seconds from now, by default once the startup delay is over"""
+        now = time.monotonic()
+        if delay is None:
+            delay = max(self._started + self.startupDelay - now, 0.0)
+        self._targets[light] = _PollTarget(light, isPaused, onUpdate, now + delay)
+        self._changed.set()
+
+    def remove(self, light):
+        self._targets.pop(light, None)
+        self._changed.set()
+
+    def _intervalFor(self, light):
+        interval = getattr(light, "pollInterval", None)
+        return interval if interval is not None else self.interval
+
+    @property
+    def spacing(self):
+        """Minimum time between two reads"""
+        intervals = [self._intervalFor(target.light) for target in self._targets.values() if self._intervalFor(target.light)]
+        return max(min(intervals) / len(intervals), self.minSpacing) if intervals else self.interval
+
+    def _nextTarget(self):
+        targets = [target for target in self._targets.values() if self._intervalFor(target.light)]
+        return min(targets, key=lambda target: target.nextDue, default=None)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._started = time.monotonic()
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            self._changed.clear()
+            target = self._nextTarget()
+            if target is None:
+                await self._changed.wait()
+                continue
+            wait = max(target.nextDue, self._lastPoll + self.spacing) - time.monotonic()
+            if wait > 0:
+                try:
+                    # lights being added or removed changes both the order and the spacing
+                    await asyncio.wait_for(self._changed.wait(), wait)
+                    continue
+                except asyncio.TimeoutError:
+                    pass
+            await self._poll(target)
+
+    async def _poll(self, target: _PollTarget):
+        light = target.light
+        interval = self._intervalFor(light)
+        now = time.monotonic()
+        if target.isPaused() or light.isBusy:
+            self.stats["skippedBusy"] += 1
+            target.nextDue = now + interval
+            return
+        if not light.available:
+            # the light's own background probe is already trying to reach it
+            self.stats["skippedUnavailable"] += 1
+            target.nextDue = now + interval
+            return
+        if light.stateAge < self.stateTtl:
+            # what a command or notification told us recently is as good as a read, poll a full interval after it
+            self.stats["skippedFresh"] += 1
+            target.nextDue = now - light.stateAge + interval
+            return
+
+        self._lastPoll = now
+        target.nextDue = now + interval
+        self.stats["polls"] += 1
+        try:
+            await asyncio.wait_for(light.readStatus(), POLL_TIMEOUT)
+        except Exception as error:
+            self.stats["failures"] += 1
+            LOGGER.debug("Polling %s failed: %s", light.mac, error)
+            return
+        if target.onUpdate is not None:
+            target.onUpdate()
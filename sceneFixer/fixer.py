@@ -0,0 +1,178 @@
+"""Normalises Home Assistant scene files for Neewer lights
+
+Scenes saved by the HA scene editor contain `effect: None` (which the lights reject) and `state: off` for lights that
+should fade down rather than switch off. Each scene is rewritten to drop the effect and to use brightness 0 instead of
+off. Files are processed in parallel, and every normalised scene is hashed into a cache so unchanged files and scenes
+are skipped on later runs. A file is only written when its content actually changes."""
+import hashlib
+import io
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, NamedTuple, Optional
+
+import ruamel.yaml
+
+SCENE_EXTENSIONS = (".yaml", ".yml")
+CACHE_VERSION = 1
+
+
+class FileResult(NamedTuple):
+	path: str
+	changed: bool # the file was (or with a dry run would have been) rewritten
+	skipped: bool # the file matched the cache and wasn't even parsed
+	scenes: int
+	scenesSkipped: int # already normalised according to the cache
+	scenesChanged: int
+	changes: List[str]
+	timings: Dict[str, float] # seconds per stage
+	fileHash: Optional[str]
+	sceneHashes: Dict[str, str]
+	error: Optional[str] = None
+
+
+def _yaml():
+	yaml = ruamel.yaml.YAML(typ="rt")
+	yaml.preserve_quotes = True
+	return yaml
+
+
+def hashBytes(data: bytes) -> str:
+	return hashlib.sha256(data).hexdigest()
+
+
+def hashScene(scene) -> str:
+	return hashBytes(json.dumps(scene, sort_keys=True, default=str).encode())
+
+
+def sceneKey(scene, index) -> str:
+	return str(scene.get("id", scene.get("name", index)))
+
+
+def normaliseScene(scene) -> List[str]:
+	"""Rewrite one scene in place, returning a description of every change"""
+	changes = []
+	for entityName, entity in (scene.get("entities") or {}).items():
+		if not hasattr(entity, "keys"):
+			continue
+		if "effect" in entity.keys() and entity["effect"] == "None":
+			changes.append(f"{scene.get('name')}.{entityName}: removing 'effect: None'")
+			del entity["effect"]
+		if "state" in entity.keys() and entity["state"] == "off":
+			entity["state"] = ruamel.yaml.scalarstring.SingleQuotedScalarString("on")
+			entity["brightness"] = 0
+			changes.append(f"{scene.get('name')}.{entityName}: changing state=off to brightness=0")
+	return changes
+
+
+def fixFile(path, cachedFileHash=None, cachedSceneHashes=None, dryRun=False) -> FileResult:
+	"""Normalise every scene in one file. Safe to run in a worker process"""
+	cachedSceneHashes = cachedSceneHashes or {}
+	timings = {}
+	start = time.perf_counter()
+	try:
+		with open(path, "rb") as file:
+			original = file.read()
+		fileHash = hashBytes(original)
+		timings["read"] = time.perf_counter() - start
+		if fileHash == cachedFileHash:
+			timings["total"] = time.perf_counter() - start
+			return FileResult(path, False, True, len(cachedSceneHashes), len(cachedSceneHashes), 0, [], timings, fileHash, cachedSceneHashes)
+
+		stage = time.perf_counter()
+		yaml = _yaml()
+		document = yaml.load(original)
+		timings["load"] = time.perf_counter() - stage
+
+		stage = time.perf_counter()
+		scenes = document if isinstance(document, list) else [document] if document else []
+		changes = []
+		sceneHashes = {}
+		skippedScenes = changedScenes = 0
+		for index, scene in enumerate(scenes):
+			if not hasattr(scene, "get"):
+				continue
+			key = sceneKey(scene, index)
+			sceneHash = hashScene(scene)
+			if cachedSceneHashes.get(key) == sceneHash:
+				skippedScenes += 1
+			else:
+				sceneChanges = normaliseScene(scene)
+				if sceneChanges:
+					changedScenes += 1
+					changes.extend(sceneChanges)
+					sceneHash = hashScene(scene)
+			sceneHashes[key] = sceneHash
+		timings["normalise"] = time.perf_counter() - stage
+
+		changed = False
+		if changes:
+			stage = time.perf_counter()
+			output = io.BytesIO()
+			yaml.dump(document, output)
+			output = output.getvalue()
+			changed = output != original
+			if changed and not dryRun:
+				temporary = path + ".tmp"
+				with open(temporary, "wb") as file:
+					file.write(output)
+				os.replace(temporary, path)
+				fileHash = hashBytes(output)
+			timings["write"] = time.perf_counter() - stage
+		timings["total"] = time.perf_counter() - start
+		if dryRun and changed:
+			fileHash = None # still needs fixing next time
+		return FileResult(path, changed, False, len(sceneHashes), skippedScenes, changedScenes, changes, timings, fileHash, sceneHashes)
+	except (OSError, ruamel.yaml.YAMLError) as error:
+		timings["total"] = time.perf_counter() - start
+		return FileResult(path, False, False, 0, 0, 0, [], timings, None, {}, str(error))
+
+
+def findSceneFiles(paths) -> List[str]:
+	files = []
+	for path in paths:
+		if os.path.isdir(path):
+			for root, _, names in os.walk(path):
+				files.extend(os.path.join(root, name) for name in sorted(names) if name.endswith(SCENE_EXTENSIONS))
+		else:
+			files.append(path)
+	return files
+
+
+def loadCache(path) -> dict:
+	if path is None or not os.path.exists(path):
+		return {}
+	try:
+		with open(path) as file:
+			cache = json.load(file)
+	except (OSError, ValueError):
+		return {}
+	return cache.get("files", {}) if cache.get("version") == CACHE_VERSION else {}
+
+
+def saveCache(path, files):
+	if path is None:
+		return
+	temporary = path + ".tmp"
+	with open(temporary, "w") as file:
+		json.dump({"version": CACHE_VERSION, "files": files}, file, indent=1, sort_keys=True)
+	os.replace(temporary, path)
+
+
+def fixPaths(paths, cachePath=None, workers=None, dryRun=False) -> List[FileResult]:
+	"""Normalise every scene file under paths, in parallel, skipping anything the cache says is already done"""
+	files = findSceneFiles(paths)
+	cache = loadCache(cachePath)
+	jobs = [(path, cache.get(os.path.abspath(path), {}).get("file"), cache.get(os.path.abspath(path), {}).get("scenes"), dryRun) for path in files]
+	if len(jobs) > 1 and workers != 1:
+		with ProcessPoolExecutor(max_workers=workers) as executor:
+			results = list(executor.map(fixFile, *zip(*jobs)))
+	else:
+		results = [fixFile(*job) for job in jobs]
+
+	for result in results:
+		if result.error is None:
+			cache[os.path.abspath(result.path)] = {"file": result.fileHash, "scenes": result.sceneHashes}
+	saveCache(cachePath, cache)
+	return results
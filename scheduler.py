@@ -0,0 +1,116 @@
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+import asyncio
+import logging
+import time
+
+from .metrics import LatencyHistogram
+
+LOGGER = logging.getLogger("NeewerLightScheduler")
+LOGGER.setLevel(logging.WARN)
+
+# write priorities, most urgent first
+PRIORITY_INTERACTIVE = 0 # a colour, white, effect or brightness someone just asked for
+PRIORITY_POWER = 1
+PRIORITY_FRAME = 2 # transition and trace playback frames
+PRIORITY_POLL = 3 # status reads
+PRIORITY_NAMES = ["interactive", "power", "frame", "poll"]
+
+DEFAULT_MAX_OUTSTANDING = 4 # writes one adapter has on air at once
+STARVATION_LIMIT = 1.0 # seconds a waiting write can be passed over by more urgent ones before it goes first
+
+
+class CommandScheduler:
+    """Decides which light writes next on one adapter
+
+    Every GATT write takes one of maxOutstanding slots for as long as it's on air. When they're all taken, waiting
+    writes are granted a slot by priority (interactive > power > frame > poll), round robin between lights within a
+    priority so one light with a long queue can't hold up the others. A write that has been passed over for
+    STARVATION_LIMIT goes next whatever its priority, so polls still happen during a long fade.
+
+    Each light already writes one command at a time, so this only orders writes between lights."""
+
+    def __init__(self, maxOutstanding=DEFAULT_MAX_OUTSTANDING):
+        self.maxOutstanding = maxOutstanding
+        self.outstanding = 0
+        self._waiting = [OrderedDict() for _ in PRIORITY_NAMES] # per priority: light -> deque of (future, queued at)
+        self.waitTime = [LatencyHistogram() for _ in PRIORITY_NAMES]
+        self.stats = {"granted": 0, "queued": 0, "starved": 0, "maxWaiting": 0}
+
+    @property
+    def waiting(self):
+        return sum(len(waiters) for queue in self._waiting for waiters in queue.values())
+
+    @asynccontextmanager
+    async def slot(self, light, priority):
+        """Hold one of the adapter's write slots for the duration of a write"""
+        queued = time.monotonic()
+        if self.outstanding < self.maxOutstanding and not self.waiting:
+            self.outstanding += 1
+        else:
+            future = asyncio.get_event_loop().create_future()
+            self._waiting[priority].setdefault(light, deque()).append((future, queued))
+            self.stats["queued"] += 1
+            self.stats["maxWaiting"] = max(self.stats["maxWaiting"], self.waiting)
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # granted in the same moment it was cancelled, hand the slot straight on
+                    self._release()
+                else:
+                    self._forget(light, priority, future)
+                raise
+        self.stats["granted"] += 1
+        self.waitTime[priority].record(time.monotonic() - queued)
+        try:
+            yield
+        finally:
+            self._release()
+
+    def _forget(self, light, priority, future):
+        waiters = self._waiting[priority].get(light)
+        if waiters is None:
+            return
+        for waiter in waiters:
+            if waiter[0] is future:
+                waiters.remove(waiter)
+                break
+        if not waiters:
+            del self._waiting[priority][light]
+
+    def _release(self):
+        self.outstanding -= 1
+        self._grant()
+
+    def _nextQueue(self):
+        queues = [queue for queue in self._waiting if queue]
+        if not queues:
+            return None
+        now = time.monotonic()
+        for queue in reversed(queues[1:]):
+            # lights are served round robin, so the first light's oldest write is (near enough) the priority's oldest
+            if now - next(iter(queue.values()))[0][1] >= STARVATION_LIMIT:
+                self.stats["starved"] += 1
+                return queue
+        return queues[0]
+
+    def _grant(self):
+        while self.outstanding < self.maxOutstanding:
+            queue = self._nextQueue()
+            if queue is None:
+                return
+            light, waiters = next(iter(queue.items()))
+            future, _ = waiters.popleft()
+            if waiters:
+                queue.move_to_end(light) # round robin: the light goes behind the others of its priority
+            else:
+                del queue[light]
+            if future.done():
+                continue
+            self.outstanding += 1
+            future.set_result(None)
+
+    def asDict(self):
+        return dict(self.stats, outstanding=self.outstanding, waiting=self.waiting, maxOutstanding=self.maxOutstanding,
+                    waitTime={name: histogram.asDict() for name, histogram in zip(PRIORITY_NAMES, self.waitTime)})
@@ -0,0 +1,63 @@
+import logging
+
+from homeassistant.components.sensor import SensorEntity, STATE_CLASS_MEASUREMENT, STATE_CLASS_TOTAL_INCREASING
+from homeassistant.const import TIME_MILLISECONDS
+from homeassistant.helpers.entity import EntityCategory
+
+from .NeewerLight import NeewerLight
+
+DOMAIN = "neewerlight"
+
+#logging.basicConfig(level=logging.DEBUG)
+LOGGER = logging.getLogger("NeewerLightSensor")
+LOGGER.setLevel(logging.WARN)
+
+
+def _percentileMs(histogram, percentile):
+	value = histogram.percentile(percentile)
+	return round(value * 1000, 1) if value is not None else None
+
+
+# key, name, unit, state class, value
+SENSORS = [
+	("write_latency_p95", "write latency p95", TIME_MILLISECONDS, STATE_CLASS_MEASUREMENT, lambda light: _percentileMs(light.metrics.write, 95)),
+	("connect_latency_p95", "connect latency p95", TIME_MILLISECONDS, STATE_CLASS_MEASUREMENT, lambda light: _percentileMs(light.metrics.connect, 95)),
+	("read_latency_p95", "status read latency p95", TIME_MILLISECONDS, STATE_CLASS_MEASUREMENT, lambda light: _percentileMs(light.metrics.read, 95)),
+	("transition_fps", "transition fps", "fps", STATE_CLASS_MEASUREMENT, lambda light: light.metrics.effectiveFps),
+	("late_frames", "late frames", None, STATE_CLASS_TOTAL_INCREASING, lambda light: light.metrics.lateFrames),
+	("dropped_frames", "dropped frames", None, STATE_CLASS_TOTAL_INCREASING, lambda light: light.metrics.droppedFrames),
+	("coalesced_frames", "coalesced frames", None, STATE_CLASS_TOTAL_INCREASING, lambda light: light.write_counters["coalesced"]),
+	("reconnects", "reconnects", None, STATE_CLASS_TOTAL_INCREASING, lambda light: light.metrics.reconnects),
+]
+
+
+async def async_setup_entry(hass, config_entry, async_add_devices):
+	instance = hass.data[DOMAIN][config_entry.entry_id]
+	async_add_devices([NeewerLightMetricSensor(instance, config_entry.data["name"], *sensor) for sensor in SENSORS])
+
+
+class NeewerLightMetricSensor(SensorEntity):
+	"""Performance metrics of one light, disabled until enabled from the entity settings"""
+
+	_attr_entity_category = EntityCategory.DIAGNOSTIC
+	_attr_entity_registry_enabled_default = False
+
+	def __init__(self, lightInstance: NeewerLight, name: str, key, label, unit, stateClass, value) -> None:
+		self._instance = lightInstance
+		self._value = value
+		self._attr_name = name+" "+label
+		self._attr_unique_id = self._instance.mac+"_"+key
+		self._attr_native_unit_of_measurement = unit
+		self._attr_state_class = stateClass
+
+	@property
+	def device_info(self):
+		return {
+			"identifiers": {
+				(DOMAIN, self._instance.mac)
+			}
+		}
+
+	@property
+	def native_value(self):
+		return self._value(self._instance)
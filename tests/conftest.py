@@ -0,0 +1,34 @@
+"""Tests run against the simulated lights in benchmarks/simulator.py, from the repository root with python -m pytest"""
+import os
+import sys
+
+import pytest
+
+# bleak refuses to import without a Bluetooth stack unless it's running under CI
+os.environ.setdefault("CI", "1")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import loadIntegration  # noqa: E402
+
+loadIntegration()
+from benchmarks.simulator import LinkProfile, SimulatedAdapter  # noqa: E402
+from neewerlight.NeewerLight import NeewerLight  # noqa: E402
+
+
+def makeLights(adapter, count, **options):
+	lights = []
+	for i in range(count):
+		address = "SIM:00:00:00:%02X:%02X" % (i >> 8, i & 0xFF)
+		adapter.addDevice(address)
+		lights.append(NeewerLight(address, clientFactory=adapter.clientFactory, **options))
+	return lights
+
+
+@pytest.fixture
+def profile():
+	return LinkProfile(connectLatency=0.05)
+
+
+@pytest.fixture
+def adapter(profile):
+	return SimulatedAdapter(profile, seed=1)
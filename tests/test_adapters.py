@@ -0,0 +1,34 @@
+"""AdapterPool assigning lights to adapters"""
+import asyncio
+from types import SimpleNamespace
+
+from benchmarks.simulator import SimulatedHost
+from neewerlight.NeewerLight import NeewerLight
+from neewerlight.adapters import AdapterPool
+from neewerlight.discovery import DiscoveryService, NEEWER_SERVICE_UUID
+
+
+def test_assigned_light_connects_from_the_adapters_cached_device():
+	host = SimulatedHost(["hci0", "hci1"], seed=1)
+	address = "SIM:00:00:00:00:01"
+	host.addDevice(address)
+	discovery = DiscoveryService()
+	heard = {}
+	for adapter, rssi in (("hci0", -80), ("hci1", -50)):
+		heard[adapter] = SimpleNamespace(address=address, name="NEEWER-RGB660", rssi=rssi)
+		discovery._onDetection(heard[adapter], SimpleNamespace(service_uuids=[NEEWER_SERVICE_UUID], rssi=rssi), adapter)
+	targets = []
+
+	def clientFactory(target, **kwargs):
+		targets.append((target, kwargs.get("adapter")))
+		return host.clientFactory(target, **kwargs)
+
+	async def scenario():
+		pool = AdapterPool(host.listAdapters(), discovery=discovery, listAdapters=host.listAdapters)
+		light = NeewerLight(address, connectionManager=pool, discovery=discovery, clientFactory=clientFactory)
+		await light.connect()
+		await pool.stop()
+
+	asyncio.run(scenario())
+	# the loudest adapter gets the light, and connects from the device it heard rather than scanning by address
+	assert targets[-1] == (heard["hci1"], "hci1")
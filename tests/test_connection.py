@@ -0,0 +1,30 @@
+"""ConnectionManager sharing an adapter's connection slots"""
+import asyncio
+import time
+
+from conftest import makeLights
+
+from benchmarks.simulator import LinkProfile, SimulatedAdapter
+from neewerlight.connection import ConnectionManager
+
+
+def test_slow_eviction_does_not_block_other_lights():
+	adapter = SimulatedAdapter(LinkProfile(connectLatency=0.05, disconnectLatency=0.5), seed=1)
+	connections = ConnectionManager(maxConnections=2)
+	first, second, third = makeLights(adapter, 3, connectionManager=connections)
+
+	async def scenario():
+		await first.connect()
+		await second.connect()
+		connecting = asyncio.ensure_future(third.connect()) # evicts first, which takes a while to disconnect
+		await asyncio.sleep(0.05)
+		start = time.monotonic()
+		await second.disconnect()
+		released = time.monotonic() - start
+		await connecting
+		return released
+
+	released = asyncio.run(scenario())
+	assert released < 0.5 + 0.05 # only its own disconnect, not the eviction's as well
+	assert not first.isConnected and third.isConnected
+	assert connections.stats["evictions"] == 1
@@ -0,0 +1,65 @@
+"""ControlDaemon command handling against simulated lights"""
+import asyncio
+import time
+
+from neewerlight.connection import ConnectionManager
+from neewerlight.daemon import ControlDaemon
+
+SLOTS = 5
+
+
+def makeDaemon(adapter, count, maxConnections=SLOTS):
+	lights = {}
+	for i in range(count):
+		address = "SIM:00:00:00:00:%02X" % i
+		adapter.addDevice(address)
+		lights["light%d" % i] = address
+	return ControlDaemon(lights, adapters=[None], clientFactory=adapter.clientFactory,
+						 connectionManager=ConnectionManager(maxConnections=maxConnections))
+
+
+def test_more_lights_than_slots(adapter):
+	daemon = makeDaemon(adapter, SLOTS + 2)
+
+	async def scenario():
+		start = time.monotonic()
+		await daemon.start()
+		started = time.monotonic() - start
+		replies = []
+		for name in daemon.lights:
+			replies.append(await daemon.handleLine("color %s 255 0 0" % name))
+		await daemon.stop()
+		return started, replies
+
+	started, replies = asyncio.run(scenario())
+	assert started < 1.0
+	assert all(reply["ok"] for reply in replies), replies
+	assert all(device.hsi is not None for device in adapter.devices.values())
+
+
+def test_bad_transitions_are_rejected(adapter):
+	daemon = makeDaemon(adapter, 1)
+	bad = [
+		{"cmd": "transition", "light": "light0", "rgb": [0, 0, 255]},
+		{"cmd": "transition", "light": "light0", "duration": 1},
+		{"cmd": "transition", "light": "light0", "rgb": [0, 0, 256], "duration": 1},
+		{"cmd": "transition", "light": "light0", "rgb": [0, 0], "duration": 1},
+		{"cmd": "transition", "light": "light0", "rgb": [0, 0, 255], "duration": "soon"},
+		{"cmd": "transition", "light": "light0", "rgb": [0, 0, 255], "duration": -1},
+		{"cmd": "transition", "light": "light0", "kelvin": 100, "duration": 1},
+		{"cmd": "transition", "light": "light0", "rgb": [0, 0, 255], "brightness": 300, "duration": 1},
+		{"cmd": "transition", "light": "light0", "rgb": [0, 0, 255], "duration": 1, "easing": "bounce"},
+	]
+
+	async def scenario():
+		await daemon.start()
+		replies = [await daemon.execute(command) for command in bad]
+		good = await daemon.execute({"cmd": "transition", "light": "light0", "rgb": [0, 0, 255], "duration": 0.2, "wait": True})
+		await daemon.stop()
+		return replies, good
+
+	replies, good = asyncio.run(scenario())
+	for command, reply in zip(bad, replies):
+		assert not reply["ok"], command
+	assert good["ok"] and good["result"]["light0"]["completed"]
+	assert adapter.devices["SIM:00:00:00:00:00"].hsi is not None
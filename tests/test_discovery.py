@@ -0,0 +1,56 @@
+"""DiscoveryService's cache and scanning, with a scanner that announces lights on cue"""
+import asyncio
+from types import SimpleNamespace
+
+from neewerlight.discovery import DiscoveryService, NEEWER_SERVICE_UUID
+
+
+class CuedScanner:
+	def __init__(self, discovery, adapter):
+		self.discovery = discovery
+		self.adapter = adapter
+
+	async def start(self):
+		self.discovery.scans += 1
+		for address in self.discovery.advertising:
+			asyncio.get_event_loop().call_later(0.01, self.announce, address)
+
+	def announce(self, address):
+		device = SimpleNamespace(address=address, name="NEEWER-RGB660", rssi=-60)
+		self.discovery._onDetection(device, SimpleNamespace(service_uuids=[NEEWER_SERVICE_UUID], rssi=-60), self.adapter)
+
+	async def stop(self):
+		pass
+
+
+class CuedDiscovery(DiscoveryService):
+	def __init__(self, advertising):
+		super().__init__()
+		self.advertising = advertising
+		self.scans = 0
+
+	def _createScanner(self, adapter):
+		return CuedScanner(self, adapter)
+
+
+def test_find_forgets_its_waiter_on_timeout():
+	async def scenario():
+		discovery = CuedDiscovery([])
+		assert await discovery.find("AA:BB:CC:DD:EE:FF", timeout=0.05) is None
+		return discovery
+
+	assert asyncio.run(scenario())._waiters == {}
+
+
+def test_discover_finds_lights_switched_on_after_a_scan():
+	async def scenario():
+		discovery = CuedDiscovery(["AA:00:00:00:00:01"])
+		first = await discovery.discover(timeout=0.5, settle=0.05)
+		discovery.advertising.append("AA:00:00:00:00:02")
+		second = await discovery.discover(timeout=0.5, settle=0.05)
+		return discovery, first, second
+
+	discovery, first, second = asyncio.run(scenario())
+	assert [device.address for device in first] == ["AA:00:00:00:00:01"]
+	assert sorted(device.address for device in second) == ["AA:00:00:00:00:01", "AA:00:00:00:00:02"]
+	assert discovery.scans == 2
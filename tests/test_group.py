@@ -0,0 +1,71 @@
+"""Group transitions with more lights than the adapter has connection slots"""
+import asyncio
+import time
+
+from conftest import makeLights
+
+from benchmarks.simulator import LinkProfile, SimulatedAdapter
+from neewerlight import codec
+from neewerlight.connection import ConnectionManager, HOLD_SLOT_TIMEOUT
+from neewerlight.planner import planTransition
+from neewerlight.transition import GroupTransition, playGroup
+
+FADE_FROM = ((255, 0, 0), 20)
+FADE_TO = ((0, 80, 255), 255)
+SLOTS = 5
+
+
+def test_group_with_more_lights_than_slots(adapter, profile):
+	connections = ConnectionManager(maxConnections=SLOTS)
+	lights = makeLights(adapter, SLOTS + 3, connectionManager=connections)
+	plan = planTransition(FADE_FROM[0], FADE_FROM[1], FADE_TO[0], FADE_TO[1], 1.0)
+
+	async def scenario():
+		group = GroupTransition()
+		for light in lights:
+			light.assume_color(*FADE_FROM)
+			group.add(light, plan)
+		start = time.monotonic()
+		stats = await playGroup(group)
+		results = await asyncio.gather(*[group.finished(light) for light in lights])
+		await connections.stop()
+		return time.monotonic() - start, stats, results
+
+	duration, stats, results = asyncio.run(scenario())
+	# lights without a slot are only waited for briefly: connects, the fade, then one write for each light left out
+	assert duration < 1.0 + HOLD_SLOT_TIMEOUT + 4 * profile.connectLatency
+	assert stats["failed"] == 0
+	assert all(results)
+	end = codec.decode(plan[len(plan) - 1].packet)
+	fading = 0
+	for light in lights:
+		device = adapter.devices[light.address.upper()]
+		assert device.hsi == end
+		assert light.rgb_color == FADE_TO[0]
+		fading += len(device.received) > 1
+	assert fading == SLOTS
+
+
+def test_removed_light_drops_its_queued_frame():
+	# acknowledged writes slow enough that the group's first frame is still queued behind the power on when it's removed
+	adapter = SimulatedAdapter(LinkProfile(connectLatency=0.05, writeLatency=0.2), seed=1)
+	light, = makeLights(adapter, 1)
+	device = adapter.devices[light.address.upper()]
+	plan = planTransition(FADE_FROM[0], FADE_FROM[1], FADE_TO[0], FADE_TO[1], 1.0)
+
+	async def scenario():
+		await light.connect()
+		light.assume_color(*FADE_FROM)
+		group = GroupTransition()
+		group.add(light, plan)
+		power = asyncio.ensure_future(light.turn_on())
+		fade = asyncio.ensure_future(group.run())
+		await asyncio.sleep(plan[0].time + 0.03)
+		group.remove(light)
+		await asyncio.gather(power, fade)
+		await asyncio.sleep(0.05)
+
+	asyncio.run(scenario())
+	assert [packet for _, packet in device.received] == [codec.POWER_ON]
+	assert light.rgb_color == FADE_FROM[0] and light.brightness == FADE_FROM[1]
+	assert light.write_counters["abandoned"] == 1
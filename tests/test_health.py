@@ -0,0 +1,64 @@
+"""CircuitBreaker and how a light behaves once it is unreachable"""
+import asyncio
+
+import pytest
+
+from conftest import makeLights
+
+from neewerlight.NeewerLight import NeewerLight
+from neewerlight.health import CircuitBreaker, LightUnavailableError, HEALTH_DEGRADED, HEALTH_HEALTHY, HEALTH_OPEN
+
+
+def test_circuit_opens_after_threshold_and_backs_off():
+	breaker = CircuitBreaker(failureThreshold=3, backoffBase=1.0)
+	assert breaker.state == HEALTH_HEALTHY
+	breaker.recordFailure(OSError("gone"))
+	assert breaker.state == HEALTH_DEGRADED and breaker.backoff == 1.0
+	breaker.recordFailure(OSError("gone"))
+	assert breaker.backoff == 2.0
+	breaker.recordFailure(OSError("gone"))
+	assert breaker.isOpen and breaker.state == HEALTH_OPEN
+	assert breaker.stats["opened"] == 1
+	assert breaker.recordSuccess()
+	assert breaker.state == HEALTH_HEALTHY and breaker.retryIn == 0.0
+
+
+def test_unreachable_light_fails_fast_once_open(adapter):
+	light = NeewerLight("SIM:FF:FF:FF:FF:FF", clientFactory=adapter.clientFactory)
+	light.health = CircuitBreaker(backoffBase=0.01)
+
+	async def scenario():
+		for _ in range(light.health.failureThreshold):
+			with pytest.raises(Exception):
+				await light.connect(timeout=0.05)
+		assert not light.available
+		with pytest.raises(LightUnavailableError):
+			await light.turn_on()
+		# colours are kept to send once it's back rather than failing
+		assert await light.set_color((255, 0, 0), 255) is False
+		await light.disconnect()
+
+	asyncio.run(scenario())
+	assert light.health.stats["rejected"] >= 2
+
+
+def test_light_recovers_when_reachable_again(adapter):
+	light, = makeLights(adapter, 1)
+	light.health = CircuitBreaker(failureThreshold=1, backoffBase=0.01)
+	device = adapter.devices.pop(light.address.upper())
+
+	async def scenario():
+		with pytest.raises(Exception):
+			await light.connect(timeout=0.05)
+		assert not light.available
+		await light.set_color((0, 0, 255), 255) # deferred while unreachable
+		adapter.devices[light.address.upper()] = device
+		for _ in range(100):
+			if light.available and device.received:
+				break
+			await asyncio.sleep(0.02)
+		await light.disconnect()
+
+	asyncio.run(scenario())
+	assert light.available
+	assert device.received # the discarded colour was sent once the probe reconnected
@@ -0,0 +1,52 @@
+"""The per light command queue: one write in flight, newer colours replacing unsent ones"""
+import asyncio
+
+from conftest import makeLights
+
+from neewerlight import codec
+
+
+def test_newer_colours_replace_unsent_ones(adapter):
+	light, = makeLights(adapter, 1)
+	device = adapter.devices[light.address.upper()]
+
+	async def scenario():
+		await light.connect()
+		writes = [asyncio.ensure_future(light.set_color((0, 0, 0), 255))]
+		await asyncio.sleep(0.005) # on air now
+		writes += [asyncio.ensure_future(light.set_color((value, 0, 0), 255)) for value in range(1, 10)]
+		return await asyncio.gather(*writes)
+
+	results = asyncio.run(scenario())
+	# the first colour is already on air when the rest arrive, only the newest of those is still sent
+	assert results[0] is True and results[-1] is True
+	assert results[1:-1] == [False] * 8
+	assert len(device.received) == 2
+	assert light.write_counters["coalesced"] == 8
+	assert device.hsi == codec.decode(device.received[-1][1])
+
+
+def test_power_commands_are_never_dropped(adapter):
+	light, = makeLights(adapter, 1)
+	device = adapter.devices[light.address.upper()]
+
+	async def scenario():
+		await light.connect()
+		await asyncio.gather(light.turn_on(), light.turn_off(), light.turn_on(), light.turn_off())
+
+	asyncio.run(scenario())
+	assert len(device.received) == 4
+	assert device.on is False
+
+
+def test_one_write_in_flight_per_light(adapter):
+	lights = makeLights(adapter, 4)
+
+	async def scenario():
+		await asyncio.gather(*[light.connect() for light in lights])
+		for step in range(20):
+			await asyncio.gather(*[light.set_color((step * 10, 0, 255), 255) for light in lights],
+								 *[light.set_brightness(step) for light in lights])
+
+	asyncio.run(scenario())
+	assert adapter.stats["maxWritesInFlightPerLight"] == 1
@@ -0,0 +1,66 @@
+"""CommandScheduler: write slots go to the most urgent waiting write, without starving the rest"""
+import asyncio
+
+from neewerlight import scheduler
+from neewerlight.scheduler import CommandScheduler, PRIORITY_FRAME, PRIORITY_INTERACTIVE, PRIORITY_POLL
+
+
+def grantOrder(scheduler, requests):
+	"""The order (light, priority) requests are granted in while one write holds the only slot"""
+	order = []
+
+	async def write(light, priority):
+		async with scheduler.slot(light, priority):
+			order.append((light, priority))
+			await asyncio.sleep(0.001)
+
+	async def scenario():
+		blocker = asyncio.ensure_future(write("blocker", PRIORITY_FRAME))
+		await asyncio.sleep(0)
+		waiting = []
+		for light, priority in requests:
+			waiting.append(asyncio.ensure_future(write(light, priority)))
+			await asyncio.sleep(0)
+		await asyncio.gather(blocker, *waiting)
+
+	asyncio.run(scenario())
+	return order[1:]
+
+
+def test_most_urgent_write_goes_first():
+	order = grantOrder(CommandScheduler(maxOutstanding=1),
+					   [("a", PRIORITY_POLL), ("b", PRIORITY_FRAME), ("c", PRIORITY_INTERACTIVE)])
+	assert order == [("c", PRIORITY_INTERACTIVE), ("b", PRIORITY_FRAME), ("a", PRIORITY_POLL)]
+
+
+def test_lights_take_turns_within_a_priority():
+	order = grantOrder(CommandScheduler(maxOutstanding=1),
+					   [("a", PRIORITY_FRAME), ("a", PRIORITY_FRAME), ("a", PRIORITY_FRAME), ("b", PRIORITY_FRAME)])
+	assert [light for light, _ in order] == ["a", "b", "a", "a"]
+
+
+def test_starved_writes_go_next(monkeypatch):
+	monkeypatch.setattr(scheduler, "STARVATION_LIMIT", 0.0)
+	order = grantOrder(CommandScheduler(maxOutstanding=1), [("a", PRIORITY_POLL), ("b", PRIORITY_INTERACTIVE)])
+	assert order[0] == ("a", PRIORITY_POLL)
+
+
+def test_slots_are_released_on_cancel():
+	commandScheduler = CommandScheduler(maxOutstanding=1)
+
+	async def scenario():
+		async def hold():
+			async with commandScheduler.slot("a", PRIORITY_FRAME):
+				await asyncio.sleep(1)
+
+		holder = asyncio.ensure_future(hold())
+		await asyncio.sleep(0)
+		waiter = asyncio.ensure_future(hold())
+		await asyncio.sleep(0)
+		waiter.cancel()
+		holder.cancel()
+		await asyncio.gather(holder, waiter, return_exceptions=True)
+
+	asyncio.run(scenario())
+	assert commandScheduler.outstanding == 0
+	assert commandScheduler.waiting == 0
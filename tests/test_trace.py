@@ -0,0 +1,50 @@
+"""Trace playback: more lights than the adapter has connection slots, and replayed packets sharing the command queue"""
+import asyncio
+import time
+
+from conftest import makeLights
+
+from neewerlight import codec
+from neewerlight.connection import ConnectionManager, HOLD_SLOT_TIMEOUT
+from neewerlight.planner import planTransition
+from neewerlight.trace import TraceRecorder, playTrace
+
+SLOTS = 5
+
+
+def test_trace_with_more_lights_than_slots(adapter, profile, tmp_path):
+	connections = ConnectionManager(maxConnections=SLOTS)
+	lights = makeLights(adapter, SLOTS + 3, connectionManager=connections)
+	recorder = TraceRecorder()
+	for light in lights:
+		recorder.addPlan(light.address, planTransition((255, 0, 0), 20, (0, 80, 255), 255, 1.0))
+	path = tmp_path / "show.nltr"
+	recorder.save(path)
+
+	async def scenario():
+		start = time.monotonic()
+		stats = await playTrace(path, lights)
+		await connections.stop()
+		return time.monotonic() - start, stats
+
+	duration, stats = asyncio.run(scenario())
+	assert stats["completed"]
+	assert stats["failed"] == 0
+	assert duration < 1.0 + HOLD_SLOT_TIMEOUT + 4 * profile.connectLatency
+	played = [light for light in lights if adapter.devices[light.address.upper()].received]
+	assert len(played) == SLOTS
+
+
+def test_replayed_half_white_packets_keep_an_unsent_switch_to_white(adapter):
+	light, = makeLights(adapter, 1)
+	device = adapter.devices[light.address.upper()]
+
+	async def scenario():
+		await light.connect()
+		power = light.queue_packet(codec.POWER_ON) # on air while the rest queue behind it
+		writes = [light.queue_packet(codec.encodeCct(80, 32)), light.queue_packet(codec.encodeBrightness(40)),
+				  light.queue_packet(codec.encodeColourTemp(56))]
+		await asyncio.gather(power, *writes)
+
+	asyncio.run(scenario())
+	assert [packet for _, packet in device.received] == [codec.POWER_ON, codec.encodeCct(40, 56)]
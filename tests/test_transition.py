@@ -0,0 +1,101 @@
+"""TransitionController: fades are cancelled by newer commands and start promptly"""
+import asyncio
+import time
+
+from conftest import makeLights
+
+from neewerlight.planner import planTransition
+from neewerlight.transition import TransitionController
+
+FADE_FROM = ((255, 0, 0), 20)
+FADE_TO = ((0, 80, 255), 255)
+
+
+def fade(light, duration=2.0):
+	return planTransition(light.rgb_color, light.brightness, FADE_TO[0], FADE_TO[1], duration)
+
+
+def test_new_command_cancels_running_fade(adapter):
+	light, = makeLights(adapter, 1)
+	device = adapter.devices[light.address.upper()]
+	controller = TransitionController(light)
+
+	async def scenario():
+		await light.connect()
+		light.assume_color(*FADE_FROM)
+		task = await controller.start(lambda: fade(light))
+		await asyncio.sleep(0.3)
+		await controller.stop()
+		stopped = len(device.received)
+		await light.set_color((0, 255, 0), 255)
+		await asyncio.sleep(0.3)
+		return task, stopped
+
+	task, stopped = asyncio.run(scenario())
+	assert task.cancelled()
+	assert not controller.isRunning
+	# only the immediate colour arrived after the fade was stopped
+	assert len(device.received) == stopped + 1
+	assert light.rgb_color == (0, 255, 0)
+
+
+def test_new_fade_replaces_running_one(adapter):
+	light, = makeLights(adapter, 1)
+	controller = TransitionController(light)
+
+	async def scenario():
+		await light.connect()
+		light.assume_color(*FADE_FROM)
+		first = await controller.start(lambda: fade(light))
+		await asyncio.sleep(0.2)
+		second = await controller.start(lambda: fade(light, 0.3))
+		await second
+		return first, second
+
+	first, second = asyncio.run(scenario())
+	assert first.cancelled()
+	assert second.result()["completed"]
+	assert light.rgb_color == FADE_TO[0]
+
+
+def test_first_packet_time_is_bounded(adapter, profile):
+	light, = makeLights(adapter, 1)
+	device = adapter.devices[light.address.upper()]
+	controller = TransitionController(light)
+	# the first frame is planned one frame in, and may wait behind one write of the old fade
+	bound = 0.040 + 2 * (profile.writeLatency + profile.jitter) + 0.02
+
+	async def scenario():
+		await light.connect()
+		light.assume_color(*FADE_FROM)
+		delays = []
+		for step in range(10):
+			# a slider being dragged: each fade replaces the last one mid flight
+			seen = len(device.received)
+			issued = time.monotonic()
+			await controller.start(lambda: planTransition(light.rgb_color, light.brightness, (step * 25, 0, 255), 255, 1.0))
+			while len(device.received) == seen:
+				await asyncio.sleep(0.001)
+			delays.append(device.received[seen][0] - issued)
+			await asyncio.sleep(0.1)
+		await controller.stop()
+		return delays
+
+	delays = asyncio.run(scenario())
+	assert max(delays) < bound
+	assert adapter.stats["maxWritesInFlightPerLight"] == 1
+
+
+def test_planning_errors_end_the_transition(adapter, caplog):
+	light, = makeLights(adapter, 1)
+	controller = TransitionController(light)
+
+	def badPlan():
+		raise ValueError("bad plan")
+
+	async def scenario():
+		task = await controller.start(badPlan)
+		return await task
+
+	assert asyncio.run(scenario()) is None
+	assert "bad plan" in caplog.text
@@ -0,0 +1,283 @@
+"""Compact binary traces of the packets sent to lights, and timed replay of them
+
+A trace is recorded once (from lights as they are driven, or straight from planned transitions) and can then be
+replayed any number of times without recomputing a single colour: playback memory-maps the file and hands the stored
+packets to the lights at their recorded times.
+
+Format, all little endian:
+  header  "NLTR", version (uint16), light count (uint16)
+  lights  per light: address length (uint8), address (utf-8). A record's light index points into this table
+  records time in TRACE_TIME_UNIT ticks since the start (uint32), light index (uint8), packet length (uint8), packet
+Records are sorted by time."""
+from contextlib import AsyncExitStack
+from functools import partial
+from typing import Dict, List
+import asyncio
+import logging
+import mmap
+import os
+import struct
+import time
+
+from .connection import holdConnections
+
+LOGGER = logging.getLogger("NeewerLightTrace")
+LOGGER.setLevel(logging.WARN)
+
+TRACE_MAGIC = b"NLTR"
+TRACE_VERSION = 1
+TRACE_TIME_UNIT = 0.0001 # seconds per tick, a uint32 then covers ~119 hours
+TRACE_HEADER = struct.Struct("<4sHH")
+TRACE_ADDRESS = struct.Struct("<B")
+TRACE_RECORD = struct.Struct("<IBB")
+TRACE_MAX_LIGHTS = 256
+
+LATE_PACKET = 0.010 # seconds past its target time before a packet counts as late
+DISPATCH_WINDOW = 0.001 # packets due this soon are sent in the same wake-up rather than sleeping for each one
+WRITE_LATENCY_SMOOTHING = 0.25 # weight of the newest write in each light's running write latency estimate
+
+
+class TraceRecorder:
+    """Collects packets with their time and light, then saves them as a trace
+
+    Attach it to lights with NeewerLight.addRecorder to capture everything they send (the clock starts at the first
+    packet, or at start()), or add planned transitions directly with addPlan to build a show without any lights."""
+
+    def __init__(self):
+        self._addresses: Dict[str, int] = {} # upper case address -> light index
+        self._records = [] # (ticks, sequence, light index, packet)
+        self._start = None
+
+    def start(self):
+        """Restart the recording clock, packets recorded live are timed from here"""
+        self._start = time.monotonic()
+
+    def lightIndex(self, address) -> int:
+        address = str(address).upper()
+        if address not in self._addresses:
+            if len(self._addresses) >= TRACE_MAX_LIGHTS:
+                raise ValueError("A trace can hold at most %d lights" % TRACE_MAX_LIGHTS)
+            self._addresses[address] = len(self._addresses)
+        return self._addresses[address]
+
+    def record(self, address, packet, at=None):
+        """Add one packet, at seconds after the start (default now)"""
+        if at is None:
+            if self._start is None:
+                self.start()
+            at = time.monotonic() - self._start
+        self._records.append((int(round(at / TRACE_TIME_UNIT)), len(self._records), self.lightIndex(address), bytes(packet)))
+
+    def addPlan(self, address, plan, offset=0.0):
+        """Add every frame of a planner.TransitionPlan, starting offset seconds into the trace"""
+        for frame in plan:
+            self.record(address, frame.packet, offset + frame.time)
+
+    def __len__(self):
+        return len(self._records)
+
+    @property
+    def duration(self):
+        return max((record[0] for record in self._records), default=0) * TRACE_TIME_UNIT
+
+    def save(self, path):
+        """Write the trace, replacing path atomically"""
+        addresses = sorted(self._addresses, key=self._addresses.get)
+        chunks = [TRACE_HEADER.pack(TRACE_MAGIC, TRACE_VERSION, len(addresses))]
+        for address in addresses:
+            encoded = address.encode()
+            chunks.append(TRACE_ADDRESS.pack(len(encoded)) + encoded)
+        for ticks, _, lightIndex, packet in sorted(self._records):
+            chunks.append(TRACE_RECORD.pack(ticks, lightIndex, len(packet)) + packet)
+        temporary = str(path) + ".tmp"
+        with open(temporary, "wb") as file:
+            file.write(b"".join(chunks))
+        os.replace(temporary, path)
+        LOGGER.info("Saved %d packets for %d lights to %s", len(self._records), len(addresses), path)
+
+
+class TraceReader:
+    """A memory-mapped trace. Iterating yields (seconds, light index, packet) straight from the mapped file"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, lightCount = TRACE_HEADER.unpack_from(self._map, 0)
+            if magic != TRACE_MAGIC or version != TRACE_VERSION:
+                raise ValueError("%s is not a version %d Neewer trace" % (path, TRACE_VERSION))
+            offset = TRACE_HEADER.size
+            self.addresses: List[str] = []
+            for _ in range(lightCount):
+                length, = TRACE_ADDRESS.unpack_from(self._map, offset)
+                offset += TRACE_ADDRESS.size
+                self.addresses.append(self._map[offset:offset + length].decode())
+                offset += length
+        except (struct.error, UnicodeDecodeError) as error:
+            self.close()
+            raise ValueError("%s is not a valid Neewer trace: %s" % (path, error)) from None
+        except ValueError:
+            self.close()
+            raise
+        self._recordsStart = offset
+
+    def __iter__(self):
+        data = self._map
+        unpack = TRACE_RECORD.unpack_from
+        headerSize = TRACE_RECORD.size
+        offset = self._recordsStart
+        end = len(data)
+        while offset < end:
+            ticks, lightIndex, length = unpack(data, offset)
+            offset += headerSize
+            yield ticks * TRACE_TIME_UNIT, lightIndex, data[offset:offset + length]
+            offset += length
+
+    @property
+    def duration(self):
+        lastTime = 0.0
+        for lastTime, _, _ in self:
+            pass
+        return lastTime
+
+    def close(self):
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class TracePlayer:
+    """Streams a trace to the lights on one monotonic timeline
+
+    Every packet is scheduled against its absolute time since the start, so a late wake-up never pushes the rest of
+    the show back, and is issued early by that light's measured write latency so it lands when it was recorded. A light
+    still busy with its previous write has its queued colour replaced by the newer one (the normal latest-value-wins
+    queue), power and scene packets are always sent.
+
+    lights is either {trace address: NeewerLight} or NeewerLights matched to the trace by address. Like
+    transition.GroupTransition it has finished(light) and remove(light), so TransitionController.joinPlayback can
+    hand lights to it and a new command for a light drops it from the show."""
+
+    def __init__(self, trace: TraceReader, lights, timeScale=1.0):
+        if not isinstance(lights, dict):
+            lights = {light.address: light for light in lights}
+        lights = {str(address).upper(): light for address, light in lights.items()}
+        self.trace = trace
+        self.timeScale = timeScale # 2.0 plays the show at half speed
+        self._targets = [lights.get(address.upper()) for address in trace.addresses]
+        self._done = {id(light): asyncio.get_event_loop().create_future() for light in self._targets if light is not None}
+        self._writes = [None] * len(self._targets)
+        self.stats = {"packets": 0, "sent": 0, "coalesced": 0, "failed": 0, "late": 0, "maxLateness": 0.0, "completed": False}
+
+    @property
+    def lights(self):
+        return [light for light in self._targets if light is not None]
+
+    def finished(self, light) -> asyncio.Future:
+        """Resolves True once the last packet for the light has been sent, False if it was dropped"""
+        return self._done[id(light)]
+
+    def remove(self, light):
+        """Stop sending to a light straight away, abandoning its in-flight packet"""
+        for index, target in enumerate(self._targets):
+            if target is light:
+                self._targets[index] = None
+                if self._writes[index] is not None and not self._writes[index].done():
+                    self._writes[index].cancel()
+        future = self._done.get(id(light))
+        if future is not None and not future.done():
+            future.set_result(False)
+
+    async def run(self):
+        targets = self._targets
+        writeLatency = [(light.metrics.write.percentile(50) or 0.0) if light is not None else 0.0 for light in targets]
+        lastPackets = [{} for _ in targets] # opcode -> latest packet, in the order they were last sent
+        packets = [0] * len(targets)
+        timeScale = self.timeScale
+        stats = self.stats
+        start = time.monotonic()
+
+        def writeDone(index, issued, write):
+            if write.cancelled():
+                return
+            if write.exception() is not None:
+                stats["failed"] += 1
+                LOGGER.warning("Trace write failed: %s", write.exception())
+            elif write.result() is False:
+                stats["coalesced"] += 1
+            else:
+                writeLatency[index] += (time.monotonic() - issued - writeLatency[index]) * WRITE_LATENCY_SMOOTHING
+
+        for at, index, packet in self.trace:
+            light = targets[index]
+            if light is None:
+                continue
+            due = start + at * timeScale - writeLatency[index]
+            waitTime = due - time.monotonic()
+            if waitTime > DISPATCH_WINDOW:
+                await asyncio.sleep(waitTime)
+                light = targets[index] # it may have been removed while waiting
+                if light is None:
+                    continue
+            issued = time.monotonic()
+            lateness = issued - due
+            if lateness > LATE_PACKET:
+                stats["late"] += 1
+                stats["maxLateness"] = max(stats["maxLateness"], lateness)
+            light.metrics.frameLateness.record(max(lateness, 0.0))
+
+            try:
+                write = light.queue_packet(packet)
+            except Exception as error:
+                stats["failed"] += 1
+                LOGGER.warning("Trace write failed: %s", error)
+                continue
+            write.add_done_callback(partial(writeDone, index, issued))
+            self._writes[index] = write
+            stats["packets"] += 1
+            packets[index] += 1
+            opcode = packet[1]
+            lastPackets[index].pop(opcode, None)
+            lastPackets[index][opcode] = packet
+
+        writes = [write for write in self._writes if write is not None]
+        if writes:
+            await asyncio.gather(*writes, return_exceptions=True)
+        duration = time.monotonic() - start
+        stats["sent"] = stats["packets"] - stats["coalesced"] - stats["failed"]
+        stats["duration"] = duration
+        stats["completed"] = True
+        for index, light in enumerate(targets):
+            if light is None:
+                continue
+            # the cached state is only brought up to date once, from the last packet of each kind the light was sent
+            for packet in lastPackets[index].values():
+                light.assume_packet(packet)
+            light.metrics.recordTransition(packets[index], duration)
+            if not self._done[id(light)].done():
+                self._done[id(light)].set_result(True)
+        LOGGER.info("Played %s in %.3fs: %s", self.trace.path, duration, stats)
+        return stats
+
+
+async def playHeld(player: TracePlayer):
+    """Run a player with its lights held connected throughout. Only as many lights as there are connection slots are
+    held, the rest are dropped from the show rather than holding it up waiting for a slot"""
+    async with AsyncExitStack() as stack:
+        held = await holdConnections(stack, player.lights)
+        for light in player.lights:
+            if light not in held:
+                LOGGER.warning("No connection slot for %s, leaving it out of %s", light.mac, player.trace.path)
+                player.remove(light)
+        return await player.run()
+
+
+async def playTrace(path, lights, timeScale=1.0):
+    """Play a trace file to the lights (see TracePlayer and playHeld)"""
+    with TraceReader(path) as trace:
+        return await playHeld(TracePlayer(trace, lights, timeScale))
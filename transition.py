@@ -0,0 +1,326 @@
+from contextlib import AsyncExitStack
+from typing import Callable, List, Optional
+import asyncio
+import logging
+import time
+
+from .NeewerLight import NeewerLight
+from .connection import holdConnections
+from .planner import TransitionFrame, TransitionPlan
+
+LOGGER = logging.getLogger("NeewerLightTransition")
+LOGGER.setLevel(logging.WARN)
+
+LATE_FRAME = 0.010 # seconds past its target time before a frame counts as a missed deadline
+WRITE_LATENCY_SMOOTHING = 0.25 # weight of the newest write in the running write latency estimate
+
+
+async def playTransition(light: NeewerLight, plan: TransitionPlan, isCancelled: Callable[[], bool] = lambda: False):
+    """Plays one light's planned transition against a monotonic deadline. Returns timing stats for the run
+
+    Every tick sends the frame for the time its write will land, rather than the next one in line. Writes are issued
+    early by the light's measured write latency, so slow writes skip frames instead of stretching the transition and the
+    last frame lands at the planned end. On a link slower than msPerFrame the effective frame interval becomes the
+    write latency."""
+    stats = {"planned": plan.plannedFrames, "sent": 0, "skipped": 0, "late": 0, "maxLateness": 0.0, "completed": False}
+    writeLatency = light.metrics.write.percentile(50) or 0.0
+    startTime = time.monotonic()
+    try:
+        await _playFrames(light, plan, isCancelled, stats, startTime, writeLatency)
+    finally:
+        # also recorded when the task is cancelled by a newer command
+        stats["duration"] = time.monotonic() - startTime
+        light.metrics.recordTransition(stats["sent"], stats["duration"], late=stats["late"], dropped=stats["skipped"])
+    return stats
+
+
+async def _playFrames(light: NeewerLight, plan: TransitionPlan, isCancelled, stats, startTime, writeLatency):
+    lastIndex = len(plan) - 1
+    sentIndex = -1
+    written = True
+    while sentIndex < lastIndex:
+        if isCancelled() or not light.available:
+            break
+        writeStart = time.monotonic()
+        landing = writeStart - startTime + writeLatency
+        index = plan.indexAt(landing)
+        if index < lastIndex and landing + writeLatency - plan.duration > plan.duration - landing:
+            # there's no time left for another frame before this one, so land the final colour as close to the end
+            # as possible instead of running over with one more write
+            index = lastIndex
+        if index > sentIndex:
+            frame = plan[index]
+            stats["skipped"] += index - sentIndex - 1
+            written = await plan.sendFrame(light, frame)
+            landed = time.monotonic()
+            writeLatency += (landed - writeStart - writeLatency) * WRITE_LATENCY_SMOOTHING
+            sentIndex = index
+            stats["sent"] += 1
+
+            lateness = landed - startTime - frame.time
+            light.metrics.frameLateness.record(max(lateness, 0.0))
+            if lateness > LATE_FRAME:
+                stats["late"] += 1
+                stats["maxLateness"] = max(stats["maxLateness"], lateness)
+            if sentIndex == lastIndex:
+                break
+
+        # wake up in time for the next frame to land when it's due
+        waitTime = plan[sentIndex + 1].time - writeLatency - (time.monotonic() - startTime)
+        if waitTime > 0:
+            await asyncio.sleep(waitTime)
+
+    if sentIndex == lastIndex and written:
+        # nothing more is sent, but the last frames may have been dropped as duplicates of what is already showing.
+        # If a newer command replaced the last frame instead, the light shows that and not the plan's end
+        plan.assumeEnd(light)
+        stats["completed"] = True
+
+
+class _GroupMember:
+    def __init__(self, light: NeewerLight, plan: TransitionPlan, isCancelled: Callable[[], bool], onCancelled: Optional[Callable[[], None]]):
+        self.light = light
+        self.plan = plan
+        self.frames: List[TransitionFrame] = list(plan)
+        self._isCancelled = isCancelled
+        self._onCancelled = onCancelled
+        self.cancelled = False
+        self.deferred = False # left off the timeline, sent straight to its last frame afterwards
+        self.nextFrame = 0
+        self.waitingFrame: Optional[TransitionFrame] = None # due, but the light was still busy with the last write
+        self.write: Optional[asyncio.Future] = None
+        self.sent = 0
+        self.skipped = 0
+        self.done = asyncio.get_event_loop().create_future() # resolved when the group has finished with this light
+
+    def isCancelled(self):
+        if not self.cancelled and self._isCancelled():
+            self.cancelled = True
+            if self._onCancelled is not None:
+                self._onCancelled()
+        return self.cancelled
+
+    @property
+    def finished(self):
+        return self.nextFrame >= len(self.frames) and self.waitingFrame is None
+
+    @property
+    def busy(self):
+        return self.write is not None and not self.write.done()
+
+    @property
+    def landed(self):
+        """The last frame was sent rather than replaced or abandoned, so the light is showing the plan's end"""
+        if not self.frames:
+            return True
+        write = self.write
+        return (self.finished and write is not None and write.done() and not write.cancelled() and write.exception() is None
+                and write.result() is True)
+
+
+class GroupTransition:
+    """Plays the transitions of several lights on one shared monotonic timeline from a single timer
+
+    Every tick sends the latest due frame of each light concurrently. A light whose previous write hasn't completed
+    yet skips frames until it catches up, so one slow light never stretches the timeline for the others."""
+
+    def __init__(self, msPerFrame=40):
+        self.msPerFrame = msPerFrame
+        self._members: List[_GroupMember] = []
+        self.stats = {"ticks": 0, "sent": 0, "skipped": 0, "failed": 0, "deferred": 0}
+
+    def add(self, light: NeewerLight, plan: TransitionPlan, isCancelled: Callable[[], bool] = lambda: False, onCancelled: Optional[Callable[[], None]] = None):
+        """isCancelled is checked every tick, once it returns True the light is dropped and onCancelled is called"""
+        self._members.append(_GroupMember(light, plan, isCancelled, onCancelled))
+
+    def __len__(self):
+        return len(self._members)
+
+    @property
+    def lights(self):
+        return [member.light for member in self._members]
+
+    def _member(self, light: NeewerLight) -> Optional[_GroupMember]:
+        return next((member for member in self._members if member.light is light), None)
+
+    def remove(self, light: NeewerLight):
+        """Drop a light from the group straight away. Its frame still queued on the light is abandoned rather than sent
+        after whatever replaced the group, one already on air can't be"""
+        member = self._member(light)
+        if member is None or member.cancelled:
+            return
+        member.cancelled = True
+        if member.busy:
+            member.write.cancel()
+        if not member.done.done():
+            member.done.set_result(False)
+
+    def finished(self, light: NeewerLight) -> asyncio.Future:
+        """Resolves True once the group has played the light's last frame, False if it was dropped"""
+        return self._member(light).done
+
+    def defer(self, light: NeewerLight):
+        """Leave a light off the shared timeline (e.g. it has no connection slot), finishDeferred() then sends it
+        straight to its last frame"""
+        member = self._member(light)
+        if not member.deferred:
+            member.deferred = True
+            self.stats["deferred"] += 1
+
+    async def finishDeferred(self):
+        """Send every deferred light still in the group its last frame"""
+        async def finish(member):
+            try:
+                written = True
+                if member.frames:
+                    written = await member.plan.sendFrame(member.light, member.frames[-1])
+                    member.sent += 1
+                if written:
+                    member.plan.assumeEnd(member.light)
+            except Exception as error:
+                self.stats["failed"] += 1
+                LOGGER.warning("Group transition write failed: %s", error)
+            if not member.done.done():
+                member.done.set_result(not member.cancelled)
+
+        await asyncio.gather(*[finish(member) for member in self._members if member.deferred and not member.isCancelled()])
+
+    def _send(self, member: _GroupMember, frame: TransitionFrame):
+        member.write = asyncio.ensure_future(member.plan.sendFrame(member.light, frame))
+        member.write.add_done_callback(self._writeDone)
+        member.sent += 1
+        self.stats["sent"] += 1
+
+    def _writeDone(self, write: asyncio.Future):
+        if not write.cancelled() and write.exception() is not None:
+            self.stats["failed"] += 1
+            LOGGER.warning("Group transition write failed: %s", write.exception())
+
+    def _tick(self, elapsed):
+        for member in self._members:
+            if member.deferred or member.finished or member.isCancelled():
+                continue
+            due = member.waitingFrame
+            while member.nextFrame < len(member.frames) and member.frames[member.nextFrame].time <= elapsed:
+                if due is not None:
+                    member.skipped += 1
+                    self.stats["skipped"] += 1
+                due = member.frames[member.nextFrame]
+                member.nextFrame += 1
+            if due is None:
+                continue
+            if member.busy:
+                member.waitingFrame = due
+            else:
+                member.waitingFrame = None
+                self._send(member, due)
+
+    async def run(self):
+        frameTime = self.msPerFrame / 1000
+        start = time.monotonic()
+        tick = 0
+        while True:
+            self._tick(time.monotonic() - start)
+            self.stats["ticks"] += 1
+            remaining = [member for member in self._members if not member.deferred and not member.finished and not member.isCancelled()]
+            if not remaining:
+                break
+            # the next tick is always on the shared grid, ticks that have already passed are skipped rather than run late
+            tick = max(tick + 1, int((time.monotonic() - start) / frameTime) + 1)
+            await asyncio.sleep(max(start + tick * frameTime - time.monotonic(), 0))
+
+        writes = [member.write for member in self._members if member.write is not None]
+        if writes:
+            await asyncio.gather(*writes, return_exceptions=True)
+        duration = time.monotonic() - start
+        for member in self._members:
+            if member.deferred:
+                continue
+            member.light.metrics.recordTransition(member.sent, duration, dropped=member.skipped)
+            if not member.isCancelled() and member.landed:
+                member.plan.assumeEnd(member.light)
+            if not member.done.done():
+                member.done.set_result(not member.cancelled)
+        LOGGER.info("Group transition of %d lights finished: %s", len(self._members), self.stats)
+        return self.stats
+
+    def isRunning(self, light: NeewerLight):
+        """False once the light has been dropped from the group"""
+        return any(member.light is light and not member.cancelled for member in self._members)
+
+
+async def playGroup(group: GroupTransition):
+    """Run a group transition with its lights held connected, so connects don't eat into the shared timeline. Only as
+    many lights as there are connection slots are held, the rest are deferred: set straight to their last frame once the
+    fade is over and slots are free again"""
+    async with AsyncExitStack() as stack:
+        held = await holdConnections(stack, group.lights)
+        for light in group.lights:
+            if light not in held:
+                LOGGER.info("No connection slot for %s, it will go straight to the end of the group transition", light.mac)
+                group.defer(light)
+        stats = await group.run()
+    await group.finishDeferred()
+    return stats
+
+
+class TransitionController:
+    """Owns the one transition task a light may have running
+
+    Starting a transition (or stop()ing before an immediate command) cancels the running one and waits for it to exit,
+    so a new command takes effect straight away rather than at the old loop's next frame, and two transitions never
+    write to the same light at once."""
+
+    def __init__(self, light: NeewerLight):
+        self.light = light
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def isRunning(self):
+        return self._task is not None and not self._task.done()
+
+    async def stop(self):
+        task, self._task = self._task, None
+        if task is None or task.done():
+            return
+        task.cancel()
+        # the cancelled task always exits at its next await, i.e. within the write it's waiting on
+        await asyncio.wait([task])
+
+    async def start(self, makePlan: Callable[[], TransitionPlan]) -> asyncio.Task:
+        """Replace any running transition with the plan makePlan() returns. makePlan is only called once the old
+        transition has stopped, so it plans from the colour the light has actually reached"""
+        await self.stop()
+        self._task = asyncio.ensure_future(self._play(makePlan))
+        return self._task
+
+    async def _play(self, makePlan):
+        try:
+            plan = makePlan()
+            LOGGER.debug("Planned %d writes for %d frames", len(plan), plan.plannedFrames)
+            async with self.light.keepConnected():
+                stats = await playTransition(self.light, plan)
+            LOGGER.info("Finished transition: %s", stats)
+            return stats
+        except Exception as error:
+            # nothing awaits this task, so the exception would otherwise never be retrieved
+            LOGGER.warning("Transition of %s failed: %s", self.light.mac, error)
+
+    async def joinGroup(self, group: GroupTransition, plan: TransitionPlan):
+        """Hand the light to a group transition. Cancelling the transition (by stop() or start()) removes it from the
+        group immediately"""
+        await self.stop()
+        group.add(self.light, plan)
+        self._task = asyncio.ensure_future(self._awaitGroup(group))
+
+    async def joinPlayback(self, player):
+        """Hand the light to a trace.TracePlayer that already includes it. Like joinGroup, a new command for the light
+        drops it from the playback"""
+        await self.stop()
+        self._task = asyncio.ensure_future(self._awaitGroup(player))
+
+    async def _awaitGroup(self, group):
+        try:
+            await asyncio.shield(group.finished(self.light))
+        finally:
+            group.remove(self.light)
@@ -0,0 +1,107 @@
+"""An optional thread with its own event loop for the Bluetooth I/O and transition timing of lights
+
+Lights set up on a BleWorker are created, driven and polled entirely on the worker's loop (along with the connection
+pool, discovery and poller they share, kept in BleWorker.data), so a stalled BlueZ call or a burst of notifications
+doesn't hold up Home Assistant, and a busy Home Assistant loop doesn't hold up transition frames.
+
+The channel between the two is deliberately small: commands go to the worker as coroutines (run), state changes come
+back as callbacks scheduled on the caller's loop (threadsafe), and the lights' cached state is read directly, as every
+field is replaced whole rather than modified in place."""
+from concurrent.futures import Future
+from typing import Callable
+import asyncio
+import logging
+import threading
+
+LOGGER = logging.getLogger("NeewerLightWorker")
+LOGGER.setLevel(logging.WARN)
+
+WORKER_THREAD_NAME = "NeewerLightBLE"
+STOP_TIMEOUT = 5.0 # seconds to wait for the worker's tasks to wind down
+
+
+class BleWorker:
+    """A daemon thread running an event loop for lights"""
+
+    def __init__(self, name=WORKER_THREAD_NAME):
+        self.name = name
+        self.loop = None
+        self.data = {} # services shared by the worker's lights, keyed like hass.data
+        self.lights = set() # the lights that live on this worker
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(ready,), name=self.name, daemon=True)
+        self._thread.start()
+        ready.wait()
+        LOGGER.debug("Started %s", self.name)
+
+    def _run(self, ready):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self.loop = loop
+        ready.set()
+        try:
+            loop.run_forever()
+        finally:
+            tasks = asyncio.all_tasks(loop)
+            for task in tasks:
+                task.cancel()
+            loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            loop.run_until_complete(loop.shutdown_asyncgens())
+            loop.close()
+
+    def inWorker(self):
+        return self._thread is not None and threading.current_thread() is self._thread
+
+    def submit(self, coroutine) -> Future:
+        """Start a coroutine on the worker's loop from any thread"""
+        if not self.running:
+            coroutine.close()
+            raise RuntimeError(self.name+" is not running")
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    async def run(self, coroutine):
+        """Run a coroutine on the worker's loop and wait for its result on the caller's loop. Cancelling the caller
+        cancels it in the worker"""
+        if self.inWorker():
+            return await coroutine
+        return await asyncio.wrap_future(self.submit(coroutine))
+
+    async def call(self, function: Callable, *args, **kwargs):
+        """Run a plain function on the worker's loop, for anything that touches the loop's tasks or events"""
+        async def call():
+            return function(*args, **kwargs)
+        return await self.run(call())
+
+    async def stop(self):
+        if not self.running:
+            return
+        thread = self._thread
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        await asyncio.get_event_loop().run_in_executor(None, thread.join, STOP_TIMEOUT)
+        if thread.is_alive():
+            LOGGER.warning("%s didn't stop within %ss", self.name, STOP_TIMEOUT)
+        self._thread = None
+        self.loop = None
+
+
+def threadsafe(loop, callback: Callable) -> Callable:
+    """callback, callable from any thread: from another thread it's scheduled on loop instead of called directly"""
+    def call(*args):
+        try:
+            current = asyncio.get_running_loop()
+        except RuntimeError:
+            current = None
+        if current is loop:
+            callback(*args)
+        else:
+            loop.call_soon_threadsafe(callback, *args)
+    return call